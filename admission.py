@@ -0,0 +1,186 @@
+import asyncio
+from collections import OrderedDict, deque
+
+# api_providers 表中的并发限制字段，NULL 表示使用 ADMISSION_CONFIG 中的默认值
+PROVIDER_LIMIT_FIELDS = ("max_concurrency", "max_queue")
+
+
+class AdmissionRejected(Exception):
+    # 队列已满或排队超时，调用方应立即告知用户稍后重试
+    pass
+
+
+class Ticket:
+    __slots__ = ("gate", "user_id", "state", "_future")
+
+    def __init__(self, gate, user_id):
+        self.gate = gate
+        self.user_id = user_id
+        self.state = "waiting"   # waiting -> active -> done
+        self._future = None
+
+    @property
+    def admitted(self):
+        return self.state == "active"
+
+    async def positions(self, interval=1.0, timeout=None):
+        # 排队期间每隔 interval 秒检查一次排队位置（从 1 开始），变化时产出；
+        # 轮到时结束，超过 timeout 秒仍未轮到则抛出 AdmissionRejected
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        last = None
+        while self.state == "waiting":
+            position = self.gate.position(self)
+            if position != last:
+                yield position
+                last = position
+            wait = interval
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise AdmissionRejected("排队超时，请稍后重试")
+                wait = min(wait, remaining)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._future), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        # 请求结束、出错或客户端断开时调用，可重复调用
+        self.gate.release(self)
+
+
+class ProviderGate:
+    # 单个服务商的准入控制：最多 max_concurrency 个请求同时调用上游，其余排队。
+    # 排队按用户分组轮转（round-robin），每次空出位置时轮到下一个用户，
+    # 同一用户开再多的标签页也只能与其他用户交替获得位置。
+    def __init__(self, max_concurrency, max_queue, max_queue_per_user):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.active = 0
+        self.waiting = 0
+        # user_id -> 该用户的排队请求；顺序即轮转顺序，第一个用户下一个获得位置
+        self._queues = OrderedDict()
+        self.admitted_total = 0
+        self.rejected_total = 0
+
+    def configure(self, max_concurrency, max_queue, max_queue_per_user):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        # 调大并发数时立即放行排队中的请求
+        self._dispatch()
+
+    def try_acquire(self, user_id):
+        # 有空闲名额且无人排队时立即获得，否则返回 None（不排队）
+        if self.active >= self.max_concurrency or self._queues:
+            return None
+        ticket = Ticket(self, user_id)
+        ticket.state = "active"
+        self.active += 1
+        self.admitted_total += 1
+        return ticket
+
+    def acquire(self, user_id):
+        ticket = self.try_acquire(user_id)
+        if ticket is not None:
+            return ticket
+        ticket = Ticket(self, user_id)
+        queue = self._queues.get(user_id)
+        if self.waiting >= self.max_queue or (queue is not None and len(queue) >= self.max_queue_per_user):
+            self.rejected_total += 1
+            raise AdmissionRejected("当前请求过多，请稍后重试")
+        ticket._future = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+        queue.append(ticket)
+        self.waiting += 1
+        return ticket
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self.waiting -= 1
+            self.active += 1
+            self.admitted_total += 1
+            ticket.state = "active"
+            ticket._future.set_result(True)
+
+    def release(self, ticket):
+        if ticket.state == "active":
+            self.active -= 1
+            self._dispatch()
+        elif ticket.state == "waiting":
+            queue = self._queues[ticket.user_id]
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_id]
+            self.waiting -= 1
+        ticket.state = "done"
+
+    def position(self, ticket):
+        # 按轮转顺序计算前面还有多少个请求：该用户排在第 k 个时，
+        # 每个用户在前 k 轮中各有最多 k 个请求先获得位置，第 k 轮中排在该用户之前的用户再各有一个
+        if ticket.state != "waiting":
+            return 0
+        depth = self._queues[ticket.user_id].index(ticket)
+        ahead = 0
+        before_user = True
+        for user_id, queue in self._queues.items():
+            if user_id == ticket.user_id:
+                before_user = False
+                ahead += depth
+                continue
+            ahead += min(len(queue), depth)
+            if before_user and len(queue) > depth:
+                ahead += 1
+        return ahead + 1
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waiting_users": len(self._queues),
+            "admitted": self.admitted_total,
+            "rejected": self.rejected_total,
+        }
+
+
+class AdmissionController:
+    # 按服务商（api_providers.id）分别准入，限制取自路由表中的服务商配置
+    def __init__(self, defaults):
+        self._defaults = dict(defaults)
+        self._gates = {}
+
+    def limits_for(self, provider):
+        max_concurrency = provider.get("max_concurrency") or self._defaults["max_concurrency"]
+        max_queue = provider.get("max_queue")
+        if max_queue is None:
+            max_queue = self._defaults["max_queue"]
+        return max_concurrency, max_queue, self._defaults["max_queue_per_user"]
+
+    def _gate(self, provider_id, provider):
+        limits = self.limits_for(provider)
+        gate = self._gates.get(provider_id)
+        if gate is None:
+            gate = self._gates[provider_id] = ProviderGate(*limits)
+        elif (gate.max_concurrency, gate.max_queue, gate.max_queue_per_user) != limits:
+            gate.configure(*limits)
+        return gate
+
+    def acquire(self, provider_id, provider, user_id):
+        return self._gate(provider_id, provider).acquire(user_id)
+
+    def try_acquire(self, provider_id, provider, user_id):
+        return self._gate(provider_id, provider).try_acquire(user_id)
+
+    def stats(self):
+        return {provider_id: gate.stats() for provider_id, gate in self._gates.items()}
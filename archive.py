@@ -0,0 +1,323 @@
+import json
+import uuid
+import zlib
+from datetime import datetime
+
+import pymysql.cursors
+
+from message_archive import message_table
+from usage import USER_COUNTS_SQL, user_counts
+
+# 对话的导出与导入。归档为 JSON Lines（每行一个 JSON 对象），可选 gzip 压缩：
+#   {"type": "session", "session_id", "title", "model_id", "preview", "message_count", "create_time", "update_time"}
+#   {"type": "message", "session_id", "role", "content", "create_time", "usage", "truncated"}
+#   usage 仅助手消息有：{"prompt_tokens", "completion_tokens"}；truncated 仅被中途停止的回复有，值为 true
+# 先输出所有会话，再按会话逐个输出消息（会话内按写入顺序）。导出和导入都是流式的，
+# 内存占用与消息数无关（导入时需要记录每个会话的 session_id 映射）。
+
+SESSION_EXPORT_SQL = (
+    "SELECT session_id, title, model_id, preview, message_count, create_time, update_time, user_id "
+    "FROM chat_sessions{where} ORDER BY id"
+)
+# 按会话主键分批：每批会话的消息从各自所在的表（消息表或归档表）按 (session_key, id) 索引顺序读取
+SESSION_BATCH_SQL = "SELECT id, session_id, archived FROM chat_sessions WHERE {where}id > %s ORDER BY id LIMIT %s"
+MESSAGE_EXPORT_SQL = (
+    "SELECT session_key, role, content, create_time, prompt_tokens, completion_tokens, truncated FROM {table} "
+    "WHERE session_key IN ({placeholders}) ORDER BY session_key, id"
+)
+
+
+class ArchiveError(ValueError):
+    # 归档内容格式错误，message 中包含行号
+    pass
+
+
+class ExportLimiter:
+    # 同时进行的导出数：每个导出在下载期间一直占用一个数据库连接，名额用完时直接拒绝而不是排队
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+
+    def try_acquire(self):
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+
+def _time(value):
+    return value.isoformat() if value is not None else None
+
+
+def _dumps(item):
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def _message_item(session_id, role, content, create_time, prompt_tokens, completion_tokens, truncated):
+    item = {"type": "message", "session_id": session_id, "role": role, "content": content, "create_time": _time(create_time)}
+    if prompt_tokens is not None:
+        item["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+    if truncated:
+        item["truncated"] = True
+    return item
+
+
+async def _stream_rows(conn, sql, args, fetch_size):
+    # 非缓冲游标（SSCursor）：结果集留在服务器端，每次只取 fetch_size 行，整个导出期间占用这条连接
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    finished = False
+    try:
+        await cursor.execute(sql, args)
+        while True:
+            rows = await cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+        finished = True
+    finally:
+        if finished:
+            await cursor.close()
+        else:
+            # 客户端中途断开或出错：关闭非缓冲游标需要读完剩余结果，直接废弃这条连接更快
+            conn.broken = True
+
+
+async def export_lines(conn, user_id=None, fetch_size=1000, include_user=False):
+    # 产出归档内容，每批为若干行拼接的字符串；user_id 为 None 时导出所有用户（管理员）
+    where, args = (" WHERE user_id = %s", (user_id,)) if user_id is not None else ("", ())
+    async for rows in _stream_rows(conn, SESSION_EXPORT_SQL.format(where=where), args, fetch_size):
+        lines = []
+        for session_id, title, model_id, preview, message_count, create_time, update_time, owner in rows:
+            item = {
+                "type": "session", "session_id": session_id, "title": title, "model_id": model_id,
+                "preview": preview, "message_count": message_count,
+                "create_time": _time(create_time), "update_time": _time(update_time),
+            }
+            if include_user:
+                item["user_id"] = owner
+            lines.append(_dumps(item))
+        yield "".join(lines)
+    last = 0
+    while True:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                SESSION_BATCH_SQL.format(where="user_id = %s AND " if user_id is not None else ""),
+                args + (last, fetch_size)
+            )
+            sessions = await cursor.fetchall()
+        if not sessions:
+            break
+        last = sessions[-1][0]
+        session_ids = {key: session_id for key, session_id, _ in sessions}
+        for archived in (0, 1):
+            keys = [key for key, _, flag in sessions if flag == archived]
+            if not keys:
+                continue
+            sql = MESSAGE_EXPORT_SQL.format(table=message_table(archived), placeholders=", ".join(["%s"] * len(keys)))
+            async for rows in _stream_rows(conn, sql, keys, fetch_size):
+                yield "".join(
+                    _dumps(_message_item(session_ids[key], *row))
+                    for key, *row in rows
+                )
+
+
+async def gzip_chunks(chunks, level=6):
+    # 逐块压缩为 gzip 格式
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def read_lines(upload, chunk_size=64 * 1024):
+    # 逐块读取上传的归档并按行产出，自动识别 gzip；压缩文件被截断时抛出 ArchiveError
+    decompressor = None
+    pending = b""
+    first = True
+    while True:
+        raw = await upload.read(chunk_size)
+        if first:
+            first = False
+            if raw[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(47)
+        chunk = raw
+        if decompressor is not None:
+            # 较小的块可能只够解出 gzip 头，解压结果为空不代表读完
+            chunk = decompressor.decompress(raw) if raw else decompressor.flush()
+        if chunk:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line
+        if not raw:
+            break
+    if decompressor is not None and not decompressor.eof:
+        raise ArchiveError("压缩文件不完整")
+    if pending:
+        yield pending
+
+
+def _parse_time(value, lineno):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ArchiveError(f"第 {lineno} 行时间格式错误")
+
+
+class ArchiveImporter:
+    # 批量导入归档：会话和消息各自攒够 batch_size 条后用一条多行 INSERT 写入并提交。
+    # user_id 为导入到的用户；为 None 时使用会话记录中的 user_id（管理员导入全部用户的归档）。
+    # keep_ids=False 时为每个会话生成新的 session_id（普通用户导入，避免与任何已有会话冲突）；
+    # keep_ids=True 时保留原 session_id（管理员迁移），已存在的会话连同其消息一起跳过。
+    def __init__(self, conn, user_id, batch_size=500, keep_ids=False):
+        self.conn = conn
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.keep_ids = keep_ids
+        self._sessions = []
+        self._messages = []
+        # 原 session_id -> (写入的 session_id, 所属用户)；跳过的会话映射为 None
+        self._ids = {}
+        # 写入的 session_id -> 会话主键（消息表的 session_key）
+        self._keys = {}
+        self.imported_sessions = 0
+        self.imported_messages = 0
+        self.skipped_sessions = 0
+        self.skipped_messages = 0
+
+    async def add_line(self, line, lineno):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            item = json.loads(line)
+            kind = item["type"]
+        except (ValueError, TypeError, KeyError):
+            raise ArchiveError(f"第 {lineno} 行不是有效的归档记录")
+        if kind == "session":
+            await self._add_session(item, lineno)
+        elif kind == "message":
+            await self._add_message(item, lineno)
+        else:
+            raise ArchiveError(f"第 {lineno} 行类型未知: {kind}")
+
+    async def _add_session(self, item, lineno):
+        original = item.get("session_id")
+        if not isinstance(original, str) or not item.get("model_id"):
+            raise ArchiveError(f"第 {lineno} 行会话缺少 session_id 或 model_id")
+        if original in self._ids:
+            raise ArchiveError(f"第 {lineno} 行会话重复: {original}")
+        owner = self.user_id
+        if owner is None:
+            owner = item.get("user_id")
+            if not isinstance(owner, int):
+                raise ArchiveError(f"第 {lineno} 行会话缺少 user_id")
+        session_id = original if self.keep_ids else str(uuid.uuid4())
+        self._ids[original] = (session_id, owner)
+        create_time = _parse_time(item.get("create_time"), lineno) or datetime.now()
+        preview = item.get("preview")
+        self._sessions.append((
+            session_id, owner, (item.get("title") or "新对话")[:200], preview[:60] if preview else None,
+            item["model_id"][:100], create_time, _parse_time(item.get("update_time"), lineno) or create_time,
+        ))
+        if len(self._sessions) >= self.batch_size:
+            await self._flush_sessions()
+
+    async def _add_message(self, item, lineno):
+        original = item.get("session_id")
+        if original not in self._ids:
+            raise ArchiveError(f"第 {lineno} 行消息所属的会话不在归档中（会话记录需要在消息之前）")
+        role, content = item.get("role"), item.get("content")
+        if role not in ("user", "assistant") or not isinstance(content, str):
+            raise ArchiveError(f"第 {lineno} 行消息格式错误")
+        if self._sessions:
+            # 消息引用会话（外键），先写入还在缓冲中的会话
+            await self._flush_sessions()
+        target = self._ids[original]
+        if target is None:
+            self.skipped_messages += 1
+            return
+        session_id, owner = target
+        # 助手消息的 token 用量，格式不对时忽略
+        usage = item.get("usage")
+        prompt_tokens = completion_tokens = None
+        if isinstance(usage, dict) and isinstance(usage.get("prompt_tokens"), int) and isinstance(usage.get("completion_tokens"), int):
+            prompt_tokens, completion_tokens = usage["prompt_tokens"], usage["completion_tokens"]
+        self._messages.append((
+            self._keys[session_id], owner, role, content, _parse_time(item.get("create_time"), lineno) or datetime.now(),
+            prompt_tokens, completion_tokens, int(item.get("truncated") is True)
+        ))
+        if len(self._messages) >= self.batch_size:
+            await self._flush_messages()
+
+    async def _flush_sessions(self):
+        batch, self._sessions = self._sessions, []
+        async with self.conn.cursor() as cursor:
+            if self.keep_ids:
+                placeholders = ", ".join(["%s"] * len(batch))
+                await cursor.execute(
+                    f"SELECT session_id FROM chat_sessions WHERE session_id IN ({placeholders})",
+                    [row[0] for row in batch]
+                )
+                existing = {row[0] for row in await cursor.fetchall()}
+                if existing:
+                    # keep_ids 时写入的 session_id 即原 session_id
+                    for session_id in existing:
+                        self._ids[session_id] = None
+                    self.skipped_sessions += len(existing)
+                    batch = [row for row in batch if row[0] not in existing]
+            if batch:
+                # pymysql 会把 INSERT ... VALUES 的 executemany 改写为多行插入
+                await cursor.executemany(
+                    "INSERT INTO chat_sessions (session_id, user_id, title, preview, model_id, create_time, update_time) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    batch
+                )
+                await cursor.execute(
+                    f"SELECT session_id, id FROM chat_sessions WHERE session_id IN ({', '.join(['%s'] * len(batch))})",
+                    [row[0] for row in batch]
+                )
+                self._keys.update(await cursor.fetchall())
+        await self.conn.commit()
+        self.imported_sessions += len(batch)
+
+    async def _flush_messages(self):
+        batch, self._messages = self._messages, []
+        counts = {}
+        for row in batch:
+            counts[row[0]] = counts.get(row[0], 0) + 1
+        async with self.conn.cursor() as cursor:
+            await cursor.executemany(
+                "INSERT INTO ai_chat_messages (session_key, user_id, role, content, create_time, prompt_tokens, completion_tokens, truncated) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                batch
+            )
+            # 消息数与消息在同一事务中更新，中途出错时已导入的部分也是一致的；
+            # update_time 保持归档中的值（该列默认 ON UPDATE 当前时间）
+            await cursor.executemany(
+                "UPDATE chat_sessions SET message_count = message_count + %s, update_time = update_time WHERE id = %s",
+                [(count, key) for key, count in counts.items()]
+            )
+            # 用户的消息计数同样增加；导入的历史消息不计入每日用量
+            await cursor.executemany(USER_COUNTS_SQL, user_counts([(row[1], row[2]) for row in batch]))
+        await self.conn.commit()
+        self.imported_messages += len(batch)
+
+    async def finish(self):
+        if self._sessions:
+            await self._flush_sessions()
+        if self._messages:
+            await self._flush_messages()
+        return {
+            "imported_sessions": self.imported_sessions,
+            "imported_messages": self.imported_messages,
+            "skipped_sessions": self.skipped_sessions,
+            "skipped_messages": self.skipped_messages,
+        }
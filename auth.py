@@ -0,0 +1,242 @@
+import logging
+import secrets
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# 登录会话：登录时签发随机令牌（放在 httponly 的 session_token cookie 中），令牌对应用户ID，有效期 session_ttl 秒。
+# 鉴权需要的用户记录（状态、是否管理员）缓存 user_ttl 秒，请求鉴权时不访问数据库；
+# 修改或删除用户时使缓存失效，禁用或删除用户时同时注销其全部会话。
+
+USER_AUTH_SQL = "SELECT id, status, is_admin FROM users WHERE id = %s"
+
+
+class AuthUser(NamedTuple):
+    id: int
+    status: int
+    is_admin: int
+
+
+class SessionStore:
+    # 进程内保存，重启后需要重新登录；只能单进程运行，多进程部署时使用 RedisSessionStore：
+    # 会话只在创建它的进程中有效，invalidate_user / revoke_user 也只作用于本进程
+    def __init__(self, db_pool, session_ttl=7 * 86400, user_ttl=60):
+        self.db_pool = db_pool
+        self.session_ttl = session_ttl
+        self.user_ttl = user_ttl
+        # 令牌 -> (用户ID, 过期时间)；用户ID -> 令牌集合；用户ID -> (AuthUser, 过期时间)
+        self._sessions = {}
+        self._user_sessions = {}
+        self._users = {}
+        # 每次 invalidate_user 加一；读取数据库期间有用户被修改时，读到的记录可能已过时，不写入缓存
+        self._generation = 0
+        self._prune_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def create(self, user_id, user=None):
+        # 签发令牌；user 为登录时刚查出的用户记录，直接放入缓存
+        now = time.monotonic()
+        if now >= self._prune_at:
+            self._prune(now)
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = (user_id, now + self.session_ttl)
+        self._user_sessions.setdefault(user_id, set()).add(token)
+        if user is not None:
+            self._users[user_id] = (user, now + self.user_ttl)
+        return token
+
+    def _prune(self, now):
+        # 每分钟清理一次过期的会话和用户记录
+        self._prune_at = now + 60
+        for token, (user_id, expires) in list(self._sessions.items()):
+            if expires <= now:
+                self._drop(token, user_id)
+        self._users = {user_id: entry for user_id, entry in self._users.items() if entry[1] > now}
+
+    def _drop(self, token, user_id):
+        self._sessions.pop(token, None)
+        tokens = self._user_sessions.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_sessions[user_id]
+
+    async def delete(self, token):
+        entry = self._sessions.get(token)
+        if entry is not None:
+            self._drop(token, entry[0])
+
+    async def _session_user(self, token):
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        user_id, expires = entry
+        if expires <= time.monotonic():
+            self._drop(token, user_id)
+            return None
+        return user_id
+
+    async def authenticate(self, token):
+        # 返回令牌对应的 AuthUser；令牌无效、已过期或用户已删除时返回 None
+        user_id = await self._session_user(token)
+        if user_id is None:
+            return None
+        user = await self.get_user(user_id)
+        if user is None:
+            await self.delete(token)
+        return user
+
+    async def get_user(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        generation = self._generation
+        user = await self._load_user(user_id)
+        if user is not None and generation == self._generation:
+            self._users[user_id] = (user, time.monotonic() + self.user_ttl)
+        return user
+
+    async def _load_user(self, user_id):
+        async with self.db_pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(USER_AUTH_SQL, (user_id,))
+                row = await cursor.fetchone()
+        return AuthUser(*row) if row else None
+
+    async def invalidate_user(self, user_id):
+        # 用户状态或权限修改后调用，下次鉴权重新读取
+        self._generation += 1
+        self._users.pop(user_id, None)
+
+    async def revoke_user(self, user_id):
+        # 禁用或删除用户后调用，注销其全部会话
+        for token in self._user_sessions.pop(user_id, ()):
+            self._sessions.pop(token, None)
+        await self.invalidate_user(user_id)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "cached_users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class RedisSessionStore(SessionStore):
+    # 会话和用户记录保存在 Redis，多个进程共享，修改用户后所有进程立即生效。
+    # Redis 不可用时无法鉴权（按未登录处理），读取用户记录失败时改为查询数据库（记录警告）
+    def __init__(self, redis, db_pool, session_ttl=7 * 86400, user_ttl=60, prefix="ai-helper:auth:"):
+        super().__init__(db_pool, session_ttl, user_ttl)
+        self._redis = redis
+        self.prefix = prefix
+
+    def _session_key(self, token):
+        return f"{self.prefix}session:{token}"
+
+    def _user_keys(self, user_id):
+        # 缓存的用户记录、用户的令牌集合
+        return f"{self.prefix}user:{user_id}", f"{self.prefix}sessions:{user_id}"
+
+    def _version_key(self, user_id):
+        # 用户记录的版本号，invalidate_user 时加一；保留一天，远长于一次数据库读取
+        return f"{self.prefix}version:{user_id}"
+
+    async def create(self, user_id, user=None):
+        token = secrets.token_urlsafe(32)
+        user_key, sessions_key = self._user_keys(user_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(self._session_key(token), user_id, ex=self.session_ttl)
+            pipe.sadd(sessions_key, token)
+            pipe.expire(sessions_key, self.session_ttl)
+            if user is not None:
+                pipe.set(user_key, _dump_user(user), ex=self.user_ttl)
+            await pipe.execute()
+        return token
+
+    async def delete(self, token):
+        try:
+            user_id = await self._redis.getdel(self._session_key(token))
+            if user_id is not None:
+                await self._redis.srem(self._user_keys(int(user_id))[1], token)
+        except Exception as e:
+            logger.warning("删除登录会话失败: %s", e)
+
+    async def _session_user(self, token):
+        try:
+            user_id = await self._redis.get(self._session_key(token))
+        except Exception as e:
+            logger.warning("读取登录会话失败: %s", e)
+            return None
+        return int(user_id) if user_id is not None else None
+
+    async def get_user(self, user_id):
+        user_key, _ = self._user_keys(user_id)
+        version_key = self._version_key(user_id)
+        try:
+            value, version = await self._redis.mget(user_key, version_key)
+        except Exception as e:
+            logger.warning("读取缓存的用户记录失败，改为查询数据库: %s", e)
+            self.misses += 1
+            return await self._load_user(user_id)
+        if value is not None:
+            self.hits += 1
+            return _load_cached_user(user_id, value)
+        self.misses += 1
+        user = await self._load_user(user_id)
+        if user is not None:
+            try:
+                # 写入后再读版本号：读取数据库期间用户被修改过（invalidate_user 先加版本号再删除记录）时，
+                # 写入的可能是修改前的记录，删掉它，下次鉴权重新读取
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.set(user_key, _dump_user(user), ex=self.user_ttl)
+                    pipe.get(version_key)
+                    _, current = await pipe.execute()
+                if current != version:
+                    await self._redis.delete(user_key)
+            except Exception as e:
+                logger.warning("写入用户记录缓存失败: %s", e)
+        return user
+
+    async def invalidate_user(self, user_id):
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                self._bump_version(pipe, user_id)
+                pipe.delete(self._user_keys(user_id)[0])
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("删除缓存的用户记录失败: %s", e)
+
+    def _bump_version(self, pipe, user_id):
+        # 必须在删除用户记录之前执行
+        version_key = self._version_key(user_id)
+        pipe.incr(version_key)
+        pipe.expire(version_key, 86400)
+
+    async def revoke_user(self, user_id):
+        user_key, sessions_key = self._user_keys(user_id)
+        try:
+            tokens = await self._redis.smembers(sessions_key)
+            async with self._redis.pipeline(transaction=False) as pipe:
+                self._bump_version(pipe, user_id)
+                pipe.delete(user_key, sessions_key, *(self._session_key(token.decode()) for token in tokens))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("注销用户的登录会话失败: %s", e)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+
+def _dump_user(user):
+    return f"{user.status}:{user.is_admin}"
+
+
+def _load_cached_user(user_id, value):
+    status, is_admin = value.decode().split(":")
+    return AuthUser(user_id, int(status), int(is_admin))
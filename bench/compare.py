@@ -0,0 +1,52 @@
+"""对比两次压测结果，延迟类指标变差超过阈值时以非零状态退出，可用于 CI。
+
+python bench/compare.py bench/results/old.json bench/results/new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# 数值越大越好的指标，其余（延迟、错误数）越小越好
+HIGHER_IS_BETTER = ("rps", "output_chars_per_s")
+# 参与判断是否退化的指标
+GATED = ("latency_p95_ms", "latency_p99_ms", "ttft_p95_ms")
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两次压测结果")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10, help="允许的退化百分比")
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    print(f"{baseline['meta']['commit']} -> {current['meta']['commit']}")
+    regressions = []
+    for endpoint, new in current["endpoints"].items():
+        old = baseline["endpoints"].get(endpoint)
+        if old is None:
+            continue
+        print(f"\n[{endpoint}]")
+        for metric, value in new.items():
+            before = old.get(metric)
+            if value is None or before is None:
+                continue
+            change = (value - before) / before * 100 if before else 0.0
+            worse = -change if metric.startswith(HIGHER_IS_BETTER) else change
+            mark = ""
+            if metric in GATED and worse > args.threshold:
+                mark = "  <-- 退化"
+                regressions.append(f"{endpoint}.{metric}")
+            print(f"  {metric:28}{before:>12}{value:>12}{change:>+10.1f}%{mark}")
+    if regressions:
+        print(f"\n超过 {args.threshold}% 的退化: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
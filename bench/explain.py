@@ -0,0 +1,297 @@
+"""检查服务执行的每条 SQL 语句的执行计划。
+
+python bench/explain.py --db-host 127.0.0.1 --db-password ...
+
+在一次性数据库中建表并写入压测数据（其中一部分会话归档到归档表），进程内启动服务，依次调用所有接口
+（流式对话使用模拟服务商），记录执行过的每条语句及参数后逐条 EXPLAIN。以下情况视为问题，以非零状态退出：
+  - 估计扫描行数超过 --max-rows 的全表扫描（type=ALL）或全索引扫描（type=index）
+  - 估计行数超过 --max-rows 的步骤使用了临时表或文件排序
+  - main.py 中有 execute 调用没有被执行到（新增接口或分支后需要在 drive() 中补充请求）
+ALLOWED 中列出的语句除外。
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+import pymysql
+import pymysql.cursors
+
+import run
+
+ROOT = run.ROOT
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+from message_archive import move_statements  # noqa: E402
+
+# 有意为之的扫描或排序：(语句的正则, 原因)
+ALLOWED = [
+    (r"FROM chat_sessions ORDER BY id$", "管理员导出全部用户的会话，按主键顺序读取整张表"),
+    (r"FROM users u\s+ORDER BY u\.id$", "管理员用户列表，列出全部用户"),
+    (r"FROM usage_daily d.* GROUP BY d\.(user_id|model_id)", "用量统计按用户/模型汇总：按日期范围读取汇总表后分组排序，行数为 天数×用户×模型"),
+]
+
+EXPLAINABLE = re.compile(r"\s*(SELECT|UPDATE|DELETE|INSERT\s+INTO\s+\w+\s*\([^)]*\)\s*SELECT)\b", re.I)
+
+
+class Recorder:
+    # 作为连接池的 on_query：记录每条语句第一次执行时的参数和执行它的代码位置
+    def __init__(self, chained=None):
+        self.chained = chained
+        self.statements = {}
+
+    def __call__(self, query, args, seconds):
+        if self.chained is not None:
+            self.chained(query, args, seconds)
+        if isinstance(args, list) and args and isinstance(args[0], (tuple, list)):
+            # executemany：用第一组参数
+            args = args[0]
+        entry = self.statements.setdefault(query, {"args": args, "sites": set()})
+        site = call_site()
+        if site is not None:
+            entry["sites"].add(site)
+
+
+def call_site():
+    # 沿调用栈（await 链）向上找到项目中第一个不属于 db.py 的位置
+    db_file = os.path.join(ROOT, "db.py")
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if os.path.dirname(filename) == ROOT and filename != db_file:
+            return os.path.relpath(filename, ROOT), frame.f_lineno
+        frame = frame.f_back
+    return None
+
+
+def execute_sites(filename):
+    # 文件中所有 execute/executemany 调用的 (起始行, 结束行)
+    with open(os.path.join(ROOT, filename), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return sorted(
+        (node.lineno, node.end_lineno) for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+        and node.func.attr in ("execute", "executemany")
+    )
+
+
+# ---------- 数据 ----------
+
+def prepare(args):
+    # 建库、写入压测数据；第一个用户设为管理员，并归档其一半的短会话
+    run.create_database(args)
+    users = run.seed(args)
+    with run.connect(args, args.db_name) as conn, conn.cursor() as cursor:
+        admin = users[0]
+        cursor.execute("UPDATE users SET is_admin = 1 WHERE id = %s", (admin["user_id"],))
+        cursor.execute(
+            "SELECT id, session_id FROM chat_sessions WHERE user_id = %s AND session_id <> %s ORDER BY id",
+            (admin["user_id"], admin["history"])
+        )
+        sessions = cursor.fetchall()
+        archived = sessions[::2]
+        conn.autocommit(False)
+        for sql, sql_args in move_statements([key for key, _ in archived], archive=True):
+            cursor.execute(sql, sql_args)
+        conn.commit()
+        conn.autocommit(True)
+        cursor.execute("ANALYZE TABLE users, chat_sessions, ai_chat_messages, ai_chat_messages_archive, usage_daily")
+        cursor.fetchall()
+        admin["archived"] = archived[0][1]
+        admin["hot"] = sessions[1][1]
+    return users
+
+
+# ---------- 请求 ----------
+
+def check(response, *statuses):
+    if response.status_code not in (statuses or (200,)):
+        raise RuntimeError(f"{response.request.method} {response.request.url} 返回 {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def stream_chat(client, session_id=None):
+    payload = {"message": "请解释一下数据库索引", "model_id": run.MODEL_ID, "session_id": session_id}
+    with client.stream("POST", "/api/chat/stream", json=payload) as response:
+        check(response)
+        for line in response.iter_lines():
+            if line.startswith("data: ") and '"done"' in line:
+                return json.loads(line[6:])["session_id"]
+    raise RuntimeError("流式对话没有正常结束")
+
+
+def drive(client, admin, other):
+    # 依次调用所有接口，覆盖 main.py 中的每条语句
+    check(client.post("/api/register", json={"username": "explain-user", "password": run.PASSWORD}))
+    check(client.post("/api/login", json={"username": admin["username"], "password": run.PASSWORD}))
+    check(client.get("/api/models"))
+    check(client.get("/api/user/info"))
+    avatar = check(client.post("/api/user/avatar", files={"file": ("a.png", b"\x89PNG\r\n", "image/png")})).json()["avatar"]
+    os.remove(os.path.join(ROOT, avatar.lstrip("/")))
+
+    # 对话：新会话、长历史会话、已归档的会话（发送消息时移回消息表）
+    new_session = stream_chat(client)
+    stream_chat(client, admin["history"])
+    stream_chat(client, admin["archived"])
+
+    # 会话列表和消息分页
+    page = check(client.get("/api/chat/history", params={"limit": 5})).json()
+    check(client.get("/api/chat/history", params={"limit": 5, "before": page["next_cursor"]}))
+    check(client.get("/api/chat/history", params={"limit": 5, "after": page["next_cursor"]}))
+    messages = check(client.get("/api/chat/history", params={"session_id": admin["history"], "limit": 20})).json()
+    check(client.get("/api/chat/history", params={"session_id": admin["history"], "limit": 20, "before": messages["next_cursor"]}))
+    check(client.get("/api/chat/history", params={"session_id": admin["history"], "limit": 20, "after": messages["next_cursor"]}))
+    check(client.get("/api/chat/history", params={"session_id": admin["hot"]}))
+    check(client.get("/api/chat/sessions/changes", params={"since": (datetime.now() - timedelta(hours=1)).isoformat()}))
+    now = datetime.now()
+    check(client.post("/api/chat/history/date-range", json={
+        "start_time": (now - timedelta(days=1)).isoformat(), "end_time": now.isoformat(), "limit": 5
+    }))
+    results = check(client.get("/api/chat/search", params={"q": "消息 内容", "limit": 5})).json()
+    if results["next_cursor"]:
+        check(client.get("/api/chat/search", params={"q": "消息 内容", "limit": 5, "cursor": results["next_cursor"]}))
+
+    # 导出导入、删除会话
+    archive = check(client.get("/api/chat/export")).content
+    check(client.post("/api/chat/import", files={"file": ("a.jsonl", archive)}))
+    check(client.delete(f"/api/chat/session/{new_session}"))
+
+    # 管理后台
+    check(client.get("/api/admin/check"))
+    check(client.post("/api/admin/providers", json={"name": "explain", "base_url": "http://127.0.0.1:1/v1", "api_key": "k"}))
+    providers = check(client.get("/api/admin/providers")).json()["providers"]
+    provider_id = max(provider["id"] for provider in providers)
+    check(client.put(f"/api/admin/providers/{provider_id}", json={"name": "explain", "base_url": "http://127.0.0.1:1/v1", "api_key": "k2"}))
+    check(client.put(f"/api/admin/providers/{provider_id}", json={"name": "explain", "base_url": "http://127.0.0.1:1/v1"}))
+    check(client.post("/api/admin/models", json={"provider_id": provider_id, "model_id": "explain-model", "model_name": "Explain"}))
+    models = check(client.get("/api/admin/models")).json()["models"]
+    model_id = max(model["id"] for model in models)
+    check(client.put(f"/api/admin/models/{model_id}", json={"provider_id": provider_id, "model_id": "explain-model", "model_name": "Explain 2"}))
+    check(client.delete(f"/api/admin/models/{model_id}"))
+    check(client.delete(f"/api/admin/providers/{provider_id}"))
+    users = check(client.get("/api/admin/users")).json()["users"]
+    for group_by in ("day", "user", "model"):
+        check(client.get("/api/admin/usage", params={"group_by": group_by}))
+    check(client.get("/api/admin/usage", params={"user_id": other["user_id"], "model_id": run.MODEL_ID}))
+    check(client.get("/api/admin/quota"))
+    check(client.get("/api/admin/auth"))
+    check(client.put(f"/api/admin/users/{other['user_id']}", json={"username": other["username"], "status": 1, "is_admin": 0}))
+    check(client.get("/api/admin/export", params={"user_id": other["user_id"]}))
+    archive = check(client.get("/api/admin/export")).content
+    check(client.post("/api/admin/import", params={"keep_ids": "true"}, files={"file": ("a.jsonl", archive)}))
+    registered = next(user["id"] for user in users if user["username"] == "explain-user")
+    check(client.delete(f"/api/admin/users/{registered}"))
+    check(client.post("/api/logout"))
+
+
+# ---------- 检查 ----------
+
+def explain(conn, sql, args):
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("EXPLAIN " + sql, args)
+        return cursor.fetchall()
+
+
+def plan_problems(plan, max_rows):
+    found = []
+    for step in plan:
+        rows = step.get("rows") or 0
+        if rows <= max_rows:
+            continue
+        extra = step.get("Extra") or ""
+        if step.get("type") == "ALL":
+            found.append(f"{step['table']}: 全表扫描，约 {rows} 行")
+        elif step.get("type") == "index":
+            found.append(f"{step['table']}: 全索引扫描（{step['key']}），约 {rows} 行")
+        for word in ("Using temporary", "Using filesort"):
+            if word in extra:
+                found.append(f"{step['table']}: {word}，约 {rows} 行")
+    return found
+
+
+def format_plan(plan):
+    return "\n".join(
+        f"      {step['table']}  type={step['type']}  key={step['key']}  rows={step['rows']}  {step.get('Extra') or ''}"
+        for step in plan
+    )
+
+
+def report(conn, recorder, max_rows):
+    failures = 0
+    print(f"共执行 {len(recorder.statements)} 条不同的语句")
+    for sql, entry in recorder.statements.items():
+        if not EXPLAINABLE.match(sql):
+            continue
+        statement = re.sub(r"\s+", " ", sql).strip()
+        plan = explain(conn, sql, entry["args"])
+        found = plan_problems(plan, max_rows)
+        allowed = next((reason for pattern, reason in ALLOWED if re.search(pattern, statement)), None)
+        if found and allowed is None:
+            failures += 1
+            sites = ", ".join(f"{name}:{line}" for name, line in sorted(entry["sites"]))
+            print(f"\n[问题] {statement[:200]}\n  位置: {sites}\n  " + "\n  ".join(found))
+            print(format_plan(plan))
+        elif found:
+            print(f"\n[允许] {statement[:120]}\n  原因: {allowed}")
+
+    hit = {line for entry in recorder.statements.values() for name, line in entry["sites"] if name == "main.py"}
+    missed = [(start, end) for start, end in execute_sites("main.py") if not any(start <= line <= end for line in hit)]
+    for start, _ in missed:
+        failures += 1
+        print(f"\n[未覆盖] main.py:{start} 的语句没有被执行到")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 SQL 执行计划")
+    parser.add_argument("--db-host", default=config.MySQL_CONFIG["host"])
+    parser.add_argument("--db-port", type=int, default=config.MySQL_CONFIG["port"])
+    parser.add_argument("--db-user", default=config.MySQL_CONFIG["user"])
+    parser.add_argument("--db-password", default=config.MySQL_CONFIG["password"])
+    parser.add_argument("--db-name", default=f"ai_explain_{os.getpid()}", help="一次性数据库名，检查前重建，结束后删除")
+    parser.add_argument("--keep-db", action="store_true", help="结束后保留数据库")
+    parser.add_argument("--mock-port", type=int, default=9101)
+    parser.add_argument("--users", type=int, default=10, help="预置的用户数")
+    parser.add_argument("--sessions", type=int, default=50, help="每个用户预置的会话数")
+    parser.add_argument("--history-messages", type=int, default=500, help="长历史会话的消息数")
+    parser.add_argument("--max-rows", type=int, default=100, help="允许全表扫描、临时表或文件排序的估计行数上限")
+    args = parser.parse_args()
+
+    print(f"准备数据库 {args.db_name} ...")
+    users = prepare(args)
+    mock = run.start_process("mock_llm.py", "--port", args.mock_port, "--ttft", 0, "--token-rate", 0, "--tokens", 20)
+    try:
+        asyncio.run(run.wait_ready(f"http://127.0.0.1:{args.mock_port}/docs"))
+        # main 在导入时读取配置，并以相对路径挂载静态文件
+        config.MySQL_CONFIG.update(
+            host=args.db_host, port=args.db_port, user=args.db_user, password=args.db_password, db=args.db_name
+        )
+        os.chdir(ROOT)
+        import main as app_module
+        from fastapi.testclient import TestClient
+
+        recorder = Recorder(app_module.db_pool.on_query)
+        app_module.db_pool.on_query = recorder
+        with TestClient(app_module.app) as client:
+            drive(client, users[0], users[1])
+        with run.connect(args, args.db_name) as conn:
+            failures = report(conn, recorder, args.max_rows)
+    finally:
+        mock.terminate()
+        mock.wait()
+        if not args.keep_db:
+            run.drop_database(args)
+
+    if failures:
+        print(f"\n发现 {failures} 个问题")
+        sys.exit(1)
+    print("\n所有语句的执行计划正常")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""模拟 OpenAI 兼容的 /chat/completions 流式接口，用于压测时替代真实的服务商。
+
+python bench/mock_llm.py --port 9100 --ttft 0.3 --token-rate 50 --tokens 200 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+# 启动参数，见 main()
+settings = {
+    "ttft": 0.3,          # 首个 token 的延迟（秒）
+    "jitter": 0.2,        # 延迟的随机波动比例
+    "token_rate": 50.0,   # 每秒输出的 token 数，0 表示不限速
+    "tokens": 200,        # 每次回复的 token 数
+    "error_rate": 0.0,    # 直接返回 500 的比例
+    "drop_rate": 0.0,     # 输出到一半时断开连接的比例
+}
+
+
+def _delay(seconds):
+    jitter = settings["jitter"]
+    return max(seconds * random.uniform(1 - jitter, 1 + jitter), 0)
+
+
+def _chunk(content):
+    return "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": content}}]}, ensure_ascii=False) + "\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < settings["error_rate"]:
+        return JSONResponse(status_code=500, content={"error": {"message": "injected error"}})
+    drop_at = settings["tokens"] // 2 if random.random() < settings["drop_rate"] else None
+    interval = 1 / settings["token_rate"] if settings["token_rate"] > 0 else 0
+    last = body.get("messages", [{}])[-1].get("content", "")
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+    async def stream():
+        await asyncio.sleep(_delay(settings["ttft"]))
+        for i in range(settings["tokens"]):
+            if i == drop_at:
+                raise RuntimeError("injected disconnect")
+            # 回复内容包含少量提问文字和中文，覆盖转义和多字节字符
+            yield _chunk(f"{last[:8]}回复{i} " if i % 20 == 0 else f"tok{i} ")
+            if interval:
+                await asyncio.sleep(_delay(interval))
+        if include_usage:
+            # 与 OpenAI 一致：最后一帧 choices 为空，携带本次调用的用量
+            prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", []))
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": settings["tokens"],
+                     "total_tokens": prompt_tokens + settings["tokens"]}
+            yield "data: " + json.dumps({"choices": [], "usage": usage}) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 LLM 服务商")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for key, value in settings.items():
+        parser.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    args = parser.parse_args()
+    for key in settings:
+        settings[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""压测：启动模拟服务商和服务本身，使用一次性的 MySQL 数据库，按场景并发请求并统计各接口的延迟。
+
+python bench/run.py --db-host 127.0.0.1 --db-password ... --users 50 --duration 60
+结果保存到 bench/results/ 下的 JSON 文件，可用 bench/compare.py 对比两次结果。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+import pymysql
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, "bench")
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+MODEL_ID = "bench-model"
+PASSWORD = "bench-password"
+
+# 场景及权重：登录、会话列表、流式对话、打开长历史会话
+SCENARIOS = {"login": 1, "list_sessions": 3, "stream_chat": 4, "open_history": 2}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    # 最近秩法
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def summarize(samples, elapsed):
+    # samples: {"latency": [...], "errors": n, 其余为可选的附加指标列表}
+    latency = samples["latency"]
+    result = {
+        "count": len(latency),
+        "errors": samples["errors"],
+        "rps": round(len(latency) / elapsed, 2) if elapsed else 0,
+    }
+    for name, values in samples.items():
+        if name == "errors" or not isinstance(values, list):
+            continue
+        unit = "_ms" if name in ("latency", "ttft") else ""
+        scale = 1000 if unit else 1
+        for p in (50, 95, 99):
+            value = percentile(values, p)
+            result[f"{name}_p{p}{unit}"] = round(value * scale, 2) if value is not None else None
+        result[f"{name}_mean{unit}"] = round(sum(values) / len(values) * scale, 2) if values else None
+    return result
+
+
+# ---------- 数据库 ----------
+
+def connect(args, db=None):
+    return pymysql.connect(
+        host=args.db_host, port=args.db_port, user=args.db_user, password=args.db_password,
+        db=db, charset="utf8mb4", autocommit=True
+    )
+
+
+def schema_statements(db_name):
+    with open(os.path.join(ROOT, "database.sql"), encoding="utf-8") as f:
+        sql = f.read()
+    # 建到一次性数据库中，不使用自带的示例数据
+    sql = re.sub(r"\bDATABASE IF NOT EXISTS ai\b", f"DATABASE IF NOT EXISTS `{db_name}`", sql)
+    sql = re.sub(r"^USE ai;", f"USE `{db_name}`;", sql, flags=re.M)
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    for statement in "\n".join(lines).split(";\n"):
+        statement = statement.strip().rstrip(";")
+        if statement and not statement.upper().startswith("INSERT"):
+            yield statement
+
+
+def create_database(args):
+    with connect(args) as conn, conn.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{args.db_name}`")
+        for statement in schema_statements(args.db_name):
+            cursor.execute(statement)
+
+
+def drop_database(args):
+    with connect(args) as conn, conn.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{args.db_name}`")
+
+
+def seed(args):
+    # 服务商指向模拟服务；每个用户预置若干短会话和一个长历史会话
+    with connect(args, args.db_name) as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO api_providers (name, base_url, api_key) VALUES (%s, %s, %s)",
+            ("bench", f"http://127.0.0.1:{args.mock_port}/v1", "bench-key")
+        )
+        cursor.execute(
+            "INSERT INTO model_configs (provider_id, model_id, model_name, max_tokens) VALUES (%s, %s, %s, %s)",
+            (cursor.lastrowid, MODEL_ID, "Bench", 8192)
+        )
+        users = []
+        now = datetime.now()
+        for i in range(args.users):
+            username = f"bench{i}"
+            cursor.execute(
+                "INSERT INTO users (username, password) VALUES (%s, SHA2(%s, 256))", (username, PASSWORD)
+            )
+            user_id = cursor.lastrowid
+            sessions = [str(uuid.uuid4()) for _ in range(args.sessions)]
+            cursor.executemany(
+                "INSERT INTO chat_sessions (session_id, user_id, model_id, preview, message_count, update_time) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [(sid, user_id, MODEL_ID, f"会话 {n}", 2, now - timedelta(minutes=n)) for n, sid in enumerate(sessions)]
+            )
+            history = str(uuid.uuid4())
+            cursor.execute(
+                "INSERT INTO chat_sessions (session_id, user_id, model_id, preview, message_count) VALUES (%s, %s, %s, %s, %s)",
+                (history, user_id, MODEL_ID, "长历史会话", args.history_messages)
+            )
+            # 消息按会话主键关联
+            cursor.execute("SELECT session_id, id FROM chat_sessions WHERE user_id = %s", (user_id,))
+            keys = dict(cursor.fetchall())
+            messages = []
+            for sid in sessions:
+                messages.append((keys[sid], user_id, "user", "你好，请介绍一下你自己"))
+                messages.append((keys[sid], user_id, "assistant", "我是一个 AI 助手。" * 20))
+            for n in range(args.history_messages):
+                role = "user" if n % 2 == 0 else "assistant"
+                messages.append((keys[history], user_id, role, f"第 {n} 条消息 " + "内容" * 100))
+            cursor.executemany(
+                "INSERT INTO ai_chat_messages (session_key, user_id, role, content) VALUES (%s, %s, %s, %s)", messages
+            )
+            # 预聚合的用户计数和当天用量（内容以中文为主，token 数按字符数计）
+            sent = sum(1 for message in messages if message[2] == "user")
+            cursor.execute(
+                "UPDATE users SET message_count = %s, sent_count = %s WHERE id = %s", (len(messages), sent, user_id)
+            )
+            cursor.execute(
+                "INSERT INTO usage_daily (day, user_id, model_id, messages, sent_count, tokens) VALUES (CURDATE(), %s, %s, %s, %s, %s)",
+                (user_id, MODEL_ID, len(messages), sent, sum(len(message[3]) for message in messages))
+            )
+            users.append({"username": username, "user_id": user_id, "history": history})
+        return users
+
+
+# ---------- 进程 ----------
+
+def start_process(script, *argv):
+    return subprocess.Popen([sys.executable, os.path.join(BENCH, script), *map(str, argv)])
+
+
+async def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                response = await client.get(url)
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} 未在 {timeout} 秒内就绪")
+            await asyncio.sleep(0.2)
+
+
+# ---------- 场景 ----------
+
+class VirtualUser:
+    def __init__(self, client, user, stats, recording):
+        self.client = client
+        self.user = user
+        self.stats = stats
+        self.recording = recording
+        self.session_id = None
+
+    def record(self, name, latency, ok, **extra):
+        if not self.recording():
+            return
+        samples = self.stats.setdefault(name, {"latency": [], "errors": 0})
+        if not ok:
+            samples["errors"] += 1
+            return
+        samples["latency"].append(latency)
+        for key, value in extra.items():
+            samples.setdefault(key, []).append(value)
+
+    async def login(self):
+        start = time.perf_counter()
+        response = await self.client.post("/api/login", json={"username": self.user["username"], "password": PASSWORD})
+        # 会话 cookie 由客户端自动保存
+        self.record("login", time.perf_counter() - start, response.status_code == 200)
+
+    async def list_sessions(self):
+        start = time.perf_counter()
+        response = await self.client.get("/api/chat/history")
+        self.record("list_sessions", time.perf_counter() - start, response.status_code == 200)
+
+    async def open_history(self):
+        start = time.perf_counter()
+        response = await self.client.get("/api/chat/history", params={"session_id": self.user["history"]})
+        self.record("open_history", time.perf_counter() - start, response.status_code == 200)
+
+    async def stream_chat(self):
+        # 一半的请求继续上一次的会话，另一半新建会话
+        payload = {
+            "message": f"问题 {random.randint(0, 10 ** 6)}：请解释一下事件循环",
+            "model_id": MODEL_ID,
+            "session_id": self.session_id if random.random() < 0.5 else None,
+        }
+        start = time.perf_counter()
+        ttft = None
+        chars = 0
+        ok = False
+        async with self.client.stream("POST", "/api/chat/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[6:])
+                if "error" in data:
+                    break
+                content = data.get("content")
+                if content is None and data.get("choices"):
+                    content = data["choices"][0].get("delta", {}).get("content")
+                if content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    chars += len(content)
+                if data.get("done"):
+                    self.session_id = data["session_id"]
+                    ok = True
+        elapsed = time.perf_counter() - start
+        extra = {}
+        if ok and ttft is not None:
+            extra["ttft"] = ttft
+            if elapsed > ttft:
+                extra["output_chars_per_s"] = chars / (elapsed - ttft)
+        self.record("stream_chat", elapsed, ok, **extra)
+
+    async def run(self, deadline, think_time):
+        await self.login()
+        names = list(SCENARIOS)
+        weights = [SCENARIOS[name] for name in names]
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            try:
+                await getattr(self, name)()
+            except httpx.HTTPError:
+                self.record(name, 0, False)
+            if think_time:
+                await asyncio.sleep(random.uniform(0, think_time * 2))
+
+
+async def drive(args, users):
+    stats = {}
+    started = time.monotonic()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(120)
+    clients = [
+        httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=timeout)
+        for _ in users
+    ]
+    try:
+        vus = [VirtualUser(client, user, stats, lambda: time.monotonic() >= measure_from) for client, user in zip(clients, users)]
+        await asyncio.gather(*(vu.run(deadline, args.think_time) for vu in vus))
+    finally:
+        for client in clients:
+            await client.aclose()
+    elapsed = time.monotonic() - measure_from
+    return {name: summarize(samples, elapsed) for name, samples in sorted(stats.items())}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(endpoints):
+    columns = ("count", "errors", "rps", "latency_p50_ms", "latency_p95_ms", "latency_p99_ms", "ttft_p50_ms", "ttft_p95_ms", "ttft_p99_ms")
+    print("endpoint".ljust(16) + "".join(column.rjust(16) for column in columns))
+    for name, result in endpoints.items():
+        cells = ["-" if result.get(column) is None else str(result[column]) for column in columns]
+        print(name.ljust(16) + "".join(cell.rjust(16) for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ai-helper 压测")
+    parser.add_argument("--db-host", default=config.MySQL_CONFIG["host"])
+    parser.add_argument("--db-port", type=int, default=config.MySQL_CONFIG["port"])
+    parser.add_argument("--db-user", default=config.MySQL_CONFIG["user"])
+    parser.add_argument("--db-password", default=config.MySQL_CONFIG["password"])
+    parser.add_argument("--db-name", default=f"ai_bench_{os.getpid()}", help="一次性数据库名，压测前重建，结束后删除")
+    parser.add_argument("--keep-db", action="store_true", help="结束后保留数据库")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--users", type=int, default=20, help="并发虚拟用户数")
+    parser.add_argument("--sessions", type=int, default=50, help="每个用户预置的会话数")
+    parser.add_argument("--history-messages", type=int, default=1000, help="长历史会话的消息数")
+    parser.add_argument("--duration", type=float, default=30, help="统计时长（秒）")
+    parser.add_argument("--warmup", type=float, default=5, help="预热时长（秒），不计入统计")
+    parser.add_argument("--think-time", type=float, default=0.5, help="用户两次操作之间的平均间隔（秒）")
+    parser.add_argument("--ttft", type=float, default=0.3, help="模拟服务商的首 token 延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=50, help="模拟服务商每秒输出的 token 数")
+    parser.add_argument("--tokens", type=int, default=200, help="模拟服务商每次回复的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务商返回 500 的比例")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="模拟服务商中途断开的比例")
+    parser.add_argument("--output", help="结果文件，默认 bench/results/<时间>-<提交>.json")
+    args = parser.parse_args()
+
+    print(f"准备数据库 {args.db_name} ...")
+    create_database(args)
+    processes = []
+    try:
+        users = seed(args)
+        processes.append(start_process(
+            "mock_llm.py", "--port", args.mock_port, "--ttft", args.ttft, "--token-rate", args.token_rate,
+            "--tokens", args.tokens, "--error-rate", args.error_rate, "--drop-rate", args.drop_rate
+        ))
+        processes.append(start_process(
+            "serve.py", "--port", args.port, "--db-name", args.db_name, "--db-host", args.db_host,
+            "--db-port", args.db_port, "--db-user", args.db_user, "--db-password", args.db_password
+        ))
+        asyncio.run(wait_ready(f"http://127.0.0.1:{args.port}/api/models"))
+        print(f"{args.users} 个用户，预热 {args.warmup} 秒，统计 {args.duration} 秒 ...")
+        endpoints = asyncio.run(drive(args, users))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        if not args.keep_db:
+            drop_database(args)
+
+    print_report(endpoints)
+    commit = git_commit()
+    result = {
+        "meta": {
+            "commit": commit,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key != "db_password"},
+        },
+        "endpoints": endpoints,
+    }
+    output = args.output or os.path.join(
+        BENCH, "results", f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""以压测用的数据库启动服务，由 bench/run.py 调用。
+
+python bench/serve.py --port 8100 --db-name ai_bench --db-host 127.0.0.1 --db-user root --db-password ...
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动压测用的服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--db-host", default=config.MySQL_CONFIG["host"])
+    parser.add_argument("--db-port", type=int, default=config.MySQL_CONFIG["port"])
+    parser.add_argument("--db-user", default=config.MySQL_CONFIG["user"])
+    parser.add_argument("--db-password", default=config.MySQL_CONFIG["password"])
+    parser.add_argument("--db-name", required=True)
+    args = parser.parse_args()
+
+    # main 在导入时读取配置，必须先改好再导入
+    config.MySQL_CONFIG.update(
+        host=args.db_host, port=args.db_port, user=args.db_user, password=args.db_password, db=args.db_name
+    )
+    import main as app_module
+
+    uvicorn.run(app_module.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+
+from metrics import STREAMS_STOPPED
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRegistry:
+    # 进行中的回复生成，按会话登记一个 asyncio.Event；停止接口和断线检测设置它，
+    # 流式接口随即停止读取上游并保存已生成的部分。
+    # 只在本进程内有效：多进程部署时停止请求需要到达正在生成该会话回复的进程（例如按会话粘性路由）
+    def __init__(self):
+        self._active = {}
+
+    def register(self, session_id, user_id):
+        # 同一会话已有生成时，新的生成替换它（旧的仍会正常结束，只是不能再通过会话停止）
+        stop = asyncio.Event()
+        self._active[session_id] = (user_id, stop)
+        return stop
+
+    def unregister(self, session_id, stop):
+        entry = self._active.get(session_id)
+        if entry is not None and entry[1] is stop:
+            del self._active[session_id]
+
+    def stop(self, session_id, user_id):
+        # 停止该用户在该会话上进行中的生成，没有时返回 False
+        entry = self._active.get(session_id)
+        if entry is None or entry[0] != user_id or entry[1].is_set():
+            return False
+        entry[1].set()
+        STREAMS_STOPPED.inc("stop")
+        return True
+
+
+async def stop_when_idle(streams, stream_id, stop, interval):
+    # 定期检查生成的输出是否还有读取者，客户端断开后超过 idle_timeout 没有重新连接（续传）时设置 stop
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        if await streams.idle(stream_id):
+            logger.info("客户端已断开且没有重新连接，停止生成")
+            STREAMS_STOPPED.inc("disconnect")
+            stop.set()
+            return
@@ -11,4 +11,161 @@ REDIS_CONFIG = {
     'host': '192.168.186.95',
     'port': 6379,
     'password': 'lxh2lph..'
-}
\ No newline at end of file
+}
+
+# 数据库连接池配置
+DB_POOL_CONFIG = {
+    'minsize': 2,                   # 启动时预建的连接数
+    'maxsize': 20,                  # 最大连接数（同时也是数据库线程池大小）
+    'acquire_timeout': 10,          # 获取连接的最长等待时间（秒）
+    'health_check_interval': 30,    # 空闲超过该秒数的连接在复用前先 ping 检查
+    'recycle': 3600                 # 连接最长存活时间（秒），超过后重建
+}
+
+# 调用AI服务商的HTTP客户端默认配置（可在管理后台按服务商覆盖部分参数）
+HTTP_CLIENT_CONFIG = {
+    'max_connections': 100,             # 每个服务商的最大连接数
+    'max_keepalive_connections': 20,    # 保持的空闲连接数上限
+    'keepalive_expiry': 120,            # 空闲连接保持时间（秒）
+    'connect_timeout': 10,              # 连接超时（秒）
+    'read_timeout': 60,                 # 读取超时（秒），流式输出时为两个数据块之间的最大间隔
+    'write_timeout': 30,
+    'pool_timeout': 10,                 # 等待空闲连接的超时（秒）
+    'http2': False                      # 默认是否启用HTTP/2（需要安装 h2）
+}
+
+# 模型路由表缓存配置
+ROUTING_CONFIG = {
+    'ttl': 300,                         # 路由表超过该秒数后在后台重新加载，0 表示只在管理端修改时重建
+    'miss_reload_interval': 5,          # 请求了未知模型时，距上次加载超过该秒数才重新加载
+    'redis_pubsub': False,              # 多进程部署时通过 Redis 发布/订阅通知其他进程重建（需要 pip install redis）
+    'channel': 'ai-helper:routing'
+}
+
+# 对话历史分页配置
+PAGINATION_CONFIG = {
+    'session_page_size': 30,            # 会话列表每页条数
+    'message_page_size': 50,            # 会话消息每页条数
+    'max_page_size': 200                # 客户端指定 limit 时的上限
+}
+
+# 对话上下文配置
+CONTEXT_CONFIG = {
+    'max_messages': 50,                 # 每轮最多读取的历史消息条数
+    'reply_reserve_ratio': 0.25,        # 模型 max_tokens 中预留给回复的比例，其余作为上下文预算
+    'default_max_tokens': 4096          # 模型未配置 max_tokens 时使用
+}
+
+# 活跃会话上下文缓存配置（缓存条数上限沿用 CONTEXT_CONFIG['max_messages']）
+SESSION_CACHE_CONFIG = {
+    'backend': 'memory',                # memory: 进程内LRU；redis: 多进程共享（需要 pip install redis）
+    'max_sessions': 10000,              # 进程内最多缓存的会话数，超出后淘汰最久未使用的
+    'ttl': 1800                         # 会话空闲超过该秒数后失效
+}
+
+# 对话消息写库配置：消息先进入内存队列，由后台任务批量写入
+PERSISTENCE_CONFIG = {
+    'flush_interval': 0.2,              # 后台写入间隔（秒）
+    'max_batch': 500,                   # 每批最多写入的条数，队列积压达到该数量时立即写入
+    'max_retries': 3,                   # 数据库不可用时同一批的重试次数，超过后丢弃并记录日志
+    'flush_on_shutdown': True,          # 停止服务时写完队列中的数据
+    'sync': False                       # True 时每条消息立即写库（测试或需要强一致时使用）
+}
+
+# 流式输出配置
+STREAM_CONFIG = {
+    'relay_mode': 'content',            # content: 只转发回复文本 {"content": ...}；raw: 原样转发上游的数据帧
+    'flush_interval': 0.02,             # 合并输出片段的时间窗口（秒），0 表示每个片段单独发送
+    'flush_bytes': 512,                 # 缓冲的片段达到该字节数时立即发送
+    'disconnect_check_interval': 1.0    # 检查客户端是否断开、断开后是否重新连接的间隔（秒），0 表示不检查
+}
+
+# 可续传的流式输出：连接中断后客户端带上 Last-Event-ID 重新连接，继续接收同一次生成的输出
+RESUME_CONFIG = {
+    'backend': 'memory',                # memory: 只能在本进程内续传；redis: 输出同时写入 Redis，可以从其他进程续传（需要 pip install redis）
+    'max_frames': 2000,                 # 每次生成最多保留的帧数，更早的帧被覆盖后无法补发
+    'grace': 60,                        # 生成结束后保留输出的秒数
+    'idle_timeout': 15,                 # 客户端断开后超过该秒数没有重新连接就停止生成，0 表示断开后立即停止
+    'max_age': 3600                     # redis: 输出的最长保留时间（秒），防止生成异常中断后残留
+}
+
+# 调用上游的准入控制（可在管理后台按服务商覆盖 max_concurrency 和 max_queue）
+ADMISSION_CONFIG = {
+    'max_concurrency': 20,              # 每个服务商同时调用上游的最大请求数
+    'max_queue': 100,                   # 每个服务商的排队请求数上限，超出后直接拒绝
+    'max_queue_per_user': 3,            # 同一用户在一个服务商上最多排队的请求数
+    'queue_timeout': 60,                # 排队超过该秒数仍未轮到则放弃
+    'report_interval': 1                # 排队期间检查并推送排队位置的间隔（秒）
+}
+
+# 多服务商路由配置（同一 model_id 配置在多个服务商下时生效）
+UPSTREAM_CONFIG = {
+    'alpha': 0.2,                       # 首 token 延迟和错误率的指数移动平均系数，越大越看重最近的请求
+    'error_threshold': 0.5,             # 错误率达到该值的服务商暂停使用
+    'min_samples': 5,                   # 至少有这么多次请求后才会因错误率暂停
+    'cooldown': 30                      # 暂停时长（秒），之后重新尝试
+}
+
+# 回复缓存：同一模型收到完全相同的上下文时直接返回上次的回复（需在管理后台为模型开启）
+RESPONSE_CACHE_CONFIG = {
+    'backend': 'memory',                # memory: 进程内LRU；redis: 多进程共享（需要 pip install redis）
+    'max_entries': 1000,                # 进程内最多缓存的回复数
+    'max_bytes': 64 * 1024 * 1024,      # 进程内缓存的回复总字节数上限
+    'max_entry_bytes': 256 * 1024,      # 超过该字节数的回复不缓存
+    'ttl': 3600                         # 回复缓存的有效期（秒）
+}
+
+# 性能指标（GET /metrics，Prometheus 文本格式）
+METRICS_CONFIG = {
+    'enabled': True,
+    'token': None,                      # 设置后抓取时需携带 Authorization: Bearer <token>，为空时需要管理员登录
+    'loop_lag_interval': 0.5            # 检测事件循环延迟的间隔（秒）
+}
+
+# 对话消息全文搜索
+SEARCH_CONFIG = {
+    'min_length': 2,                    # 搜索词的最短字符数，与 MySQL 的 ngram_token_size 一致，更短的词无法命中
+    'page_size': 20,                    # 每页结果数
+    'snippet_length': 80,               # 摘要长度（字符）
+    'max_execution_ms': 1000            # 单次搜索的最长执行时间，超时返回错误而不是一直占用连接
+}
+
+# 对话导出/导入（JSON Lines，可选 gzip）
+ARCHIVE_CONFIG = {
+    'fetch_size': 1000,                 # 导出时每次从数据库读取的行数
+    'import_batch_size': 500,           # 导入时每条多行 INSERT 写入的行数
+    'gzip_level': 6,                    # gzip 压缩级别（1-9）
+    'max_exports': 4,                   # 同时进行的导出数上限（每个导出占用一个数据库连接，不超过连接池 maxsize - 1）
+    'send_timeout': 60                  # 导出时单次写出给客户端的最长等待时间（秒），超过后中止下载、归还连接
+}
+
+# 冷消息归档（python migrate.py archive）：超过 days 天没有更新的会话，其消息移到归档表
+MESSAGE_ARCHIVE_CONFIG = {
+    'days': 180,                        # 会话多久没有更新算作冷数据
+    'batch_size': 200                   # 每个事务归档的会话数
+}
+
+# 用量统计（/api/admin/usage）
+USAGE_CONFIG = {
+    'default_days': 30,                 # 未指定开始日期时统计最近的天数
+    'max_days': 366,                    # 单次查询的最大天数
+    'stream_usage': True                # 请求上游在流式输出结束时返回 token 用量（stream_options.include_usage），服务商不支持时关闭，改为本地估算
+}
+
+# 按用户的 token 配额和请求频率限制（None 表示不限制），在调用上游之前检查
+QUOTA_CONFIG = {
+    'backend': 'memory',                # memory: 进程内计数；redis: 多进程共享（需要 pip install redis）
+    'user_daily_tokens': None,          # 每个用户每天在全部模型上可用的 token 数
+    'user_rpm': None,                   # 每个用户每分钟的请求数
+    'model_daily_tokens': None,         # 每个用户每天在单个模型上可用的 token 数（模型配置未设置时使用）
+    'model_rpm': None                   # 每个用户每分钟在单个模型上的请求数（模型配置未设置时使用）
+}
+
+# 登录会话和鉴权用户记录缓存
+AUTH_CONFIG = {
+    'backend': 'memory',                # memory: 进程内保存，重启后需要重新登录，只能单进程运行；redis: 多进程共享，修改用户后所有进程立即生效（需要 pip install redis）
+    'session_ttl': 7 * 86400,           # 登录会话的有效期（秒）
+    'user_ttl': 60,                     # 用户状态和权限的缓存时间（秒）
+    'workers': 1,                       # 部署的工作进程数（uvicorn --workers / gunicorn -w），大于1时 backend 必须为 redis
+    'cookie_secure': False              # 只通过 HTTPS 发送会话 cookie（部署在 HTTPS 之后时开启）
+}
@@ -0,0 +1,49 @@
+import re
+
+# 中日韩字符及全角符号，大致每个字符对应一个 token
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+# 每条消息在对话格式中的额外开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    # 不依赖具体分词器的粗略估算：CJK 字符按 1 token/字，其余按 4 字符/token
+    cjk = _CJK_RE.subn("", text)[1]
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(content: str) -> int:
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(max_tokens, reply_reserve_ratio: float, default_max_tokens: int) -> int:
+    # 模型的 max_tokens 中预留一部分给回复，其余作为上下文预算
+    return max(int((max_tokens or default_max_tokens) * (1 - reply_reserve_ratio)), 1)
+
+
+def build_context(history, message: str, budget: int):
+    # history: [(role, content), ...]，按时间从新到旧排列
+    # 当前消息总是保留，然后从最近的历史开始向前填充，直到超出预算
+    context = [{"role": "user", "content": message}]
+    used = message_tokens(message)
+    for role, content in history:
+        cost = message_tokens(content)
+        if used + cost > budget:
+            break
+        context.append({"role": role, "content": content})
+        used += cost
+    context.reverse()
+    return context
+
+
+def chat_payload(model_id: str, history, message: str, budget: int, include_usage: bool = False):
+    # 发给服务商的请求体。token 预算只用于截取历史消息，不设置 max_tokens，回复长度不受预算限制
+    payload = {
+        "model": model_id,
+        "messages": build_context(history, message, budget),
+        "stream": True
+    }
+    if include_usage:
+        payload["stream_options"] = {"include_usage": True}
+    return payload
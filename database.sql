@@ -12,7 +12,9 @@ CREATE TABLE IF NOT EXISTS users (
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     last_login TIMESTAMP NULL COMMENT '最后登录时间',
     status TINYINT DEFAULT 1 COMMENT '用户状态：1-正常，0-禁用',
-    is_admin TINYINT DEFAULT 0 COMMENT '是否为管理员：1-是，0-否'
+    is_admin TINYINT DEFAULT 0 COMMENT '是否为管理员：1-是，0-否',
+    message_count INT NOT NULL DEFAULT 0 COMMENT '消息总数（包括已归档的消息）',
+    sent_count INT NOT NULL DEFAULT 0 COMMENT '用户发送的消息数'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='用户表';
 
 -- API服务商表
@@ -23,6 +25,13 @@ CREATE TABLE IF NOT EXISTS api_providers (
     api_key VARCHAR(500) NOT NULL COMMENT 'API密钥',
     description TEXT COMMENT '服务商描述',
     status TINYINT DEFAULT 1 COMMENT '状态：1-启用，0-禁用',
+    max_connections INT DEFAULT NULL COMMENT '最大连接数',
+    keepalive_expiry FLOAT DEFAULT NULL COMMENT '空闲连接保持时间（秒）',
+    connect_timeout FLOAT DEFAULT NULL COMMENT '连接超时（秒）',
+    read_timeout FLOAT DEFAULT NULL COMMENT '读取超时（秒）',
+    http2 TINYINT DEFAULT NULL COMMENT '是否启用HTTP/2：1-是，0-否，NULL-使用默认值',
+    max_concurrency INT DEFAULT NULL COMMENT '同时调用上游的最大请求数',
+    max_queue INT DEFAULT NULL COMMENT '排队请求数上限',
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='API服务商表';
@@ -37,6 +46,10 @@ CREATE TABLE IF NOT EXISTS model_configs (
     max_tokens INT DEFAULT 4096 COMMENT '最大token数',
     status TINYINT DEFAULT 1 COMMENT '状态：1-启用，0-禁用',
     sort_order INT DEFAULT 0 COMMENT '排序权重',
+    hedge_delay_ms INT DEFAULT NULL COMMENT '对冲延迟（毫秒），同一模型有多个服务商时首个超过该时间未返回就同时请求下一个',
+    cache_enabled TINYINT DEFAULT 0 COMMENT '回复缓存：1-相同的上下文直接返回上次的回复，0-不缓存',
+    daily_token_quota INT DEFAULT NULL COMMENT '每个用户每天在该模型上可用的 token 数',
+    rpm_limit INT DEFAULT NULL COMMENT '每个用户每分钟在该模型上的请求数',
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
     INDEX idx_provider_id (provider_id),
@@ -51,32 +64,90 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     session_id VARCHAR(100) NOT NULL UNIQUE COMMENT '会话ID',
     user_id INT NOT NULL COMMENT '用户ID',
     title VARCHAR(200) DEFAULT '新对话' COMMENT '会话标题',
+    preview VARCHAR(60) DEFAULT NULL COMMENT '首条用户消息预览（前50个字符）',
+    message_count INT NOT NULL DEFAULT 0 COMMENT '会话消息数',
+    archived TINYINT NOT NULL DEFAULT 0 COMMENT '消息是否已归档：1-在归档表，0-在消息表',
     model_id VARCHAR(100) NOT NULL COMMENT '当前使用的模型ID',
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
     is_active TINYINT DEFAULT 1 COMMENT '是否活跃：1-活跃，0-已结束',
-    INDEX idx_user_id (user_id),
-    INDEX idx_session_id (session_id),
-    INDEX idx_update_time (update_time),
+    INDEX idx_user_update (user_id, update_time),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='对话会话表';
 
 -- AI对话消息表（存储单条消息记录）
 CREATE TABLE IF NOT EXISTS ai_chat_messages (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    session_id VARCHAR(100) NOT NULL COMMENT '会话ID',
+    session_key INT NOT NULL COMMENT '会话主键（chat_sessions.id）',
     user_id INT NOT NULL COMMENT '用户ID',
     role ENUM('user', 'assistant') NOT NULL COMMENT '消息角色：user-用户，assistant-助手',
     content TEXT NOT NULL COMMENT '消息内容',
+    prompt_tokens INT DEFAULT NULL COMMENT '本次调用的输入 token 数（助手消息）',
+    completion_tokens INT DEFAULT NULL COMMENT '本次调用的输出 token 数（助手消息）',
+    truncated TINYINT NOT NULL DEFAULT 0 COMMENT '回复是否被中途停止（助手消息）',
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
-    INDEX idx_session_id (session_id),
-    INDEX idx_user_id (user_id),
-    INDEX idx_create_time (create_time),
-    INDEX idx_session_user (session_id, user_id),
+    INDEX idx_session_message (session_key, id),
+    INDEX idx_user_role (user_id, role),
+    FULLTEXT INDEX ft_content (content) WITH PARSER ngram,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id) ON DELETE CASCADE
+    CONSTRAINT fk_message_session FOREIGN KEY (session_key) REFERENCES chat_sessions(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='AI对话消息表';
 
+-- AI对话消息归档表（长期未更新会话的消息，结构与消息表相同，保留原消息ID）
+CREATE TABLE IF NOT EXISTS ai_chat_messages_archive (
+    id INT PRIMARY KEY COMMENT '原消息ID',
+    session_key INT NOT NULL COMMENT '会话主键（chat_sessions.id）',
+    user_id INT NOT NULL COMMENT '用户ID',
+    role ENUM('user', 'assistant') NOT NULL COMMENT '消息角色：user-用户，assistant-助手',
+    content TEXT NOT NULL COMMENT '消息内容',
+    prompt_tokens INT DEFAULT NULL COMMENT '本次调用的输入 token 数（助手消息）',
+    completion_tokens INT DEFAULT NULL COMMENT '本次调用的输出 token 数（助手消息）',
+    truncated TINYINT NOT NULL DEFAULT 0 COMMENT '回复是否被中途停止（助手消息）',
+    create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    INDEX idx_session_message (session_key, id),
+    INDEX idx_user_role (user_id, role),
+    CONSTRAINT fk_archive_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT fk_archive_session FOREIGN KEY (session_key) REFERENCES chat_sessions(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='AI对话消息归档表';
+
+-- 每日用量汇总（按 天/用户/模型），删除会话不会减少，导入的历史消息不计入
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day DATE NOT NULL COMMENT '日期',
+    user_id INT NOT NULL COMMENT '用户ID',
+    model_id VARCHAR(100) NOT NULL COMMENT '模型ID',
+    messages INT NOT NULL DEFAULT 0 COMMENT '消息数（用户和助手）',
+    sent_count INT NOT NULL DEFAULT 0 COMMENT '用户发送的消息数',
+    tokens BIGINT NOT NULL DEFAULT 0 COMMENT '模型调用的 token 数（prompt + completion）',
+    PRIMARY KEY (day, user_id, model_id),
+    INDEX idx_user_day (user_id, day),
+    CONSTRAINT fk_usage_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='每日用量汇总';
+
+-- 已执行的数据库迁移（migrations/ 目录），由 migrate.py 维护
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY COMMENT '迁移编号',
+    name VARCHAR(200) NOT NULL COMMENT '迁移文件名',
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='数据库迁移记录';
+
+-- 本脚本已包含以下迁移的结果，新建的数据库不需要再执行
+INSERT INTO schema_migrations (version, name) VALUES
+(1, '001_provider_http_settings.sql'),
+(2, '002_session_preview.sql'),
+(3, '003_history_pagination_index.sql'),
+(4, '004_provider_admission_limits.sql'),
+(5, '005_model_hedge_delay.sql'),
+(6, '006_model_response_cache.sql'),
+(7, '007_message_fulltext_index.sql'),
+(8, '008_message_session_key.sql'),
+(9, '009_message_archive.sql'),
+(10, '010_usage_counters.sql'),
+(11, '011_token_usage.sql'),
+(12, '012_message_truncated.sql'),
+(13, '013_provider_http2_default.sql'),
+(14, '014_drop_redundant_session_indexes.sql')
+ON DUPLICATE KEY UPDATE version=version;
+
 -- 插入测试用户（密码为123456的哈希值）
 INSERT INTO users (username, password, is_admin) VALUES 
 ('admin', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj6ukXN/8cjC', 1),
@@ -0,0 +1,322 @@
+import asyncio
+import functools
+import logging
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import pymysql
+import pymysql.cursors
+from pymysql.constants import SERVER_STATUS
+
+logger = logging.getLogger(__name__)
+
+# 连接级错误：出现后连接不再可信，归还时直接回收
+CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+# 不需要事务的语句：不加锁的查询。连接处于自动提交模式，这些语句执行完不会留下事务
+_READ_RE = re.compile(r"\s*(?:/\*.*?\*/\s*)*(?:SELECT|SHOW|EXPLAIN|DESCRIBE|DESC)\b", re.I | re.S)
+_LOCKING_RE = re.compile(r"\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", re.I)
+
+
+def is_read(query):
+    return bool(_READ_RE.match(query)) and not _LOCKING_RE.search(query)
+
+
+class PoolTimeoutError(Exception):
+    """在 acquire_timeout 内没有拿到空闲连接"""
+
+
+class AsyncCursor:
+    # pymysql 游标的异步包装：execute 放到连接池线程中执行，
+    # 缓冲游标的 fetch 直接读内存结果，非缓冲游标（SSCursor）的 fetch 同样放到线程中
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+        self._unbuffered = isinstance(cursor, pymysql.cursors.SSCursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    async def execute(self, query, args=None):
+        await self._conn.prepare(query)
+        return await self._timed(self._cursor.execute, query, args)
+
+    async def executemany(self, query, args):
+        await self._conn.prepare(query)
+        return await self._timed(self._cursor.executemany, query, args)
+
+    async def _timed(self, fn, query, args):
+        on_query = self._conn._pool.on_query
+        if on_query is None:
+            return await self._conn.run(fn, query, args)
+        start = time.perf_counter()
+        try:
+            return await self._conn.run(fn, query, args)
+        finally:
+            # 包含在线程池中排队的时间
+            on_query(query, args, time.perf_counter() - start)
+
+    async def fetchone(self):
+        if self._unbuffered:
+            return await self._conn.run(self._cursor.fetchone)
+        return self._cursor.fetchone()
+
+    async def fetchmany(self, size=None):
+        if self._unbuffered:
+            return await self._conn.run(self._cursor.fetchmany, size)
+        return self._cursor.fetchmany(size)
+
+    async def fetchall(self):
+        if self._unbuffered:
+            return await self._conn.run(self._cursor.fetchall)
+        return self._cursor.fetchall()
+
+    async def close(self):
+        if self._unbuffered:
+            # SSCursor 关闭时需要读完剩余结果集
+            await self._conn.run(self._cursor.close)
+        else:
+            self._cursor.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class PooledConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.broken = False
+
+    async def run(self, fn, *args):
+        try:
+            return await self._pool.run_in_executor(fn, *args)
+        except CONNECTION_ERRORS:
+            self.broken = True
+            raise
+        except asyncio.CancelledError:
+            # 线程里的调用仍在使用这条连接，不能再放回池中
+            self.broken = True
+            raise
+
+    def cursor(self, cursor_class=None):
+        return AsyncCursor(self, self.raw.cursor(cursor_class))
+
+    async def prepare(self, query):
+        # 连接以自动提交模式打开，只读查询不开启事务，归还时也不需要回滚；
+        # 写入和加锁读之前开启事务，直到 commit / rollback，调用方仍按“执行若干语句后提交”的方式使用
+        if not self.in_transaction and not is_read(query):
+            await self.run(self.raw.begin)
+
+    async def commit(self):
+        if self.in_transaction:
+            await self.run(self.raw.commit)
+
+    async def rollback(self):
+        if self.in_transaction:
+            await self.run(self.raw.rollback)
+
+    @property
+    def in_transaction(self):
+        return bool(self.raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+
+
+class ConnectionPool:
+    def __init__(self, minsize=1, maxsize=10, acquire_timeout=10.0,
+                 health_check_interval=30.0, recycle=3600.0, on_query=None, **connect_kwargs):
+        if minsize > maxsize:
+            raise ValueError("minsize 不能大于 maxsize")
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.recycle = recycle
+        # on_query(query, args, seconds)：每条语句执行完成后调用，用于统计耗时（executemany 时 args 为参数列表）
+        self.on_query = on_query
+        self._connect_kwargs = connect_kwargs
+        # 信号量在 open() 中创建，保证绑定到运行中的事件循环
+        self._sem = None
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        # 专用线程池：数据库调用不占用默认线程池，也不会阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=maxsize, thread_name_prefix="db-pool")
+        self._counters = {
+            "acquired": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+        }
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    async def run_in_executor(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    async def open(self):
+        self._closed = False
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.maxsize)
+        try:
+            conns = await asyncio.gather(*(self._connect() for _ in range(self.minsize - self._size)))
+        except Exception as e:
+            # 启动时数据库不可用不影响服务启动，连接会在首次使用时按需创建
+            logger.warning("连接池预热失败: %s", e)
+            return
+        for conn in conns:
+            self._idle.append(conn)
+
+    async def close(self):
+        # 仍被借出的连接在归还时关闭
+        self._closed = True
+        while self._idle:
+            self._discard(self._idle.pop())
+        self._executor.shutdown(wait=False)
+
+    async def _connect(self):
+        raw = await self.run_in_executor(functools.partial(pymysql.connect, **{**self._connect_kwargs, "autocommit": True}))
+        self._size += 1
+        self._counters["created"] += 1
+        return PooledConnection(self, raw)
+
+    def _discard(self, conn):
+        self._size -= 1
+        self._counters["recycled"] += 1
+        # 关闭放到线程中且不等待，避免在取消/清理路径上再次 await；
+        # 连接池关闭后线程池已停止，直接关闭（关闭期间归还的连接）
+        try:
+            self._executor.submit(conn.raw.close)
+        except RuntimeError:
+            try:
+                conn.raw.close()
+            except Exception:
+                pass
+
+    async def _checkout(self):
+        while self._idle:
+            # LIFO：最近归还的连接最可能仍然有效
+            conn = self._idle.pop()
+            now = time.monotonic()
+            if self.recycle and now - conn.created_at > self.recycle:
+                self._discard(conn)
+                continue
+            if self.health_check_interval is not None and now - conn.last_used > self.health_check_interval:
+                try:
+                    await self.run_in_executor(conn.raw.ping, False)
+                except Exception:
+                    self._counters["health_check_failures"] += 1
+                    self._discard(conn)
+                    continue
+            return conn
+        return await self._connect()
+
+    async def acquire(self):
+        if self._closed:
+            raise RuntimeError("连接池已关闭")
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.maxsize)
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            await self._acquire_permit()
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            raise PoolTimeoutError(f"{self.acquire_timeout}秒内未获取到数据库连接")
+        finally:
+            self._waiting -= 1
+        try:
+            conn = await self._checkout()
+        except BaseException:
+            self._sem.release()
+            raise
+        waited = time.monotonic() - start
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+        self._counters["acquired"] += 1
+        self._in_use += 1
+        return conn
+
+    async def _acquire_permit(self):
+        if hasattr(asyncio, "timeout"):
+            # Python 3.11 起超时通过取消实现，获取成功后再被取消时 Semaphore 会归还名额
+            async with asyncio.timeout(self.acquire_timeout):
+                await self._sem.acquire()
+            return
+        # 更早的版本中 wait_for 可能在获取成功的同时超时并丢弃结果，名额永久丢失；
+        # 获取放在单独的任务中，超时或被取消后如果已经获取到就归还
+        acquire = asyncio.ensure_future(self._sem.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(acquire), self.acquire_timeout)
+        except BaseException:
+            acquire.cancel()
+            try:
+                await acquire
+            except asyncio.CancelledError:
+                pass
+            else:
+                self._sem.release()
+            raise
+
+    async def release(self, conn):
+        try:
+            if self._closed or conn.broken or not conn.raw.open:
+                # 连接池已关闭时不再回滚，关闭连接即放弃未提交的事务
+                self._discard(conn)
+                return
+            if conn.in_transaction:
+                # 未提交的写入事务不能带回池中；只读查询在自动提交模式下执行，不需要回滚
+                try:
+                    await conn.rollback()
+                except Exception:
+                    conn.broken = True
+            if conn.broken or not conn.raw.open:
+                self._discard(conn)
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+        finally:
+            self._in_use -= 1
+            self._sem.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            conn.broken = True
+            raise
+        finally:
+            await self.release(conn)
+
+    def stats(self):
+        acquired = self._counters["acquired"]
+        return {
+            "minsize": self.minsize,
+            "maxsize": self.maxsize,
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "saturation": round(self._in_use / self.maxsize, 3),
+            "wait_time_avg_ms": round(self._wait_time_total / acquired * 1000, 3) if acquired else 0.0,
+            "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+            **self._counters,
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import importlib.util
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 依赖 h2 包（pip install httpx[http2]），未安装时自动退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# api_providers 表中可按服务商覆盖的连接参数，NULL 表示使用 HTTP_CLIENT_CONFIG 中的默认值
+PROVIDER_HTTP_FIELDS = ("max_connections", "keepalive_expiry", "connect_timeout", "read_timeout", "http2")
+
+
+class _ClientEntry:
+    def __init__(self, client, settings):
+        self.client = client
+        self.settings = settings
+        self.leases = 0
+        self.retired = False
+
+
+class ProviderClientRegistry:
+    # 每个服务商（api_providers.id）一个长期存活的 httpx.AsyncClient，复用 TCP/TLS 连接
+    def __init__(self, defaults):
+        self._defaults = dict(defaults)
+        self._entries = {}
+
+    def settings_for(self, provider):
+        # provider: 包含 base_url 以及 PROVIDER_HTTP_FIELDS 的字典
+        settings = {"base_url": provider["base_url"]}
+        for field in PROVIDER_HTTP_FIELDS:
+            value = provider.get(field)
+            settings[field] = self._defaults[field] if value is None else value
+        settings["http2"] = bool(settings["http2"])
+        return settings
+
+    def _build(self, settings):
+        http2 = settings["http2"] and HTTP2_AVAILABLE
+        if settings["http2"] and not HTTP2_AVAILABLE:
+            logger.warning("未安装 h2，服务商 %s 使用 HTTP/1.1", settings["base_url"])
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=min(self._defaults["max_keepalive_connections"], settings["max_connections"]),
+                keepalive_expiry=settings["keepalive_expiry"],
+            ),
+            timeout=httpx.Timeout(
+                connect=settings["connect_timeout"],
+                read=settings["read_timeout"],
+                write=self._defaults["write_timeout"],
+                pool=self._defaults["pool_timeout"],
+            ),
+        )
+
+    def configure(self, provider_id, provider):
+        # 新建或重建客户端；旧客户端在正在进行的请求结束后关闭
+        settings = self.settings_for(provider)
+        entry = self._entries.get(provider_id)
+        if entry is not None and entry.settings == settings:
+            return entry
+        new_entry = _ClientEntry(self._build(settings), settings)
+        self._entries[provider_id] = new_entry
+        if entry is not None:
+            self._retire(entry)
+        return new_entry
+
+    def remove(self, provider_id):
+        entry = self._entries.pop(provider_id, None)
+        if entry is not None:
+            self._retire(entry)
+
+    def _retire(self, entry):
+        entry.retired = True
+        if entry.leases == 0:
+            asyncio.get_running_loop().create_task(entry.client.aclose())
+
+    def sync(self, providers):
+        # providers: {provider_id: provider_dict}，与路由表保持一致，多余的客户端被回收
+        for provider_id, provider in providers.items():
+            self.configure(provider_id, provider)
+        for provider_id in list(self._entries):
+            if provider_id not in providers:
+                self.remove(provider_id)
+
+    @asynccontextmanager
+    async def client(self, provider_id, provider):
+        # 只按服务商ID取用客户端，不按调用方手中的设置重建：路由表重新加载时由 sync 统一更新，
+        # 否则持有新旧两份路由的请求会来回重建客户端。还没有客户端时（服务商刚被删除）按 provider 创建，
+        # 下次 sync 时回收
+        entry = self._entries.get(provider_id)
+        if entry is None:
+            entry = self.configure(provider_id, provider)
+        entry.leases += 1
+        try:
+            yield entry.client
+        finally:
+            entry.leases -= 1
+            if entry.retired and entry.leases == 0:
+                await entry.client.aclose()
+
+    async def close(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            await entry.client.aclose()
+
+    def stats(self):
+        return {
+            provider_id: {
+                "base_url": entry.settings["base_url"],
+                "http2": entry.settings["http2"] and HTTP2_AVAILABLE,
+                "in_flight": entry.leases,
+            }
+            for provider_id, entry in self._entries.items()
+        }
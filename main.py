@@ -1,31 +1,184 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, ValidationError
 from typing import Optional
 from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.exceptions import RequestValidationError
-import pymysql
 import json
 import hashlib
+import secrets
 import uuid
-import httpx
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from contextlib import asynccontextmanager
 import os
 import base64
-from config import MySQL_CONFIG
+import asyncio
+import logging
+from config import MySQL_CONFIG, DB_POOL_CONFIG, HTTP_CLIENT_CONFIG, ROUTING_CONFIG, PAGINATION_CONFIG, CONTEXT_CONFIG, SESSION_CACHE_CONFIG, PERSISTENCE_CONFIG, STREAM_CONFIG, ADMISSION_CONFIG, UPSTREAM_CONFIG, RESPONSE_CACHE_CONFIG, METRICS_CONFIG, SEARCH_CONFIG, ARCHIVE_CONFIG, USAGE_CONFIG, QUOTA_CONFIG, RESUME_CONFIG, AUTH_CONFIG
+from db import ConnectionPool, PoolTimeoutError
+from llm_clients import ProviderClientRegistry
+from routing import RoutingTable
+from redis_client import get_redis, close_redis
+from context import chat_payload, context_budget, estimate_tokens, message_tokens
+from session_cache import SessionContextCache, RedisSessionContextCache
+from persistence import PersistenceQueue
+from sse import content_frame, coalesce, TokenUsage
+from admission import AdmissionController
+from upstream import UpstreamRouter
+from response_cache import ResponseCache, RedisResponseCache, response_key
+from singleflight import SingleFlight
+import metrics
+from search import search_terms, boolean_query, highlight, encode_search_cursor, decode_search_cursor
+from pymysql.err import OperationalError, IntegrityError
+from archive import export_lines, gzip_chunks, read_lines, ArchiveImporter, ArchiveError, ExportLimiter
+from message_archive import message_table
+from usage import USER_COUNTS_SQL
+from quota import QuotaTracker, RedisQuotaTracker
+from cancellation import GenerationRegistry, stop_when_idle
+from resumable import ResumableStreams, RedisResumableStreams, StreamNotFound, StreamExpired, produce, relay
+from auth import AuthUser, SessionStore, RedisSessionStore
+import zlib
 
-app = FastAPI(title="AI Chat Assistant")
+logger = logging.getLogger(__name__)
+
+# 数据库连接池
+db_pool = ConnectionPool(
+    **DB_POOL_CONFIG, **MySQL_CONFIG,
+    on_query=metrics.observe_query if METRICS_CONFIG['enabled'] else None
+)
+
+# 各服务商的长连接HTTP客户端
+provider_clients = ProviderClientRegistry(HTTP_CLIENT_CONFIG)
+
+# 模型路由表（内存缓存），每次重建后同步服务商客户端
+routing_table = RoutingTable(
+    db_pool,
+    ttl=ROUTING_CONFIG['ttl'],
+    miss_reload_interval=ROUTING_CONFIG['miss_reload_interval'],
+    channel=ROUTING_CONFIG['channel'],
+    on_reload=lambda table: provider_clients.sync(table.providers)
+)
+
+# 按服务商和用户的上游准入控制
+admission = AdmissionController(ADMISSION_CONFIG)
+
+# 多服务商路由：按首 token 延迟和错误率选择服务商，失败时切换
+upstream_router = UpstreamRouter(provider_clients, admission, **UPSTREAM_CONFIG)
+
+# 消息延迟批量写库
+persistence = PersistenceQueue(db_pool, **PERSISTENCE_CONFIG)
+
+# 活跃会话的上下文缓存，连续对话时跳过历史消息查询
+if SESSION_CACHE_CONFIG['backend'] == 'redis':
+    session_cache = RedisSessionContextCache(
+        get_redis(), max_messages=CONTEXT_CONFIG['max_messages'], ttl=SESSION_CACHE_CONFIG['ttl']
+    )
+else:
+    session_cache = SessionContextCache(
+        max_sessions=SESSION_CACHE_CONFIG['max_sessions'],
+        max_messages=CONTEXT_CONFIG['max_messages'],
+        ttl=SESSION_CACHE_CONFIG['ttl']
+    )
+
+# 回复缓存，只对开启了缓存的模型生效
+if RESPONSE_CACHE_CONFIG['backend'] == 'redis':
+    response_cache = RedisResponseCache(
+        get_redis(), max_entry_bytes=RESPONSE_CACHE_CONFIG['max_entry_bytes'], ttl=RESPONSE_CACHE_CONFIG['ttl']
+    )
+else:
+    response_cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_CONFIG['max_entries'],
+        max_bytes=RESPONSE_CACHE_CONFIG['max_bytes'],
+        max_entry_bytes=RESPONSE_CACHE_CONFIG['max_entry_bytes'],
+        ttl=RESPONSE_CACHE_CONFIG['ttl']
+    )
+
+# 开启了回复缓存的模型，相同的请求并发到达时共用一个上游请求
+single_flight = SingleFlight()
+
+# 进行中的回复生成，按会话登记，用于停止生成
+generations = GenerationRegistry()
+
+# 生成的输出先写入可续传的缓冲，客户端断线后可以重新连接继续接收
+if RESUME_CONFIG['backend'] == 'redis':
+    resumable_streams = RedisResumableStreams(
+        get_redis(), max_frames=RESUME_CONFIG['max_frames'], grace=RESUME_CONFIG['grace'],
+        idle_timeout=RESUME_CONFIG['idle_timeout'], max_age=RESUME_CONFIG['max_age']
+    )
+else:
+    resumable_streams = ResumableStreams(
+        max_frames=RESUME_CONFIG['max_frames'], grace=RESUME_CONFIG['grace'], idle_timeout=RESUME_CONFIG['idle_timeout']
+    )
+
+# 后台任务保留引用直到完成，避免中途被回收
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# 按用户的 token 配额和请求频率限制
+if QUOTA_CONFIG['backend'] == 'redis':
+    quota = RedisQuotaTracker(
+        get_redis(), user_daily_tokens=QUOTA_CONFIG['user_daily_tokens'], user_rpm=QUOTA_CONFIG['user_rpm']
+    )
+else:
+    quota = QuotaTracker(db_pool, user_daily_tokens=QUOTA_CONFIG['user_daily_tokens'], user_rpm=QUOTA_CONFIG['user_rpm'])
+
+# 登录会话和鉴权用的用户记录缓存
+if AUTH_CONFIG['backend'] == 'redis':
+    auth_sessions = RedisSessionStore(
+        get_redis(), db_pool, session_ttl=AUTH_CONFIG['session_ttl'], user_ttl=AUTH_CONFIG['user_ttl']
+    )
+else:
+    # 进程内的会话只在本进程有效，注销和禁用用户也只作用于本进程。--workers / -w 指定的进程数在工作进程中无法可靠获取，
+    # 因此以 AUTH_CONFIG['workers'] 为准，同时检查 WEB_CONCURRENCY（uvicorn / gunicorn 的默认进程数），多进程时拒绝启动
+    workers = max(AUTH_CONFIG['workers'], int(os.environ.get("WEB_CONCURRENCY", "1")))
+    if workers > 1:
+        raise RuntimeError(f"AUTH_CONFIG['backend'] 为 memory 时只能单进程运行（当前为 {workers} 个进程），多进程部署请设为 redis")
+    auth_sessions = SessionStore(db_pool, session_ttl=AUTH_CONFIG['session_ttl'], user_ttl=AUTH_CONFIG['user_ttl'])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db_pool.open()
+    await routing_table.start(get_redis() if ROUTING_CONFIG['redis_pubsub'] else None)
+    persistence.start()
+    await quota.start()
+    loop_monitor = None
+    if METRICS_CONFIG['enabled']:
+        loop_monitor = asyncio.create_task(metrics.monitor_event_loop(METRICS_CONFIG['loop_lag_interval']))
+    yield
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+    await routing_table.stop()
+    # 先写完队列中的消息再关闭连接池
+    await persistence.close()
+    await provider_clients.close()
+    await close_redis()
+    await db_pool.close()
+
+app = FastAPI(title="AI Chat Assistant", lifespan=lifespan)
+
+# 按路由统计请求耗时
+if METRICS_CONFIG['enabled']:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 # 自定义验证错误处理器
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print(f"验证错误 - URL: {request.url}")
-    print(f"错误详情: {exc.errors()}")
-    print(f"请求体: {await request.body()}")
+    # 不记录请求体和出错的字段值，其中可能有密码或服务商的 API 密钥
+    errors = [(error.get("loc"), error.get("msg")) for error in exc.errors()]
+    logger.warning("验证错误 - URL: %s, 错误详情: %s", request.url.path, errors)
     return await request_validation_exception_handler(request, exc)
 
+# 连接池耗尽时快速返回503，而不是让请求一直挂起
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(status_code=503, content={"detail": "服务繁忙，请稍后重试"})
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -55,9 +208,14 @@ class ChatMessage(BaseModel):
 class ChatHistory(BaseModel):
     session_id: Optional[str] = None
 
+class ChatStop(BaseModel):
+    session_id: str
+
 class ChatHistoryByDateRange(BaseModel):
     start_time: str
     end_time: str
+    limit: Optional[int] = None
+    before: Optional[str] = None
 
 # 管理员相关模型
 class ApiProvider(BaseModel):
@@ -65,12 +223,28 @@ class ApiProvider(BaseModel):
     base_url: str
     api_key: str
     description: Optional[str] = None
+    # 连接参数，为空时使用 HTTP_CLIENT_CONFIG 默认值
+    max_connections: Optional[int] = None
+    keepalive_expiry: Optional[float] = None
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    http2: Optional[int] = None
+    # 并发限制，为空时使用 ADMISSION_CONFIG 默认值
+    max_concurrency: Optional[int] = None
+    max_queue: Optional[int] = None
 
 class ApiProviderUpdate(BaseModel):
     name: str
     base_url: str
     api_key: Optional[str] = None
     description: Optional[str] = None
+    max_connections: Optional[int] = None
+    keepalive_expiry: Optional[float] = None
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    http2: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    max_queue: Optional[int] = None
 
 class ModelConfig(BaseModel):
     provider_id: int
@@ -79,15 +253,22 @@ class ModelConfig(BaseModel):
     description: Optional[str] = None
     max_tokens: Optional[int] = 4096
     sort_order: Optional[int] = 0
+    # 对冲延迟（毫秒）：同一模型配置了多个服务商时，首个服务商超过该时间未返回就同时请求下一个；为空不启用
+    hedge_delay_ms: Optional[int] = None
+    # 回复缓存：1 表示相同的上下文直接返回上次的回复
+    cache_enabled: Optional[int] = 0
+    # 每个用户每天在该模型上可用的 token 数、每分钟的请求数；为空使用 QUOTA_CONFIG 中的默认值
+    daily_token_quota: Optional[int] = None
+    rpm_limit: Optional[int] = None
 
 class UserManagement(BaseModel):
     username: str
     status: int
     is_admin: Optional[int] = 0
 
-# 数据库连接
+# 数据库连接（从连接池借出，async with 结束时自动归还）
 def get_db_connection():
-    return pymysql.connect(**MySQL_CONFIG)
+    return db_pool.connection()
 
 # 工具函数
 def hash_password(password: str) -> str:
@@ -96,24 +277,28 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return hash_password(password) == hashed
 
-def get_current_user(request: Request):
-    user_id = request.cookies.get("user_id")
-    if not user_id:
+# 会话预览：首条用户消息的前50个字符
+def make_preview(content: str) -> str:
+    return content[:50] + "..." if len(content) > 50 else content
+
+# 按 session_token cookie 鉴权，使用缓存的用户记录，不访问数据库
+async def authenticate(request: Request) -> AuthUser:
+    token = request.cookies.get("session_token")
+    user = await auth_sessions.authenticate(token) if token else None
+    if user is None:
         raise HTTPException(status_code=401, detail="未登录")
-    return int(user_id)
+    if user.status != 1:
+        raise HTTPException(status_code=401, detail="账号已被禁用")
+    return user
 
-def get_admin_user(request: Request):
-    user_id = get_current_user(request)
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
-            result = cursor.fetchone()
-            if not result or result[0] != 1:
-                raise HTTPException(status_code=403, detail="需要管理员权限")
-            return user_id
-    finally:
-        conn.close()
+async def get_current_user(request: Request):
+    return (await authenticate(request)).id
+
+async def get_admin_user(request: Request):
+    user = await authenticate(request)
+    if user.is_admin != 1:
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+    return user.id
 
 # 生成默认头像（SVG格式，显示用户名首字母）
 def generate_default_avatar(username: str) -> str:
@@ -140,133 +325,112 @@ def generate_default_avatar(username: str) -> str:
 # 用户注册
 @app.post("/api/register")
 async def register(user_data: UserRegister):
-    conn = get_db_connection()
-    try:
+    async with get_db_connection() as conn:
         cursor = conn.cursor()
         username = user_data.username
         password = user_data.password
-        
+
         if not username or not password:
             raise HTTPException(status_code=400, detail="用户名和密码不能为空")
-        
+
         # 检查用户名是否存在
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cursor.fetchone():
+        await cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+        if await cursor.fetchone():
             raise HTTPException(status_code=400, detail="用户名已存在")
-        
+
         # 创建用户
         hashed_password = hash_password(password)
-        cursor.execute(
+        await cursor.execute(
             "INSERT INTO users (username, password) VALUES (%s, %s)",
             (username, hashed_password)
         )
-        conn.commit()
+        await conn.commit()
         return {"message": "注册成功"}
-    finally:
-        conn.close()
 
 # 用户登录
 @app.post("/api/login")
-async def login(user_data: UserLogin):
-    conn = get_db_connection()
-    try:
+async def login(user_data: UserLogin, response: Response):
+    async with get_db_connection() as conn:
         cursor = conn.cursor()
         username = user_data.username
         password = user_data.password
-        
+
         if not username or not password:
             raise HTTPException(status_code=400, detail="用户名和密码不能为空")
-        
-        cursor.execute(
-            "SELECT id, password FROM users WHERE username = %s",
+
+        await cursor.execute(
+            "SELECT id, password, status, is_admin FROM users WHERE username = %s",
             (username,)
         )
-        result = cursor.fetchone()
+        result = await cursor.fetchone()
         if not result or not verify_password(password, result[1]):
             raise HTTPException(status_code=401, detail="用户名或密码错误")
-        
+        if result[2] != 1:
+            raise HTTPException(status_code=403, detail="账号已被禁用")
+
         # 更新最后登录时间
-        cursor.execute(
+        await cursor.execute(
             "UPDATE users SET last_login = NOW() WHERE id = %s",
             (result[0],)
         )
-        conn.commit()
-        
-        response = {"message": "登录成功", "user_id": result[0]}
-        return response
-    finally:
-        conn.close()
+        await conn.commit()
+
+    # 会话令牌只放在 httponly cookie 中，前端脚本无法读取
+    token = await auth_sessions.create(result[0], AuthUser(result[0], result[2], result[3]))
+    response.set_cookie(
+        "session_token", token, max_age=AUTH_CONFIG['session_ttl'], httponly=True, samesite="lax",
+        secure=AUTH_CONFIG['cookie_secure']
+    )
+    return {"message": "登录成功", "user_id": result[0]}
+
+# 退出登录
+@app.post("/api/logout")
+async def logout(request: Request, response: Response):
+    token = request.cookies.get("session_token")
+    if token:
+        await auth_sessions.delete(token)
+    response.delete_cookie("session_token")
+    return {"message": "已退出登录"}
 
 # 获取可用模型列表
 @app.get("/api/models")
 async def get_models():
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT mc.model_id, mc.model_name, ap.name as provider_name
-                FROM model_configs mc 
-                JOIN api_providers ap ON mc.provider_id = ap.id 
-                WHERE mc.status = 1 AND ap.status = 1 
-                ORDER BY ap.name, mc.sort_order, mc.id
-            """)
-            models_data = []
-            providers = {}
-            for row in cursor.fetchall():
-                model_id, model_name, provider_name = row
-                if provider_name not in providers:
-                    providers[provider_name] = []
-                providers[provider_name].append({
-                    "model_id": model_id,
-                    "model_name": model_name
-                })
-                models_data.append(model_id)  # 保持向后兼容
-            
-            return {
-                "models": models_data,  # 向后兼容的简单列表
-                "providers": providers  # 按服务商分组的数据
-            }
-    finally:
-        conn.close()
+    # 直接使用内存中的路由表，不访问数据库
+    catalog = await routing_table.get_catalog()
+    return {
+        "models": catalog["models"],  # 向后兼容的简单列表
+        "providers": catalog["providers"]  # 按服务商分组的数据
+    }
 
 # 获取用户信息
 @app.get("/api/user/info")
 async def get_user_info(user_id: int = Depends(get_current_user)):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # 获取用户名和头像
-        cursor.execute("SELECT username, avatar FROM users WHERE id = %s", (user_id,))
-        user_result = cursor.fetchone()
-        if not user_result:
-            raise HTTPException(status_code=404, detail="用户不存在")
-        
-        username, avatar = user_result
-        
-        # 统计用户发送的消息数量
-        cursor.execute(
-            "SELECT COUNT(*) FROM ai_chat_messages WHERE session_id IN (SELECT session_id FROM chat_sessions WHERE user_id = %s) AND role = 'user'",
-            (user_id,)
-        )
-        message_count = cursor.fetchone()[0]
-        
-        # 如果没有头像，生成默认头像（用户名首字母）
-        if not avatar:
-            avatar = f"data:image/svg+xml;base64,{generate_default_avatar(username)}"
-        # 如果头像是旧的base64格式但不是默认头像，也生成新的默认头像
-        elif avatar.startswith('data:image/') and 'base64,' in avatar and len(avatar) > 1000:
-            avatar = f"data:image/svg+xml;base64,{generate_default_avatar(username)}"
-        
-        return {
-            "username": username,
-            "message_count": message_count,
-            "avatar": avatar
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            cursor = conn.cursor()
+
+            # 获取用户名、头像和发送的消息数（预聚合的计数，包括已归档的消息）
+            await cursor.execute("SELECT username, avatar, sent_count FROM users WHERE id = %s", (user_id,))
+            user_result = await cursor.fetchone()
+            if not user_result:
+                raise HTTPException(status_code=404, detail="用户不存在")
+
+            username, avatar, message_count = user_result
+
+            # 如果没有头像，生成默认头像（用户名首字母）
+            if not avatar:
+                avatar = f"data:image/svg+xml;base64,{generate_default_avatar(username)}"
+            # 如果头像是旧的base64格式但不是默认头像，也生成新的默认头像
+            elif avatar.startswith('data:image/') and 'base64,' in avatar and len(avatar) > 1000:
+                avatar = f"data:image/svg+xml;base64,{generate_default_avatar(username)}"
+
+            return {
+                "username": username,
+                "message_count": message_count,
+                "avatar": avatar
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 # 上传头像
 @app.post("/api/user/avatar")
@@ -298,22 +462,34 @@ async def upload_avatar(file: UploadFile = File(...), user_id: int = Depends(get
     avatar_url = f"/static/img/{filename}"
     
     # 更新数据库
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET avatar = %s WHERE id = %s", (avatar_url, user_id))
-        conn.commit()
-        
-        return {"message": "头像上传成功", "avatar": avatar_url}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            cursor = conn.cursor()
+            await cursor.execute("UPDATE users SET avatar = %s WHERE id = %s", (avatar_url, user_id))
+            await conn.commit()
+
+            return {"message": "头像上传成功", "avatar": avatar_url}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+# 流式响应的响应头
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # 关闭 nginx 等反向代理的响应缓冲，数据帧立即送达
+    "X-Accel-Buffering": "no",
+}
 
 # 发送消息（流式）
 @app.post("/api/chat/stream")
-async def chat_stream(chat_data: ChatMessage, user_id: int = Depends(get_current_user)):
+async def chat_stream(chat_data: ChatMessage, request: Request, user_id: int = Depends(get_current_user)):
+    raw_relay = STREAM_CONFIG['relay_mode'] == 'raw'
+    
     async def generate_response():
+        ticket = None
+        flight = None
+        quota_minute = None
+        metrics.ACTIVE_STREAMS.inc()
         try:
             message = chat_data.message
             model_id_selected = chat_data.model_id
@@ -323,261 +499,620 @@ async def chat_stream(chat_data: ChatMessage, user_id: int = Depends(get_current
                 yield f"data: {json.dumps({'error': '消息和模型ID不能为空'})}\n\n"
                 return
             
-            # 获取或创建会话
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            # 从内存路由表获取可提供该模型的服务商，按近期延迟和错误率排序
+            routes = await routing_table.get_routes(model_id_selected)
+            if not routes:
+                yield f"data: {json.dumps({'error': '模型配置不存在或已禁用'})}\n\n"
+                return
+            ranked = upstream_router.rank(routes)
+            
+            # 配额和请求频率在内存或 Redis 中检查，不访问数据库；同一模型有多个服务商时取最严格的限制。
+            # 请求数先计入，在获得准入之前结束（会话不存在、排队已满或超时等）时退回
+            quota_minute = await quota.acquire(
+                user_id, model_id_selected,
+                min((route["daily_token_quota"] for route in routes if route["daily_token_quota"] is not None),
+                    default=QUOTA_CONFIG['model_daily_tokens']),
+                min((route["rpm_limit"] for route in routes if route["rpm_limit"] is not None),
+                    default=QUOTA_CONFIG['model_rpm'])
+            )
             
+            # 读取会话和历史上下文（只读，消息在获得准入后再保存）
+            cached = None
+            history = []
             if session_id:
-                # 检查会话是否存在
-                cursor.execute(
-                    "SELECT id FROM chat_sessions WHERE session_id = %s AND user_id = %s",
-                    (session_id, user_id)
-                )
-                if not cursor.fetchone():
-                    yield f"data: {json.dumps({'error': '会话不存在'})}\n\n"
-                    return
+                async with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    # 检查会话是否存在，消息数用于判断缓存的上下文是否落后于数据库，
+                    # 其余字段用于在结束事件中返回更新后的会话信息
+                    await cursor.execute(
+                        "SELECT message_count, title, model_id, create_time, preview, id, archived FROM chat_sessions "
+                        "WHERE session_id = %s AND user_id = %s",
+                        (session_id, user_id)
+                    )
+                    row = await cursor.fetchone()
+                    if row is not None:
+                        message_count, title, session_model_id, create_time, preview, session_key, archived = row
+                    elif persistence.pending_owner(session_id) == user_id:
+                        # 本进程刚创建、尚未写入数据库的会话
+                        message_count, title, session_model_id, create_time, preview = 0, None, model_id_selected, datetime.now(), None
+                        session_key = None
+                    else:
+                        yield f"data: {json.dumps({'error': '会话不存在'})}\n\n"
+                        return
+                    
+                    # 优先使用缓存的上下文；未命中时只读取最近的若干条历史消息
+                    cached = await session_cache.get(session_id, user_id, min_total=message_count)
+                    if cached is not None:
+                        history, message_count = cached
+                    elif session_key is not None:
+                        await cursor.execute(
+                            f"SELECT role, content FROM {message_table(archived)} WHERE session_key = %s ORDER BY id DESC LIMIT %s",
+                            (session_key, CONTEXT_CONFIG['max_messages'])
+                        )
+                        history = [tuple(row) for row in reversed(await cursor.fetchall())]
             else:
-                # 创建新会话
-                session_id = str(uuid.uuid4())
-                cursor.execute(
-                    "INSERT INTO chat_sessions (session_id, user_id, model_id) VALUES (%s, %s, %s)",
-                    (session_id, user_id, model_id_selected)
-                )
-                conn.commit()
+                message_count, title, session_model_id, create_time, preview = 0, None, model_id_selected, datetime.now(), None
             
-            # 获取历史消息
-            cursor.execute(
-                "SELECT role, content FROM ai_chat_messages WHERE session_id = %s ORDER BY create_time ASC",
-                (session_id,)
-            )
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    "role": row[0],
-                    "content": row[1]
-                })
+            # 按模型的 token 预算从最近的消息开始截取上下文
+            # 切换服务商时上下文也要放得下，取各候选中最小的 max_tokens
+            max_tokens = min((route["max_tokens"] for route in routes if route["max_tokens"]), default=None)
+            budget = context_budget(max_tokens, CONTEXT_CONFIG['reply_reserve_ratio'], CONTEXT_CONFIG['default_max_tokens'])
+            payload = chat_payload(model_id_selected, history[::-1], message, budget, USAGE_CONFIG['stream_usage'])
             
-            # 添加用户消息到数组
-            messages.append({
-                "role": "user",
-                "content": message
-            })
+            # 模型开启了回复缓存时，相同的上下文直接返回上次的回复，不占用服务商的准入名额
+            flight_key = response_key(payload)
+            cache_key = flight_key if any(route["cache_enabled"] for route in routes) else None
+            reply = await response_cache.get(cache_key) if cache_key else None
             
-            # 保存用户消息到数据库
-            cursor.execute(
-                "INSERT INTO ai_chat_messages (session_id, user_id, role, content) VALUES (%s, %s, %s, %s)",
-                (session_id, user_id, "user", message)
-            )
-            conn.commit()
+            # 相同的请求正在调用上游时直接订阅它的输出（与是否开启回复缓存无关），同样不占用准入名额；
+            # 订阅立即计入，保存消息期间其他订阅者都离开也不会取消上游请求
+            flight = single_flight.get(flight_key) if reply is None else None
             
-            # 获取模型对应的API配置
-            cursor.execute("""
-                SELECT ap.base_url, ap.api_key 
-                FROM model_configs mc 
-                JOIN api_providers ap ON mc.provider_id = ap.id 
-                WHERE mc.model_id = %s AND mc.status = 1 AND ap.status = 1
-            """, (model_id_selected,))
-            api_config = cursor.fetchone()
-            if not api_config:
-                yield f"data: {json.dumps({'error': '模型配置不存在或已禁用'})}\n\n"
-                return
+            if reply is None and flight is None:
+                # 按服务商准入：优先使用能立即获得名额的服务商；都已满时在排名第一的服务商排队并推送排队位置，
+                # 队列已满或排队超时直接返回错误（在保存消息之前）
+                for route in ranked:
+                    ticket = admission.try_acquire(route["provider_id"], route["provider"], user_id)
+                    if ticket is not None:
+                        break
+                else:
+                    route = ranked[0]
+                    ticket = admission.acquire(route["provider_id"], route["provider"], user_id)
+                    async for position in ticket.positions(ADMISSION_CONFIG['report_interval'], ADMISSION_CONFIG['queue_timeout']):
+                        yield f"data: {json.dumps({'queue_position': position})}\n\n"
+                candidates = [route] + [other for other in ranked if other is not route]
+                # 排队期间相同的请求可能已经开始调用上游
+                flight = single_flight.get(flight_key)
+                if flight is not None:
+                    ticket.release()
+                    ticket = None
+            quota_minute = None
+            
+            # 保存用户消息；消息写入交给后台批量写库，模型请求不必等待数据库
+            if session_id:
+                # 同时更新会话消息数（旧会话没有预览时补上）
+                await persistence.add_message(session_id, user_id, "user", message, model_id_selected, preview=make_preview(message))
+            else:
+                # 创建新会话，首条消息即为会话预览
+                session_id = str(uuid.uuid4())
+                await persistence.create_session(session_id, user_id, model_id_selected, make_preview(message))
+                await persistence.add_message(session_id, user_id, "user", message, model_id_selected)
             
-            api_base_url, api_key = api_config
+            if cached is not None:
+                await session_cache.append(session_id, "user", message)
+            else:
+                await session_cache.put(session_id, user_id, history + [("user", message)], message_count + 1)
             
-            # 调用AI API
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                async with client.stream(
-                    "POST",
-                    f"{api_base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": model_id_selected,
-                        "messages": [{"role": msg["role"], "content": msg["content"]} for msg in messages[-10:]],
-                        "stream": True
-                    }
-                ) as response:
-                    assistant_message = ""
-                    async for line in response.aiter_lines():
-                        if line.strip():
-                            if line.startswith("data: "):
-                                data = line[6:]
-                                if data == "[DONE]":
-                                    break
-                                try:
-                                    chunk = json.loads(data)
-                                    if "choices" in chunk and len(chunk["choices"]) > 0:
-                                        delta = chunk["choices"][0].get("delta", {})
-                                        if "content" in delta:
-                                            content = delta["content"]
-                                            assistant_message += content
-                                            yield f"data: {json.dumps({'content': content})}\n\n"
-                                except json.JSONDecodeError:
-                                    continue
+            async def save_reply(assistant_message, usage, truncated):
+                # 服务商没有返回用量（命中回复缓存或中途停止）时按内容估算，计入配额并随助手回复保存
+                if usage is None:
+                    usage = TokenUsage(
+                        sum(message_tokens(item["content"]) for item in payload["messages"]), estimate_tokens(assistant_message)
+                    )
+                await quota.add_tokens(user_id, model_id_selected, usage.prompt_tokens + usage.completion_tokens)
+                # 保存助手回复，同时更新会话的最后更新时间和消息数
+                await persistence.add_message(
+                    session_id, user_id, "assistant", assistant_message, model_id_selected, usage=usage, truncated=truncated
+                )
+                await session_cache.append(session_id, "assistant", assistant_message)
+                return usage
             
-            # 保存助手回复到数据库
-            cursor.execute(
-                "INSERT INTO ai_chat_messages (session_id, user_id, role, content) VALUES (%s, %s, %s, %s)",
-                (session_id, user_id, "assistant", assistant_message)
-            )
+            usage = None
+            truncated = False
+            if reply is not None:
+                # 缓存命中：按合并输出的帧大小一次性发出，不再模拟逐字输出
+                size = STREAM_CONFIG['flush_bytes']
+                for start in range(0, len(reply), size):
+                    yield content_frame(reply[start:start + size])
+                assistant_message = reply
+            else:
+                # 回复片段先收集到列表，结束后一次拼接
+                parts = []
+                
+                def build_request(route):
+                    return (
+                        f"{route['provider']['base_url']}/chat/completions",
+                        {
+                            "Authorization": f"Bearer {route['api_key']}",
+                            "Content-Type": "application/json"
+                        },
+                        payload
+                    )
+                
+                if flight is not None:
+                    source = flight
+                else:
+                    # 模型配置了对冲延迟时，首个服务商迟迟没有返回就同时请求下一个
+                    hedge_delay_ms = next((candidate["hedge_delay_ms"] for candidate in candidates if candidate["hedge_delay_ms"]), None)
+                    # 调用AI API（复用各服务商的长连接客户端），出首个 token 前失败自动切换服务商
+                    source = upstream_router.stream(
+                        candidates, ticket, build_request, user_id, hedge_delay_ms / 1000 if hedge_delay_ms else None
+                    )
+                    # 交给后台任务调用上游，本请求与之后到达的相同请求一样作为订阅者读取输出；
+                    # 准入名额随上游请求结束释放
+                    source = flight = single_flight.start(flight_key, source, on_finish=ticket.release)
+                    ticket = None
+                
+                async def upstream():
+                    # 每个请求各自读取、合并输出并保存回复；服务商返回的用量不转发给客户端
+                    nonlocal usage
+                    async for line, content in source:
+                        if isinstance(content, TokenUsage):
+                            usage = content
+                            continue
+                        parts.append(content)
+                        # raw 模式原样转发上游的数据帧，省去重新编码
+                        yield line + "\n\n" if raw_relay else content
+                
+                # 登记本次生成，用户点击停止、或客户端断开后超过 idle_timeout 没有重新连接时立即停止读取上游，
+                # 已生成的部分照常保存。先告知客户端会话ID（新会话此时才有），以便停止
+                stop = generations.register(session_id, user_id)
+                yield f"data: {json.dumps({'session_id': session_id})}\n\n"
+                interval = STREAM_CONFIG['disconnect_check_interval']
+                watcher = asyncio.create_task(stop_when_idle(resumable_streams, stream_id, stop, interval)) if interval > 0 else None
+                try:
+                    # 相邻的片段合并后再写出，减少帧数和系统调用
+                    async for chunk in coalesce(upstream(), STREAM_CONFIG['flush_bytes'], STREAM_CONFIG['flush_interval'], stop):
+                        yield chunk if raw_relay else content_frame(chunk)
+                except (asyncio.CancelledError, GeneratorExit):
+                    # 生成任务被取消或关闭（例如停止服务）：停止上游，部分回复交给后台任务保存
+                    if not stop.is_set():
+                        metrics.STREAMS_STOPPED.inc("cancelled")
+                        stop.set()
+                    if parts:
+                        run_in_background(save_reply("".join(parts), None, True))
+                    raise
+                finally:
+                    if watcher is not None:
+                        watcher.cancel()
+                    generations.unregister(session_id, stop)
+                assistant_message = "".join(parts)
+                truncated = stop.is_set()
+                # 只缓存完整结束的回复，中途出错或停止的不会缓存
+                if cache_key and assistant_message and not truncated:
+                    await response_cache.put(cache_key, assistant_message)
             
-            # 更新会话的最后更新时间
-            cursor.execute(
-                "UPDATE chat_sessions SET update_time = NOW() WHERE session_id = %s",
-                (session_id,)
-            )
-            conn.commit()
+            usage = await save_reply(assistant_message, usage, truncated)
             
-            yield f"data: {json.dumps({'done': True, 'session_id': session_id})}\n\n"
+            # 结束事件附带更新后的会话摘要，客户端直接更新侧边栏，不必重新拉取会话列表
+            session = session_summary((
+                session_id, title or "新对话", session_model_id, create_time, datetime.now(),
+                preview or make_preview(message), message_count + 2
+            ))
+            yield f"data: {json.dumps({'done': True, 'session_id': session_id, 'session': session, 'usage': usage._asdict(), 'truncated': truncated})}\n\n"
                 
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
         finally:
-            if 'conn' in locals():
-                conn.close()
+            metrics.ACTIVE_STREAMS.dec()
+            if ticket is not None:
+                ticket.release()
+            if flight is not None:
+                await flight.aclose()
+            if quota_minute is not None:
+                await quota.release(user_id, model_id_selected, quota_minute)
     
+    # 生成在后台任务中进行，输出写入可续传的缓冲；响应只是缓冲的读取者，客户端断开不影响生成。
+    # 第一帧告知客户端输出ID，断线后用它续传
+    stream_id = await resumable_streams.create(user_id)
+    await resumable_streams.publish(stream_id, f"data: {json.dumps({'stream_id': stream_id})}\n\n")
+    run_in_background(produce(resumable_streams, stream_id, generate_response()))
+    return StreamingResponse(
+        relay(resumable_streams, stream_id, 0, request, STREAM_CONFIG['disconnect_check_interval'] or None),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+# 续传：连接中断后带上 Last-Event-ID（最后收到的帧序号）重新连接，先补发错过的帧，再继续接收同一次生成的输出
+@app.get("/api/chat/stream/{stream_id}")
+async def resume_chat_stream(stream_id: str, request: Request, user_id: int = Depends(get_current_user)):
+    try:
+        after = int(request.headers.get("last-event-id") or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的 Last-Event-ID")
+    try:
+        await resumable_streams.open(stream_id, user_id, after)
+    except StreamNotFound:
+        raise HTTPException(status_code=404, detail="输出不存在或已过期")
+    except StreamExpired:
+        raise HTTPException(status_code=410, detail="需要补发的输出已过期，请重新加载会话")
     return StreamingResponse(
-        generate_response(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        relay(resumable_streams, stream_id, after, request, STREAM_CONFIG['disconnect_check_interval'] or None),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
+# 停止生成：停止当前用户在该会话上进行中的回复，已生成的部分保存为截断的回复。
+# 登记只在本进程内，停止请求需要到达正在生成的进程
+@app.post("/api/chat/stop")
+async def chat_stop(data: ChatStop, user_id: int = Depends(get_current_user)):
+    if not generations.stop(data.session_id, user_id):
+        raise HTTPException(status_code=404, detail="没有进行中的回复")
+    return {"message": "已停止"}
+
+# 会话列表项，row: session_id, title, model_id, create_time, update_time, preview, message_count
+def session_summary(row):
+    preview = row[5] or "新对话"
+    return {
+        "session_id": row[0],
+        "title": row[1] or preview,
+        "model_id": row[2],
+        "create_time": row[3].isoformat(),
+        "update_time": row[4].isoformat(),
+        "preview": preview,
+        "message_count": row[6]
+    }
+
+# 分页大小：未指定时使用默认值，且不超过上限
+def page_size(limit: Optional[int], default: int) -> int:
+    if limit is None:
+        return default
+    return max(1, min(limit, PAGINATION_CONFIG['max_page_size']))
+
+# 会话分页游标：按 (update_time, id) 定位，对客户端不透明
+def encode_session_cursor(update_time, pk) -> str:
+    return base64.urlsafe_b64encode(f"{update_time.isoformat()}|{pk}".encode()).decode()
+
+def decode_session_cursor(value: str):
+    try:
+        update_time, pk = base64.urlsafe_b64decode(value.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(update_time), int(pk)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+# 按 update_time 倒序分页查询会话列表
+# before：比游标更早的一页；after：比游标更新的一页；都不传时返回最新的一页
+async def query_session_page(cursor, where: str, args: tuple, limit: int, before: Optional[str] = None, after: Optional[str] = None):
+    if before and after:
+        raise HTTPException(status_code=400, detail="before 和 after 不能同时使用")
+    sql = f"SELECT session_id, title, model_id, create_time, update_time, preview, message_count, id FROM chat_sessions WHERE {where}"
+    if before:
+        update_time, pk = decode_session_cursor(before)
+        sql += " AND (update_time < %s OR (update_time = %s AND id < %s))"
+        args += (update_time, update_time, pk)
+    elif after:
+        update_time, pk = decode_session_cursor(after)
+        sql += " AND (update_time > %s OR (update_time = %s AND id > %s))"
+        args += (update_time, update_time, pk)
+    order = "ASC" if after else "DESC"
+    sql += f" ORDER BY update_time {order}, id {order} LIMIT %s"
+    await cursor.execute(sql, args + (limit + 1,))
+    rows = list(await cursor.fetchall())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after:
+        rows.reverse()
+    return {
+        "sessions": [session_summary(row) for row in rows],
+        "has_more": has_more,  # before/默认：是否还有更早的会话；after：是否还有更新的会话
+        "next_cursor": encode_session_cursor(rows[-1][4], rows[-1][7]) if rows else None,
+        "prev_cursor": encode_session_cursor(rows[0][4], rows[0][7]) if rows else None
+    }
+
+def parse_message_cursor(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
 # 获取对话历史
+# 不传 session_id 时返回会话列表（按最后更新时间倒序分页）；
+# 传 session_id 时返回该会话的消息（默认最新一页，before/after 为消息ID）
 @app.get("/api/chat/history")
-async def get_chat_history(session_id: str = None, user_id: int = Depends(get_current_user)):
-    conn = get_db_connection()
-    try:
+async def get_chat_history(session_id: str = None, limit: Optional[int] = None, before: Optional[str] = None,
+                           after: Optional[str] = None, user_id: int = Depends(get_current_user)):
+    # 先写入本进程队列中的消息，保证能读到刚刚的对话
+    await persistence.flush()
+    async with get_db_connection() as conn:
         cursor = conn.cursor()
         if session_id:
-            # 获取指定会话的消息历史
-            cursor.execute(
-                "SELECT role, content, create_time FROM ai_chat_messages WHERE session_id = %s AND user_id = %s ORDER BY create_time ASC",
+            if before and after:
+                raise HTTPException(status_code=400, detail="before 和 after 不能同时使用")
+            page = page_size(limit, PAGINATION_CONFIG['message_page_size'])
+            
+            # 获取会话信息
+            await cursor.execute(
+                "SELECT model_id, create_time, id, archived FROM chat_sessions WHERE session_id = %s AND user_id = %s",
                 (session_id, user_id)
             )
+            session_info = await cursor.fetchone()
+            if not session_info:
+                return {"conversation": []}
+            
+            # 获取指定会话的一页消息（已归档的会话从归档表读取）
+            sql = f"SELECT id, role, content, create_time, truncated FROM {message_table(session_info[3])} WHERE session_key = %s"
+            args = (session_info[2],)
+            if before:
+                sql += " AND id < %s"
+                args += (parse_message_cursor(before),)
+            elif after:
+                sql += " AND id > %s"
+                args += (parse_message_cursor(after),)
+            sql += " ORDER BY id ASC LIMIT %s" if after else " ORDER BY id DESC LIMIT %s"
+            await cursor.execute(sql, args + (page + 1,))
+            rows = list(await cursor.fetchall())
+            has_more = len(rows) > page
+            rows = rows[:page]
+            if not after:
+                rows.reverse()
             messages = []
-            for row in cursor.fetchall():
+            for row in rows:
                 messages.append({
-                    "role": row[0],
-                    "content": row[1],
-                    "timestamp": row[2].isoformat()
+                    "id": row[0],
+                    "role": row[1],
+                    "content": row[2],
+                    "timestamp": row[3].isoformat(),
+                    "truncated": bool(row[4])
                 })
             
-            # 获取会话信息
-            cursor.execute(
-                "SELECT model_id, create_time FROM chat_sessions WHERE session_id = %s AND user_id = %s",
-                (session_id, user_id)
-            )
-            session_info = cursor.fetchone()
-            if session_info:
-                return {
-                    "conversation": messages,
-                    "model_id": session_info[0],
-                    "create_time": session_info[1].isoformat()
-                }
-            return {"conversation": []}
+            return {
+                "conversation": messages,
+                "model_id": session_info[0],
+                "create_time": session_info[1].isoformat(),
+                "has_more": has_more,  # before/默认：是否还有更早的消息；after：是否还有更新的消息
+                "next_cursor": str(rows[0][0]) if rows else None,
+                "prev_cursor": str(rows[-1][0]) if rows else None
+            }
         else:
-            # 获取所有会话列表
-            cursor.execute(
-                "SELECT session_id, title, model_id, create_time, update_time FROM chat_sessions WHERE user_id = %s ORDER BY update_time DESC",
-                (user_id,)
+            # 获取会话列表（预览和消息数已冗余在会话表中，一次查询完成）
+            result = await query_session_page(
+                cursor, "user_id = %s", (user_id,),
+                page_size(limit, PAGINATION_CONFIG['session_page_size']), before, after
             )
-            sessions = []
-            for row in cursor.fetchall():
-                # 获取每个会话的第一条消息作为预览
-                cursor.execute(
-                    "SELECT content FROM ai_chat_messages WHERE session_id = %s AND role = 'user' ORDER BY create_time ASC LIMIT 1",
-                    (row[0],)
-                )
-                first_message = cursor.fetchone()
-                preview = first_message[0][:50] + "..." if first_message and len(first_message[0]) > 50 else (first_message[0] if first_message else "新对话")
-                
-                sessions.append({
-                    "session_id": row[0],
-                    "title": row[1] or preview,
-                    "model_id": row[2],
-                    "create_time": row[3].isoformat(),
-                    "update_time": row[4].isoformat(),
-                    "preview": preview
-                })
-            return {"sessions": sessions}
-    finally:
-        conn.close()
+            if not before and not after:
+                # 最新一页附带增量同步标记，之后用 /api/chat/sessions/changes 只获取有变化的会话
+                result["sync_token"] = result["sessions"][0]["update_time"] if result["sessions"] else None
+            return result
+
+# 会话列表增量同步：返回 since 以来有更新的会话（按更新时间正序），客户端按 session_id 合并到本地列表。
+# 按 update_time >= since 比较，同一秒内的更新不会遗漏，边界上的会话可能重复返回；
+# has_more 为真时说明变化太多，客户端应重新加载整个列表
+@app.get("/api/chat/sessions/changes")
+async def get_session_changes(since: str, limit: Optional[int] = None, user_id: int = Depends(get_current_user)):
+    try:
+        since_time = datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的同步标记")
+    limit = page_size(limit, PAGINATION_CONFIG['max_page_size'])
+    await persistence.flush()
+    async with get_db_connection() as conn:
+        cursor = conn.cursor()
+        await cursor.execute(
+            "SELECT session_id, title, model_id, create_time, update_time, preview, message_count FROM chat_sessions "
+            "WHERE user_id = %s AND update_time >= %s ORDER BY update_time ASC, id ASC LIMIT %s",
+            (user_id, since_time, limit + 1)
+        )
+        rows = list(await cursor.fetchall())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "sessions": [session_summary(row) for row in rows],
+        "has_more": has_more,
+        "sync_token": rows[-1][4].isoformat() if rows else since
+    }
 
 # 根据时间范围获取对话历史
 @app.post("/api/chat/history/date-range")
 async def get_chat_history_by_date_range(date_range: ChatHistoryByDateRange, user_id: int = Depends(get_current_user)):
-    conn = get_db_connection()
-    try:
+    await persistence.flush()
+    async with get_db_connection() as conn:
         cursor = conn.cursor()
         
         # 查询指定时间范围内的会话
-        cursor.execute("""
-            SELECT session_id, title, model_id, create_time, update_time 
-            FROM chat_sessions 
-            WHERE user_id = %s 
-            AND create_time >= %s 
-            AND create_time <= %s 
-            ORDER BY update_time DESC
-        """, (user_id, date_range.start_time, date_range.end_time))
-        
-        sessions = []
-        for row in cursor.fetchall():
-            # 获取每个会话的第一条消息作为预览
-            cursor.execute(
-                "SELECT content FROM ai_chat_messages WHERE session_id = %s AND role = 'user' ORDER BY create_time ASC LIMIT 1",
-                (row[0],)
-            )
-            first_message = cursor.fetchone()
-            preview = first_message[0][:50] + "..." if first_message and len(first_message[0]) > 50 else (first_message[0] if first_message else "新对话")
-            
-            sessions.append({
-                "session_id": row[0],
-                "title": row[1] or preview,
-                "model_id": row[2],
-                "create_time": row[3].isoformat(),
-                "update_time": row[4].isoformat(),
-                "preview": preview
-            })
-        
-        return {"sessions": sessions}
-    finally:
-        conn.close()
+        return await query_session_page(
+            cursor,
+            "user_id = %s AND create_time >= %s AND create_time <= %s",
+            (user_id, date_range.start_time, date_range.end_time),
+            page_size(date_range.limit, PAGINATION_CONFIG['session_page_size']),
+            date_range.before
+        )
+
+# 搜索当前用户的对话消息，按相关度排序分页（cursor 为上一页返回的 next_cursor）
+@app.get("/api/chat/search")
+async def search_chat_messages(q: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                               user_id: int = Depends(get_current_user)):
+    terms = search_terms(q, SEARCH_CONFIG['min_length'])
+    if not terms:
+        return {"results": [], "has_more": False, "next_cursor": None}
+    page = max(1, min(limit or SEARCH_CONFIG['page_size'], PAGINATION_CONFIG['max_page_size']))
+    query = boolean_query(terms)
+    # 相关度放大后取整作为排序键，游标比较时不受浮点精度影响。
+    # 子查询由全文索引找出命中的消息，只保留当前用户的并按相关度取出一页，
+    # 再按主键关联会话表取得这一页的会话ID和标题。
+    # 只搜索消息表，已归档会话的消息不在搜索范围内
+    page_sql = (
+        "SELECT id, session_key, role, content, create_time, "
+        "CAST(MATCH(content) AGAINST (%s IN BOOLEAN MODE) * 1000000 AS SIGNED) AS score "
+        "FROM ai_chat_messages "
+        "WHERE MATCH(content) AGAINST (%s IN BOOLEAN MODE) AND user_id = %s"
+    )
+    args = (query, query, user_id)
+    if cursor:
+        try:
+            score, pk = decode_search_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+        page_sql += " HAVING score < %s OR (score = %s AND id < %s)"
+        args += (score, score, pk)
+    page_sql += " ORDER BY score DESC, id DESC LIMIT %s"
+    sql = (
+        f"SELECT /*+ MAX_EXECUTION_TIME({int(SEARCH_CONFIG['max_execution_ms'])}) */ "
+        "m.id, s.session_id, m.role, m.content, m.create_time, m.score, s.title, s.preview "
+        f"FROM ({page_sql}) m JOIN chat_sessions s ON s.id = m.session_key "
+        "ORDER BY m.score DESC, m.id DESC"
+    )
+    
+    # 先写入本进程队列中的消息，刚发送的消息也能搜到
+    await persistence.flush()
+    async with get_db_connection() as conn:
+        db_cursor = conn.cursor()
+        try:
+            await db_cursor.execute(sql, args + (page + 1,))
+        except OperationalError as e:
+            # 3024：超过 MAX_EXECUTION_TIME
+            if e.args and e.args[0] == 3024:
+                raise HTTPException(status_code=503, detail="搜索超时，请使用更具体的关键词")
+            raise
+        rows = list(await db_cursor.fetchall())
+        has_more = len(rows) > page
+        rows = rows[:page]
+    
+    return {
+        "results": [
+            {
+                "message_id": row[0],
+                "session_id": row[1],
+                "session_title": row[6] or row[7] or "新对话",
+                "role": row[2],
+                "snippet": highlight(row[3], terms, SEARCH_CONFIG['snippet_length']),
+                "timestamp": row[4].isoformat(),
+                "score": row[5]
+            }
+            for row in rows
+        ],
+        "has_more": has_more,
+        "next_cursor": encode_search_cursor(rows[-1][5], rows[-1][0]) if has_more else None
+    }
+
+# 导出名额：至少给其他请求留一个数据库连接
+export_limiter = ExportLimiter(min(ARCHIVE_CONFIG['max_exports'], DB_POOL_CONFIG['maxsize'] - 1))
+
+class ArchiveResponse(StreamingResponse):
+    # 下载期间一直占用一个导出名额和一个数据库连接：单次写出超过 send_timeout 秒（客户端读取过慢或停止读取）时中止下载，
+    # 结束后关闭生成器归还连接并释放名额
+    async def stream_response(self, send):
+        async def timed_send(message):
+            await asyncio.wait_for(send(message), ARCHIVE_CONFIG['send_timeout'])
+        await super().stream_response(timed_send)
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            export_limiter.release()
+
+# 流式导出归档：使用非缓冲游标边读边写，不把整个历史读入内存
+def archive_response(user_id: Optional[int], compress: bool, name: str):
+    async def generate():
+        # 先写入本进程队列中的消息
+        await persistence.flush()
+        async with get_db_connection() as conn:
+            chunks = export_lines(conn, user_id, ARCHIVE_CONFIG['fetch_size'], include_user=user_id is None)
+            if compress:
+                chunks = gzip_chunks(chunks, ARCHIVE_CONFIG['gzip_level'])
+            finished = False
+            try:
+                async for chunk in chunks:
+                    yield chunk
+                finished = True
+            finally:
+                if not finished:
+                    # 中途中止（超时或客户端断开）时非缓冲游标可能还有没读完的结果，不把这条连接放回池中
+                    conn.broken = True
+    
+    if not export_limiter.try_acquire():
+        raise HTTPException(status_code=503, detail="同时进行的导出过多，请稍后重试")
+    filename = f"ai-helper-{name}-{datetime.now():%Y%m%d%H%M%S}.jsonl"
+    if compress:
+        return ArchiveResponse(generate(), media_type="application/gzip", headers={
+            "Content-Disposition": f'attachment; filename="{filename}.gz"'
+        })
+    return ArchiveResponse(generate(), media_type="application/x-ndjson; charset=utf-8", headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+# 批量导入归档，user_id 为 None 时使用归档中记录的用户
+async def import_archive(file: UploadFile, user_id: Optional[int], keep_ids: bool):
+    async with get_db_connection() as conn:
+        importer = ArchiveImporter(conn, user_id, ARCHIVE_CONFIG['import_batch_size'], keep_ids)
+        lineno = 0
+        try:
+            async for line in read_lines(file):
+                lineno += 1
+                await importer.add_line(line, lineno)
+            return await importer.finish()
+        except (ArchiveError, IntegrityError, zlib.error) as e:
+            await conn.rollback()
+            if isinstance(e, IntegrityError):
+                reason = f"第 {lineno} 行附近写入失败: {e.args[-1]}"
+            elif isinstance(e, zlib.error):
+                reason = "压缩文件已损坏"
+            else:
+                reason = str(e)
+            # 之前的批次已经提交，告知已导入的数量
+            raise HTTPException(status_code=400, detail=(
+                f"{reason}（已导入 {importer.imported_sessions} 个会话、{importer.imported_messages} 条消息）"
+            ))
+
+# 导出当前用户的全部对话，compress=true 时为 gzip 压缩的文件
+@app.get("/api/chat/export")
+async def export_chat_sessions(compress: bool = False, user_id: int = Depends(get_current_user)):
+    return archive_response(user_id, compress, f"user{user_id}")
+
+# 导入归档到当前用户，会话使用新的会话ID
+@app.post("/api/chat/import")
+async def import_chat_sessions(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
+    return await import_archive(file, user_id, keep_ids=False)
 
 # 删除对话
 @app.delete("/api/chat/session/{session_id}")
 async def delete_chat_session(session_id: str, user_id: int = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # 检查会话是否属于当前用户
-        cursor.execute(
-            "SELECT id FROM chat_sessions WHERE user_id = %s AND session_id = %s",
-            (user_id, session_id)
-        )
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="会话不存在或无权限删除")
-        
-        # 删除会话（由于外键约束，相关消息会自动删除）
-        cursor.execute(
-            "DELETE FROM chat_sessions WHERE user_id = %s AND session_id = %s",
-            (user_id, session_id)
-        )
-        
-        conn.commit()
-        return {"message": "对话已删除"}
-    
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cursor.close()
-        conn.close()
+    # 停止该会话进行中的回复
+    generations.stop(session_id, user_id)
+    # 队列中可能还有该会话刚创建的记录或消息，先写入再删除
+    await persistence.flush()
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            try:
+                # 检查会话是否属于当前用户，并锁定会话行（与后台写入消息互斥）
+                await cursor.execute(
+                    "SELECT id, archived FROM chat_sessions WHERE user_id = %s AND session_id = %s FOR UPDATE",
+                    (user_id, session_id)
+                )
+                row = await cursor.fetchone()
+                if not row:
+                    raise HTTPException(status_code=404, detail="会话不存在或无权限删除")
+                session_key, archived = row
+                
+                # 用户的消息计数减去该会话的消息（只读该会话的消息）
+                await cursor.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(role = 'user'), 0) FROM {message_table(archived)} WHERE session_key = %s",
+                    (session_key,)
+                )
+                total, sent = await cursor.fetchone()
+                await cursor.execute(USER_COUNTS_SQL, (-total, -int(sent), user_id))
+                
+                # 删除会话（由于外键约束，相关消息会自动删除）
+                await cursor.execute("DELETE FROM chat_sessions WHERE id = %s", (session_key,))
+                
+                await conn.commit()
+                await session_cache.invalidate(session_id)
+                return {"message": "对话已删除"}
+            
+            except Exception as e:
+                await conn.rollback()
+                raise HTTPException(status_code=500, detail=str(e))
 
 # 主页
 # ==================== 管理员后台API ====================
@@ -585,105 +1120,121 @@ async def delete_chat_session(session_id: str, user_id: int = Depends(get_curren
 # 获取所有API服务商
 @app.get("/api/admin/providers")
 async def get_providers(admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, name, base_url, description, status, create_time FROM api_providers ORDER BY id")
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                SELECT id, name, base_url, description, status, create_time,
+                       max_connections, keepalive_expiry, connect_timeout, read_timeout, http2,
+                       max_concurrency, max_queue
+                FROM api_providers ORDER BY id
+            """)
             providers = []
-            for row in cursor.fetchall():
+            for row in await cursor.fetchall():
                 providers.append({
                     "id": row[0],
                     "name": row[1],
                     "base_url": row[2],
                     "description": row[3],
                     "status": row[4],
-                    "create_time": row[5].strftime("%Y-%m-%d %H:%M:%S")
+                    "create_time": row[5].strftime("%Y-%m-%d %H:%M:%S"),
+                    "max_connections": row[6],
+                    "keepalive_expiry": row[7],
+                    "connect_timeout": row[8],
+                    "read_timeout": row[9],
+                    "http2": row[10],
+                    "max_concurrency": row[11],
+                    "max_queue": row[12]
                 })
             return {"providers": providers}
-    finally:
-        conn.close()
 
 # 添加API服务商
 @app.post("/api/admin/providers")
 async def add_provider(provider: ApiProvider, admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO api_providers (name, base_url, api_key, description) VALUES (%s, %s, %s, %s)",
-                (provider.name, provider.base_url, provider.api_key, provider.description)
-            )
-            conn.commit()
-            return {"message": "API服务商添加成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"添加失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                provider_params = (provider.max_connections, provider.keepalive_expiry,
+                                     provider.connect_timeout, provider.read_timeout, provider.http2,
+                                     provider.max_concurrency, provider.max_queue)
+                await cursor.execute(
+                    """INSERT INTO api_providers (name, base_url, api_key, description, max_connections,
+                       keepalive_expiry, connect_timeout, read_timeout, http2, max_concurrency, max_queue)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                    (provider.name, provider.base_url, provider.api_key, provider.description) + provider_params
+                )
+                await conn.commit()
+                await routing_table.invalidate()
+                return {"message": "API服务商添加成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"添加失败: {str(e)}")
 
 # 更新API服务商
 @app.put("/api/admin/providers/{provider_id}")
 async def update_provider(provider_id: int, provider: ApiProviderUpdate, admin_id: int = Depends(get_admin_user)):
-    print(f"收到更新请求 - provider_id: {provider_id}")
-    print(f"数据: name={provider.name}, base_url={provider.base_url}, api_key={provider.api_key}, description={provider.description}")
-    
     # 验证必需字段
     if not provider.name or not provider.base_url:
         raise HTTPException(status_code=422, detail="name, base_url 字段不能为空")
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            # 如果api_key为空，则不更新api_key字段
-            if provider.api_key:
-                cursor.execute(
-                    "UPDATE api_providers SET name=%s, base_url=%s, api_key=%s, description=%s WHERE id=%s",
-                    (provider.name, provider.base_url, provider.api_key, provider.description, provider_id)
-                )
-            else:
-                cursor.execute(
-                    "UPDATE api_providers SET name=%s, base_url=%s, description=%s WHERE id=%s",
-                    (provider.name, provider.base_url, provider.description, provider_id)
-                )
-            conn.commit()
-            return {"message": "API服务商更新成功"}
-    except Exception as e:
-        conn.rollback()
-        print(f"数据库更新错误: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"更新失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                provider_params = (provider.max_connections, provider.keepalive_expiry,
+                                     provider.connect_timeout, provider.read_timeout, provider.http2,
+                                     provider.max_concurrency, provider.max_queue)
+                # 如果api_key为空，则不更新api_key字段
+                if provider.api_key:
+                    await cursor.execute(
+                        """UPDATE api_providers SET name=%s, base_url=%s, api_key=%s, description=%s, max_connections=%s,
+                           keepalive_expiry=%s, connect_timeout=%s, read_timeout=%s, http2=%s, max_concurrency=%s,
+                           max_queue=%s WHERE id=%s""",
+                        (provider.name, provider.base_url, provider.api_key, provider.description) + provider_params + (provider_id,)
+                    )
+                else:
+                    await cursor.execute(
+                        """UPDATE api_providers SET name=%s, base_url=%s, description=%s, max_connections=%s,
+                           keepalive_expiry=%s, connect_timeout=%s, read_timeout=%s, http2=%s, max_concurrency=%s,
+                           max_queue=%s WHERE id=%s""",
+                        (provider.name, provider.base_url, provider.description) + provider_params + (provider_id,)
+                    )
+                await conn.commit()
+                # 重建路由表，同时按新的地址和连接参数重建该服务商的客户端
+                await routing_table.invalidate()
+                return {"message": "API服务商更新成功"}
+        except Exception as e:
+            await conn.rollback()
+            logger.error("更新服务商 %s 失败: %s", provider_id, e)
+            raise HTTPException(status_code=400, detail=f"更新失败: {str(e)}")
 
 # 删除API服务商
 @app.delete("/api/admin/providers/{provider_id}")
 async def delete_provider(provider_id: int, admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM api_providers WHERE id = %s", (provider_id,))
-            conn.commit()
-            return {"message": "API服务商删除成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"删除失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM api_providers WHERE id = %s", (provider_id,))
+                await conn.commit()
+                await routing_table.invalidate()
+                return {"message": "API服务商删除成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"删除失败: {str(e)}")
 
 # 获取所有模型配置
 @app.get("/api/admin/models")
 async def get_model_configs(admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
                 SELECT mc.id, mc.model_id, mc.model_name, mc.description, mc.max_tokens, 
-                       mc.status, mc.sort_order, ap.name as provider_name, mc.provider_id
+                       mc.status, mc.sort_order, ap.name as provider_name, mc.provider_id, mc.hedge_delay_ms,
+                       mc.cache_enabled, mc.daily_token_quota, mc.rpm_limit
                 FROM model_configs mc 
                 JOIN api_providers ap ON mc.provider_id = ap.id 
                 ORDER BY mc.sort_order, mc.id
             """)
             models = []
-            for row in cursor.fetchall():
+            for row in await cursor.fetchall():
                 models.append({
                     "id": row[0],
                     "model_id": row[1],
@@ -693,79 +1244,87 @@ async def get_model_configs(admin_id: int = Depends(get_admin_user)):
                     "status": row[5],
                     "sort_order": row[6],
                     "provider_name": row[7],
-                    "provider_id": row[8]
+                    "provider_id": row[8],
+                    "hedge_delay_ms": row[9],
+                    "cache_enabled": row[10],
+                    "daily_token_quota": row[11],
+                    "rpm_limit": row[12]
                 })
             return {"models": models}
-    finally:
-        conn.close()
 
 # 添加模型配置
 @app.post("/api/admin/models")
 async def add_model_config(model: ModelConfig, admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO model_configs (provider_id, model_id, model_name, description, max_tokens, sort_order) VALUES (%s, %s, %s, %s, %s, %s)",
-                (model.provider_id, model.model_id, model.model_name, model.description, model.max_tokens, model.sort_order)
-            )
-            conn.commit()
-            return {"message": "模型配置添加成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"添加失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "INSERT INTO model_configs (provider_id, model_id, model_name, description, max_tokens, sort_order, hedge_delay_ms, cache_enabled, daily_token_quota, rpm_limit) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    (model.provider_id, model.model_id, model.model_name, model.description, model.max_tokens, model.sort_order, model.hedge_delay_ms, model.cache_enabled, model.daily_token_quota, model.rpm_limit)
+                )
+                await conn.commit()
+                await routing_table.invalidate()
+                return {"message": "模型配置添加成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"添加失败: {str(e)}")
 
 # 更新模型配置
 @app.put("/api/admin/models/{model_id}")
 async def update_model_config(model_id: int, model: ModelConfig, admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "UPDATE model_configs SET provider_id=%s, model_id=%s, model_name=%s, description=%s, max_tokens=%s, sort_order=%s WHERE id=%s",
-                (model.provider_id, model.model_id, model.model_name, model.description, model.max_tokens, model.sort_order, model_id)
-            )
-            conn.commit()
-            return {"message": "模型配置更新成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"更新失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE model_configs SET provider_id=%s, model_id=%s, model_name=%s, description=%s, max_tokens=%s, sort_order=%s, hedge_delay_ms=%s, cache_enabled=%s, daily_token_quota=%s, rpm_limit=%s WHERE id=%s",
+                    (model.provider_id, model.model_id, model.model_name, model.description, model.max_tokens, model.sort_order, model.hedge_delay_ms, model.cache_enabled, model.daily_token_quota, model.rpm_limit, model_id)
+                )
+                await conn.commit()
+                await routing_table.invalidate()
+                return {"message": "模型配置更新成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"更新失败: {str(e)}")
 
 # 删除模型配置
 @app.delete("/api/admin/models/{model_id}")
 async def delete_model_config(model_id: int, admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM model_configs WHERE id = %s", (model_id,))
-            conn.commit()
-            return {"message": "模型配置删除成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"删除失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM model_configs WHERE id = %s", (model_id,))
+                await conn.commit()
+                await routing_table.invalidate()
+                return {"message": "模型配置删除成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"删除失败: {str(e)}")
+
+# 导出指定用户或全部用户（不传 user_id）的对话，全部用户的归档中会话带有 user_id
+@app.get("/api/admin/export")
+async def admin_export_chat_sessions(user_id: Optional[int] = None, compress: bool = False,
+                                     admin_id: int = Depends(get_admin_user)):
+    return archive_response(user_id, compress, f"user{user_id}" if user_id is not None else "all")
+
+# 导入归档：指定 user_id 时全部导入到该用户，否则按归档中的 user_id；
+# keep_ids=true 时保留原会话ID（迁移用），已存在的会话跳过
+@app.post("/api/admin/import")
+async def admin_import_chat_sessions(file: UploadFile = File(...), user_id: Optional[int] = None, keep_ids: bool = False,
+                                     admin_id: int = Depends(get_admin_user)):
+    return await import_archive(file, user_id, keep_ids)
 
 # 获取所有用户
 @app.get("/api/admin/users")
 async def get_users(admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT u.id, u.username, u.status, u.is_admin, u.create_time, u.last_login,
-                       COUNT(m.id) as message_count
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                SELECT u.id, u.username, u.status, u.is_admin, u.create_time, u.last_login, u.message_count
                 FROM users u 
-                LEFT JOIN ai_chat_messages m ON u.id = m.user_id 
-                GROUP BY u.id 
                 ORDER BY u.id
             """)
             users = []
-            for row in cursor.fetchall():
+            for row in await cursor.fetchall():
                 users.append({
                     "id": row[0],
                     "username": row[1],
@@ -776,26 +1335,80 @@ async def get_users(admin_id: int = Depends(get_admin_user)):
                     "message_count": row[6]
                 })
             return {"users": users}
-    finally:
-        conn.close()
+
+# 用量统计的分组方式：分组列、返回字段、需要关联的表
+USAGE_GROUPS = {
+    "day": ("d.day", ("day",), ""),
+    "user": ("d.user_id, u.username", ("user_id", "username"), " JOIN users u ON u.id = d.user_id"),
+    "model": ("d.model_id", ("model_id",), ""),
+}
+
+# 用量统计：按天、用户或模型汇总 start~end（含）的消息数和 token 数，读取每日用量汇总表，不扫描消息表
+@app.get("/api/admin/usage")
+async def get_usage(start: Optional[date] = None, end: Optional[date] = None, group_by: str = "day",
+                    user_id: Optional[int] = None, model_id: Optional[str] = None,
+                    admin_id: int = Depends(get_admin_user)):
+    if group_by not in USAGE_GROUPS:
+        raise HTTPException(status_code=400, detail="group_by 只能是 day、user 或 model")
+    end = end or date.today()
+    start = start or end - timedelta(days=USAGE_CONFIG['default_days'] - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    if (end - start).days >= USAGE_CONFIG['max_days']:
+        raise HTTPException(status_code=400, detail=f"日期范围不能超过 {USAGE_CONFIG['max_days']} 天")
+    columns, fields, join = USAGE_GROUPS[group_by]
+    where = "d.day BETWEEN %s AND %s"
+    args = [start, end]
+    if user_id is not None:
+        where += " AND d.user_id = %s"
+        args.append(user_id)
+    if model_id:
+        where += " AND d.model_id = %s"
+        args.append(model_id)
+    order = "d.day" if group_by == "day" else "messages DESC"
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT {columns}, SUM(d.messages) AS messages, SUM(d.sent_count), SUM(d.tokens) "
+                f"FROM usage_daily d{join} WHERE {where} GROUP BY {columns} ORDER BY {order}",
+                args
+            )
+            rows = []
+            for row in await cursor.fetchall():
+                item = dict(zip(fields, row))
+                if group_by == "day":
+                    item["day"] = item["day"].isoformat()
+                # SUM 的结果为 Decimal
+                item.update(messages=int(row[-3]), sent_count=int(row[-2]), tokens=int(row[-1]))
+                rows.append(item)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": group_by,
+        "rows": rows,
+        "total": {key: sum(item[key] for item in rows) for key in ("messages", "sent_count", "tokens")},
+    }
 
 # 更新用户状态
 @app.put("/api/admin/users/{user_id}")
 async def update_user_status(user_id: int, user_data: UserManagement, admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "UPDATE users SET status=%s, is_admin=%s WHERE id=%s",
-                (user_data.status, user_data.is_admin, user_id)
-            )
-            conn.commit()
-            return {"message": "用户状态更新成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"更新失败: {str(e)}")
-    finally:
-        conn.close()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE users SET status=%s, is_admin=%s WHERE id=%s",
+                    (user_data.status, user_data.is_admin, user_id)
+                )
+                await conn.commit()
+                # 禁用后立即注销该用户的全部会话，否则下次鉴权时读取新的状态和权限
+                if user_data.status != 1:
+                    await auth_sessions.revoke_user(user_id)
+                else:
+                    await auth_sessions.invalidate_user(user_id)
+                return {"message": "用户状态更新成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"更新失败: {str(e)}")
 
 # 删除用户
 @app.delete("/api/admin/users/{user_id}")
@@ -803,17 +1416,17 @@ async def delete_user(user_id: int, admin_id: int = Depends(get_admin_user)):
     if user_id == admin_id:
         raise HTTPException(status_code=400, detail="不能删除自己的账户")
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            conn.commit()
-            return {"message": "用户删除成功"}
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=f"删除失败: {str(e)}")
-    finally:
-        conn.close()
+    await persistence.flush()
+    async with get_db_connection() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+                await conn.commit()
+                await auth_sessions.revoke_user(user_id)
+                return {"message": "用户删除成功"}
+        except Exception as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"删除失败: {str(e)}")
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -827,14 +1440,62 @@ async def read_admin():
 
 @app.get("/api/admin/check")
 async def check_admin_auth(admin_id: int = Depends(get_admin_user)):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT username FROM users WHERE id = %s", (admin_id,))
-            result = cursor.fetchone()
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT username FROM users WHERE id = %s", (admin_id,))
+            result = await cursor.fetchone()
             return {"message": "Admin access granted", "user": result[0] if result else "Unknown"}
-    finally:
-        conn.close()
+
+# 数据库连接池状态（连接数、等待数、饱和度等）
+@app.get("/api/admin/db-pool")
+async def get_db_pool_stats(admin_id: int = Depends(get_admin_user)):
+    return db_pool.stats()
+
+# 各服务商的并发和排队情况
+@app.get("/api/admin/admission")
+async def get_admission_stats(admin_id: int = Depends(get_admin_user)):
+    return admission.stats()
+
+# 各服务商近期的首 token 延迟、错误率及是否暂停使用
+@app.get("/api/admin/upstream")
+async def get_upstream_stats(admin_id: int = Depends(get_admin_user)):
+    return upstream_router.stats()
+
+# 回复缓存的条目数和命中情况，以及合并中的并发相同请求
+@app.get("/api/admin/response-cache")
+async def get_response_cache_stats(admin_id: int = Depends(get_admin_user)):
+    return {**response_cache.stats(), "single_flight": single_flight.stats()}
+
+# 配额计数的后端和被拒绝的请求数
+@app.get("/api/admin/quota")
+async def get_quota_stats(admin_id: int = Depends(get_admin_user)):
+    return quota.stats()
+
+# 可续传的输出缓冲数、生成中的数量和续传次数
+@app.get("/api/admin/streams")
+async def get_stream_stats(admin_id: int = Depends(get_admin_user)):
+    return resumable_streams.stats()
+
+# 登录会话数和用户记录缓存的命中情况
+@app.get("/api/admin/auth")
+async def get_auth_stats(admin_id: int = Depends(get_admin_user)):
+    return auth_sessions.stats()
+
+# Prometheus 指标：路由耗时、数据库语句耗时、上游首 token 延迟和输出速度、上游错误、事件循环延迟等
+# 配置了 token 时抓取需携带该令牌，否则需要管理员登录
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not METRICS_CONFIG['enabled']:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_CONFIG['token']:
+        if not secrets.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {METRICS_CONFIG['token']}".encode()):
+            raise HTTPException(status_code=401, detail="未授权")
+    else:
+        await get_admin_user(request)
+    pool = db_pool.stats()
+    for state in ("size", "idle", "in_use", "waiting"):
+        metrics.DB_POOL.set(state, value=pool[state])
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,28 @@
+# 冷消息归档：长期没有更新的会话，其消息整体移到 ai_chat_messages_archive，
+# chat_sessions.archived 标记消息当前所在的表。读取时按标记选择表；
+# 已归档的会话再次收到消息时，由 PersistenceQueue 在写入消息的同一事务中移回消息表。
+# 归档由 python migrate.py archive 执行。
+
+MESSAGE_TABLE = "ai_chat_messages"
+ARCHIVE_TABLE = "ai_chat_messages_archive"
+
+_COLUMNS = "id, session_key, user_id, role, content, prompt_tokens, completion_tokens, truncated, create_time"
+
+
+def message_table(archived):
+    return ARCHIVE_TABLE if archived else MESSAGE_TABLE
+
+
+def move_statements(session_keys, archive):
+    # 把一批会话的消息在两张表之间移动（保留消息ID），返回 [(sql, args), ...]，
+    # 调用方需要先锁定这些会话行（SELECT ... FOR UPDATE），并在同一个事务中依次执行
+    source, target = (MESSAGE_TABLE, ARCHIVE_TABLE) if archive else (ARCHIVE_TABLE, MESSAGE_TABLE)
+    keys = list(session_keys)
+    placeholders = ", ".join(["%s"] * len(keys))
+    return [
+        (f"INSERT INTO {target} ({_COLUMNS}) SELECT {_COLUMNS} FROM {source} WHERE session_key IN ({placeholders})", keys),
+        (f"DELETE FROM {source} WHERE session_key IN ({placeholders})", keys),
+        # update_time 保持不变（该列默认 ON UPDATE 当前时间）
+        (f"UPDATE chat_sessions SET archived = %s, update_time = update_time WHERE id IN ({placeholders})",
+         [1 if archive else 0, *keys]),
+    ]
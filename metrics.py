@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import re
+import time
+
+# 进程内的性能指标，按 Prometheus 文本格式输出（GET /metrics）。
+# 多进程部署时每个进程各自统计，由 Prometheus 按实例分别抓取。
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        return tuple(str(value) for value in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, *labels, value):
+        self._values[self._key(labels)] = value
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [各区间计数..., +Inf 区间计数, 总和]
+            state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def _samples(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state):
+            cumulative += count
+            le = 'le="' + _number(bound) + '"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(state[-1])}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（流式接口为整个响应的时长）", ("method", "route", "status")
+))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "按语句统计的数据库执行耗时", ("statement",)
+))
+DB_POOL = REGISTRY.register(Gauge(
+    "db_pool_connections", "数据库连接池状态", ("state",)
+))
+UPSTREAM_TTFT = REGISTRY.register(Histogram(
+    "upstream_ttft_seconds", "上游首个 token 的延迟", ("model", "provider")
+))
+UPSTREAM_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "upstream_tokens_per_second", "上游输出速度（首个 token 之后每秒的片段数）", ("model", "provider"),
+    buckets=(1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "upstream_errors_total", "上游请求失败次数", ("provider", "reason")
+))
+ACTIVE_STREAMS = REGISTRY.register(Gauge(
+    "chat_active_streams", "进行中的对话流式响应数"
+))
+STREAMS_STOPPED = REGISTRY.register(Counter(
+    "chat_streams_stopped_total", "中途停止的回复数（stop：用户停止，disconnect：客户端断开后没有重新连接，cancelled：响应被服务器取消）", ("reason",)
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds", "事件循环调度延迟（定时任务实际唤醒时间与预期的差值）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+))
+
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*%s(?:\s*,\s*%s)*\s*\)", re.IGNORECASE)
+
+
+def statement_label(query, max_length=120):
+    # 语句中只有 %s 占位符，不含参数值；IN 列表的占位符个数随参数变化，统一写作 IN (...)，
+    # 再合并空白后截断，作为标签时数量有限
+    return _IN_LIST.sub("IN (...)", _WHITESPACE.sub(" ", query)).strip()[:max_length]
+
+
+def observe_query(query, args, seconds):
+    DB_QUERY_DURATION.observe(statement_label(query), value=seconds)
+
+
+class MetricsMiddleware:
+    # ASGI 中间件：按路由模板（而不是实际路径）统计请求耗时，未匹配任何路由的请求归为 unmatched
+    def __init__(self, app, exclude=("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(scope["method"], route, status, value=time.perf_counter() - start)
+
+
+async def monitor_event_loop(interval=0.5):
+    # 定时睡眠 interval 秒，实际多睡的时间即事件循环被阻塞或过载的程度
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(value=max(loop.time() - start - interval, 0))
@@ -0,0 +1,189 @@
+"""数据库迁移与冷消息归档，连接 config.py 中 MySQL_CONFIG 指定的数据库。
+
+python migrate.py                     执行 migrations/ 下所有尚未执行的迁移
+python migrate.py status              查看各迁移是否已执行
+python migrate.py baseline 7          把编号不大于 7 的迁移标记为已执行（手动执行过这些脚本的已有数据库）
+python migrate.py archive --days 180  把超过 180 天没有更新的会话的消息移到归档表
+
+database.sql 新建的数据库已经记录了它包含的迁移，不需要再执行。
+迁移脚本中的 USE 语句会被忽略；DDL 不能回滚，迁移中途失败时需要按提示处理后重新执行。
+"""
+import argparse
+import os
+import re
+from datetime import datetime, timedelta
+
+import pymysql
+
+from config import MySQL_CONFIG, MESSAGE_ARCHIVE_CONFIG
+from message_archive import move_statements
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY COMMENT '迁移编号',
+    name VARCHAR(200) NOT NULL COMMENT '迁移文件名',
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='数据库迁移记录'
+"""
+
+_TOKEN = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|;", re.S)
+
+
+def split_statements(sql):
+    # 按分号拆分语句，跳过注释，忽略引号内的分号
+    statements = []
+    start = 0
+    parts = []
+    for match in _TOKEN.finditer(sql):
+        token = match.group()
+        if token.startswith("--") or token.startswith("/*") and not token.startswith("/*+"):
+            parts.append(sql[start:match.start()])
+            start = match.end()
+        elif token == ";":
+            parts.append(sql[start:match.start()])
+            start = match.end()
+            statements.append("".join(parts).strip())
+            parts = []
+    parts.append(sql[start:])
+    statements.append("".join(parts).strip())
+    return [statement for statement in statements if statement]
+
+
+def list_migrations():
+    # [(编号, 文件名)]，按编号排序
+    migrations = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r"(\d+)_.*\.sql$", name)
+        if match:
+            migrations.append((int(match.group(1)), name))
+    migrations.sort()
+    versions = [version for version, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise SystemExit("迁移编号重复")
+    return migrations
+
+
+def connect(autocommit=True):
+    return pymysql.connect(**MySQL_CONFIG, autocommit=autocommit)
+
+
+def applied_versions(cursor):
+    cursor.execute(MIGRATIONS_TABLE_SQL)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(cursor):
+    applied = applied_versions(cursor)
+    pending = [(version, name) for version, name in list_migrations() if version not in applied]
+    if not applied and pending:
+        cursor.execute("SHOW TABLES LIKE 'chat_sessions'")
+        if cursor.fetchone():
+            raise SystemExit(
+                "数据库已有数据表但没有迁移记录：请先用 python migrate.py baseline <编号> 标记已经执行过的迁移"
+            )
+        raise SystemExit("数据库还没有初始化，请先执行 database.sql")
+    if not pending:
+        print("没有需要执行的迁移")
+        return
+    for version, name in pending:
+        with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+            statements = split_statements(f.read())
+        print(f"执行 {name} ...")
+        for statement in statements:
+            if re.match(r"USE\s", statement, re.I):
+                continue
+            try:
+                cursor.execute(statement)
+            except pymysql.MySQLError as e:
+                raise SystemExit(
+                    f"{name} 执行失败: {e}\n语句: {statement}\n"
+                    "之前的语句已经生效（DDL 不能回滚），请检查数据库状态，修复后重新执行或用 baseline 标记"
+                )
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    print(f"已执行 {len(pending)} 个迁移")
+
+
+def status(cursor):
+    applied = applied_versions(cursor)
+    for version, name in list_migrations():
+        print(f"{'已执行' if version in applied else '未执行'}  {name}")
+
+
+def baseline(cursor, target):
+    applied = applied_versions(cursor)
+    for version, name in list_migrations():
+        if version <= target and version not in applied:
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            print(f"标记为已执行: {name}")
+
+
+def archive_sessions(conn, before, batch_size):
+    # 按 (user_id, update_time, id) 顺序（即 idx_user_update 的顺序）分批归档 before 之前最后更新的会话，
+    # 每批一个事务；返回归档的会话数
+    total = 0
+    last = None
+    while True:
+        with conn.cursor() as cursor:
+            sql = "SELECT id, user_id, update_time FROM chat_sessions WHERE update_time < %s AND archived = 0"
+            args = [before]
+            if last is not None:
+                sql += " AND (user_id, update_time, id) > (%s, %s, %s)"
+                args += list(last)
+            cursor.execute(sql + " ORDER BY user_id, update_time, id LIMIT %s", args + [batch_size])
+            rows = cursor.fetchall()
+            if not rows:
+                return total
+            last = (rows[-1][1], rows[-1][2], rows[-1][0])
+            # 锁定会话行后再次确认：期间收到新消息的会话不归档
+            placeholders = ", ".join(["%s"] * len(rows))
+            cursor.execute(
+                f"SELECT id FROM chat_sessions WHERE id IN ({placeholders}) AND archived = 0 AND update_time < %s FOR UPDATE",
+                [row[0] for row in rows] + [before]
+            )
+            keys = [row[0] for row in cursor.fetchall()]
+            if keys:
+                for statement, statement_args in move_statements(keys, archive=True):
+                    cursor.execute(statement, statement_args)
+            conn.commit()
+            total += len(keys)
+            print(f"已归档 {total} 个会话")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库迁移与冷消息归档")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("up", help="执行所有未执行的迁移（默认）")
+    commands.add_parser("status", help="查看迁移状态")
+    baseline_parser = commands.add_parser("baseline", help="把不大于指定编号的迁移标记为已执行")
+    baseline_parser.add_argument("version", type=int)
+    archive_parser = commands.add_parser("archive", help="把长期没有更新的会话的消息移到归档表")
+    archive_parser.add_argument("--days", type=int, default=MESSAGE_ARCHIVE_CONFIG['days'])
+    archive_parser.add_argument("--batch-size", type=int, default=MESSAGE_ARCHIVE_CONFIG['batch_size'])
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        conn = connect(autocommit=False)
+        try:
+            total = archive_sessions(conn, datetime.now() - timedelta(days=args.days), args.batch_size)
+        finally:
+            conn.close()
+        print(f"归档完成，共 {total} 个会话")
+        return
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            if args.command == "status":
+                status(cursor)
+            elif args.command == "baseline":
+                baseline(cursor, args.version)
+            else:
+                migrate(cursor)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
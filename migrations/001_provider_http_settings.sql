@@ -0,0 +1,9 @@
+-- 服务商连接参数（NULL 表示使用 config.py 中 HTTP_CLIENT_CONFIG 的默认值）
+USE ai;
+
+ALTER TABLE api_providers
+    ADD COLUMN max_connections INT DEFAULT NULL COMMENT '最大连接数' AFTER status,
+    ADD COLUMN keepalive_expiry FLOAT DEFAULT NULL COMMENT '空闲连接保持时间（秒）' AFTER max_connections,
+    ADD COLUMN connect_timeout FLOAT DEFAULT NULL COMMENT '连接超时（秒）' AFTER keepalive_expiry,
+    ADD COLUMN read_timeout FLOAT DEFAULT NULL COMMENT '读取超时（秒）' AFTER connect_timeout,
+    ADD COLUMN http2 TINYINT DEFAULT 0 COMMENT '是否启用HTTP/2：1-是，0-否' AFTER read_timeout;
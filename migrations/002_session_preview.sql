@@ -0,0 +1,21 @@
+-- 会话列表预览与消息数冗余到 chat_sessions，避免列表接口逐个会话查询首条消息
+USE ai;
+
+ALTER TABLE chat_sessions
+    ADD COLUMN preview VARCHAR(60) DEFAULT NULL COMMENT '首条用户消息预览（前50个字符）' AFTER title,
+    ADD COLUMN message_count INT NOT NULL DEFAULT 0 COMMENT '会话消息数' AFTER preview;
+
+-- 回填已有会话
+UPDATE chat_sessions s
+LEFT JOIN (
+    SELECT session_id, COUNT(*) AS cnt, MIN(CASE WHEN role = 'user' THEN id END) AS first_user_id
+    FROM ai_chat_messages
+    GROUP BY session_id
+) c ON c.session_id = s.session_id
+LEFT JOIN ai_chat_messages fm ON fm.id = c.first_user_id
+SET s.message_count = COALESCE(c.cnt, 0),
+    s.preview = CASE
+        WHEN fm.id IS NULL THEN NULL
+        WHEN CHAR_LENGTH(fm.content) > 50 THEN CONCAT(LEFT(fm.content, 50), '...')
+        ELSE fm.content
+    END;
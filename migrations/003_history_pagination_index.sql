@@ -0,0 +1,5 @@
+-- 会话列表按 (user_id, update_time, id) 游标分页
+-- InnoDB 二级索引会附带主键，因此该索引等价于 (user_id, update_time, id)
+USE ai;
+
+ALTER TABLE chat_sessions ADD INDEX idx_user_update (user_id, update_time);
@@ -0,0 +1,6 @@
+-- 服务商并发限制（NULL 表示使用 config.py 中 ADMISSION_CONFIG 的默认值）
+USE ai;
+
+ALTER TABLE api_providers
+    ADD COLUMN max_concurrency INT DEFAULT NULL COMMENT '同时调用上游的最大请求数' AFTER http2,
+    ADD COLUMN max_queue INT DEFAULT NULL COMMENT '排队请求数上限' AFTER max_concurrency;
@@ -0,0 +1,6 @@
+-- 同一 model_id 可配置在多个服务商下，由路由按延迟和错误率选择并在失败时切换；
+-- hedge_delay_ms 为对冲请求延迟（NULL 表示不启用）
+USE ai;
+
+ALTER TABLE model_configs
+    ADD COLUMN hedge_delay_ms INT DEFAULT NULL COMMENT '对冲延迟（毫秒），同一模型有多个服务商时首个超过该时间未返回就同时请求下一个' AFTER sort_order;
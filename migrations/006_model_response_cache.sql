@@ -0,0 +1,5 @@
+-- 按模型开启回复缓存：同一模型收到完全相同的上下文时直接返回上次的回复，默认关闭
+USE ai;
+
+ALTER TABLE model_configs
+    ADD COLUMN cache_enabled TINYINT DEFAULT 0 COMMENT '回复缓存：1-相同的上下文直接返回上次的回复，0-不缓存' AFTER hedge_delay_ms;
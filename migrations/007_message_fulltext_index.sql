@@ -0,0 +1,6 @@
+-- 消息全文搜索（GET /api/chat/search）使用的全文索引
+-- ngram 分词器按连续字符切分（默认 ngram_token_size=2），中文不需要空格分词；需要 MySQL 5.7.6 及以上
+-- 消息较多时建索引耗时较长，建议在低峰期执行
+USE ai;
+
+ALTER TABLE ai_chat_messages ADD FULLTEXT INDEX ft_content (content) WITH PARSER ngram;
@@ -0,0 +1,35 @@
+-- 消息表用整数会话主键 session_key（chat_sessions.id）代替每行重复存储的 36 字节会话ID字符串，
+-- 并把单列索引换成热点查询使用的组合索引：
+--   (session_key, id)：按会话读取上下文和消息分页（WHERE session_key = ? ORDER BY id）
+--   (user_id, role)：统计用户消息数时只读索引
+-- 需要重建 ai_chat_messages，消息较多时耗时较长，建议在低峰期停服执行
+USE ai;
+
+ALTER TABLE ai_chat_messages ADD COLUMN session_key INT NULL COMMENT '会话主键（chat_sessions.id）' AFTER id;
+
+UPDATE ai_chat_messages m JOIN chat_sessions s ON s.session_id = m.session_id SET m.session_key = s.id;
+
+-- 旧的 session_id 外键是自动命名的，按列查出名称后删除
+SET @fk = (
+    SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ai_chat_messages'
+      AND COLUMN_NAME = 'session_id' AND REFERENCED_TABLE_NAME = 'chat_sessions'
+);
+SET @sql = CONCAT('ALTER TABLE ai_chat_messages DROP FOREIGN KEY `', @fk, '`');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+ALTER TABLE ai_chat_messages
+    MODIFY session_key INT NOT NULL COMMENT '会话主键（chat_sessions.id）',
+    DROP INDEX idx_session_id,
+    DROP INDEX idx_session_user,
+    DROP INDEX idx_create_time,
+    DROP INDEX idx_user_id,
+    DROP COLUMN session_id,
+    ADD INDEX idx_session_message (session_key, id),
+    ADD INDEX idx_user_role (user_id, role),
+    ADD CONSTRAINT fk_message_session FOREIGN KEY (session_key) REFERENCES chat_sessions(id) ON DELETE CASCADE;
+
+-- session_id 上已有唯一索引
+ALTER TABLE chat_sessions DROP INDEX idx_session_id;
@@ -0,0 +1,20 @@
+-- 冷消息归档：长期没有更新的会话，其消息由 python migrate.py archive 移到归档表，
+-- 热表只保留近期会话的消息。归档表结构与消息表相同（保留原消息ID），没有全文索引。
+-- 归档的会话 archived = 1，读取时改查归档表；再次发送消息时自动移回热表
+USE ai;
+
+ALTER TABLE chat_sessions
+    ADD COLUMN archived TINYINT NOT NULL DEFAULT 0 COMMENT '消息是否已归档：1-在归档表，0-在消息表' AFTER message_count;
+
+CREATE TABLE IF NOT EXISTS ai_chat_messages_archive (
+    id INT PRIMARY KEY COMMENT '原消息ID',
+    session_key INT NOT NULL COMMENT '会话主键（chat_sessions.id）',
+    user_id INT NOT NULL COMMENT '用户ID',
+    role ENUM('user', 'assistant') NOT NULL COMMENT '消息角色：user-用户，assistant-助手',
+    content TEXT NOT NULL COMMENT '消息内容',
+    create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    INDEX idx_session_message (session_key, id),
+    INDEX idx_user_role (user_id, role),
+    CONSTRAINT fk_archive_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT fk_archive_session FOREIGN KEY (session_key) REFERENCES chat_sessions(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='AI对话消息归档表';
@@ -0,0 +1,45 @@
+-- 预聚合的用量计数：用户信息和管理员用户列表直接读取 users 上的计数，不再扫描消息表；
+-- usage_daily 按 天/用户/模型 汇总消息数和 token 数，用于管理员用量统计。
+-- 计数由写入消息、删除会话、导入归档时在同一事务中增量维护；
+-- usage_daily 记录的是使用量，删除会话不会减少，导入的历史消息也不计入。
+USE ai;
+
+ALTER TABLE users
+    ADD COLUMN message_count INT NOT NULL DEFAULT 0 COMMENT '消息总数（包括已归档的消息）',
+    ADD COLUMN sent_count INT NOT NULL DEFAULT 0 COMMENT '用户发送的消息数';
+
+UPDATE users u SET
+    message_count = (SELECT COUNT(*) FROM ai_chat_messages m WHERE m.user_id = u.id)
+        + (SELECT COUNT(*) FROM ai_chat_messages_archive a WHERE a.user_id = u.id),
+    sent_count = (SELECT COUNT(*) FROM ai_chat_messages m WHERE m.user_id = u.id AND m.role = 'user')
+        + (SELECT COUNT(*) FROM ai_chat_messages_archive a WHERE a.user_id = u.id AND a.role = 'user');
+
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day DATE NOT NULL COMMENT '日期',
+    user_id INT NOT NULL COMMENT '用户ID',
+    model_id VARCHAR(100) NOT NULL COMMENT '模型ID',
+    messages INT NOT NULL DEFAULT 0 COMMENT '消息数（用户和助手）',
+    sent_count INT NOT NULL DEFAULT 0 COMMENT '用户发送的消息数',
+    tokens BIGINT NOT NULL DEFAULT 0 COMMENT 'token 数',
+    PRIMARY KEY (day, user_id, model_id),
+    INDEX idx_user_day (user_id, day),
+    CONSTRAINT fk_usage_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='每日用量汇总';
+
+-- 按已有消息回填，模型取会话的模型；token 数按 context.estimate_tokens 的规则估算：
+-- utf8mb4 下中日韩字符占 3 字节，按 1 token/字，其余按 4 字符/token
+INSERT INTO usage_daily (day, user_id, model_id, messages, sent_count, tokens)
+SELECT DATE(m.create_time), m.user_id, s.model_id, COUNT(*), SUM(m.role = 'user'),
+       SUM((LENGTH(m.content) - CHAR_LENGTH(m.content)) DIV 2
+           + (CHAR_LENGTH(m.content) - (LENGTH(m.content) - CHAR_LENGTH(m.content)) DIV 2 + 3) DIV 4)
+FROM ai_chat_messages m JOIN chat_sessions s ON s.id = m.session_key
+GROUP BY DATE(m.create_time), m.user_id, s.model_id;
+
+INSERT INTO usage_daily (day, user_id, model_id, messages, sent_count, tokens)
+SELECT DATE(a.create_time), a.user_id, s.model_id, COUNT(*), SUM(a.role = 'user'),
+       SUM((LENGTH(a.content) - CHAR_LENGTH(a.content)) DIV 2
+           + (CHAR_LENGTH(a.content) - (LENGTH(a.content) - CHAR_LENGTH(a.content)) DIV 2 + 3) DIV 4)
+FROM ai_chat_messages_archive a JOIN chat_sessions s ON s.id = a.session_key
+GROUP BY DATE(a.create_time), a.user_id, s.model_id
+ON DUPLICATE KEY UPDATE messages = messages + VALUES(messages), sent_count = sent_count + VALUES(sent_count),
+    tokens = tokens + VALUES(tokens);
@@ -0,0 +1,16 @@
+-- token 用量与配额：助手消息记录本次调用的 prompt / completion token 数
+-- （服务商返回的用量，没有返回时为本地估算；用户消息和之前的消息为 NULL）。
+-- 模型配置增加每个用户在该模型上的每日 token 配额和每分钟请求数限制（NULL 使用 QUOTA_CONFIG 中的默认值）
+USE ai;
+
+ALTER TABLE ai_chat_messages
+    ADD COLUMN prompt_tokens INT DEFAULT NULL COMMENT '本次调用的输入 token 数（助手消息）' AFTER content,
+    ADD COLUMN completion_tokens INT DEFAULT NULL COMMENT '本次调用的输出 token 数（助手消息）' AFTER prompt_tokens;
+
+ALTER TABLE ai_chat_messages_archive
+    ADD COLUMN prompt_tokens INT DEFAULT NULL COMMENT '本次调用的输入 token 数（助手消息）' AFTER content,
+    ADD COLUMN completion_tokens INT DEFAULT NULL COMMENT '本次调用的输出 token 数（助手消息）' AFTER prompt_tokens;
+
+ALTER TABLE model_configs
+    ADD COLUMN daily_token_quota INT DEFAULT NULL COMMENT '每个用户每天在该模型上可用的 token 数' AFTER cache_enabled,
+    ADD COLUMN rpm_limit INT DEFAULT NULL COMMENT '每个用户每分钟在该模型上的请求数' AFTER daily_token_quota;
@@ -0,0 +1,8 @@
+-- 被中途停止的回复：用户点击停止或客户端断开时，已生成的部分回复照常保存并标记为截断
+USE ai;
+
+ALTER TABLE ai_chat_messages
+    ADD COLUMN truncated TINYINT NOT NULL DEFAULT 0 COMMENT '回复是否被中途停止（助手消息）' AFTER completion_tokens;
+
+ALTER TABLE ai_chat_messages_archive
+    ADD COLUMN truncated TINYINT NOT NULL DEFAULT 0 COMMENT '回复是否被中途停止（助手消息）' AFTER completion_tokens;
@@ -0,0 +1,8 @@
+-- http2 与其他连接参数一样，NULL 表示使用 HTTP_CLIENT_CONFIG 的默认值。
+-- 此前管理后台总是写入 0，已有的 0 视为未设置
+USE ai;
+
+ALTER TABLE api_providers
+    MODIFY COLUMN http2 TINYINT DEFAULT NULL COMMENT '是否启用HTTP/2：1-是，0-否，NULL-使用默认值';
+
+UPDATE api_providers SET http2 = NULL WHERE http2 = 0;
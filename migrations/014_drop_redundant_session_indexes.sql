@@ -0,0 +1,8 @@
+-- idx_user_update (user_id, update_time) 已覆盖按用户查询（包括 user_id 外键）和按用户、更新时间排序的查询，
+-- 单列的 idx_user_id 和 idx_update_time 只增加写入开销。
+-- 冷消息归档（python migrate.py archive）按 (user_id, update_time, id) 顺序扫描，同样使用 idx_user_update
+USE ai;
+
+ALTER TABLE chat_sessions
+    DROP INDEX idx_user_id,
+    DROP INDEX idx_update_time;
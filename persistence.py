@@ -0,0 +1,221 @@
+import asyncio
+import logging
+
+from pymysql.err import IntegrityError
+
+from message_archive import move_statements
+from usage import USER_COUNTS_SQL, DAILY_USAGE_SQL, user_counts, daily_usage
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceQueue:
+    # 对话消息的延迟批量写入：流式接口只负责入队，后台任务按间隔或批量大小合并写库。
+    # 每批在一个事务内依次执行：新建会话 -> 多行插入消息 -> 按会话合并更新消息数/预览/更新时间 -> 更新用户计数和每日用量。
+    # sync=True 时每次入队立即写库（测试或要求强一致时使用）。
+    def __init__(self, db_pool, flush_interval=0.2, max_batch=500, max_retries=3, flush_on_shutdown=True, sync=False):
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.flush_on_shutdown = flush_on_shutdown
+        self.sync = sync
+        self._pending = []
+        self._pending_sessions = {}
+        self._retries = 0
+        self._lock = None
+        self._wakeup = None
+        self._task = None
+        self.flushed_batches = 0
+        self.flushed_items = 0
+        self.failed_batches = 0
+        self.dropped_items = 0
+
+    def start(self):
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        if not self.sync:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.flush_on_shutdown:
+            await self.flush()
+        elif self._pending:
+            logger.warning("关闭时丢弃 %d 条未写入的数据", len(self._pending))
+
+    async def create_session(self, session_id, user_id, model_id, preview):
+        self._pending_sessions[session_id] = user_id
+        await self._enqueue(("session", session_id, user_id, model_id, preview))
+
+    async def add_message(self, session_id, user_id, role, content, model_id, preview=None, usage=None, truncated=False):
+        # 同时累加会话消息数并刷新更新时间；preview 仅在会话还没有预览时写入；
+        # model_id 为本次使用的模型，usage 为助手消息的 TokenUsage，都计入每日用量；
+        # truncated 表示助手回复被中途停止
+        await self._enqueue(("message", session_id, user_id, role, content, model_id, preview, usage, truncated))
+
+    def pending_owner(self, session_id):
+        # 已创建但尚未写入数据库的会话，返回其所属用户
+        return self._pending_sessions.get(session_id)
+
+    async def _enqueue(self, item):
+        self._pending.append(item)
+        if self.sync or self._task is None:
+            await self.flush()
+        elif len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("后台写入异常: %s", e)
+
+    async def flush(self):
+        # 写入当前所有待写数据；读取接口调用它以保证能读到本进程刚写的数据
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    if self.sync:
+                        # 同步模式下与直接写库一致，把错误交给调用方
+                        self._discard(batch)
+                        raise
+                    if isinstance(e, IntegrityError):
+                        # 数据本身的问题（例如会话已在流式输出期间被删除），重试无意义；
+                        # 逐条写入，只丢弃出错的那几条，不连累同批的其他会话
+                        logger.warning("批量写入违反约束，改为逐条写入: %s", e)
+                        try:
+                            await self._write_each(batch)
+                            self._retries = 0
+                            continue
+                        except Exception as item_error:
+                            # 已写入的数据已移出队列，batch 中只剩未写入的部分，按普通失败重试或丢弃
+                            e = item_error
+                    self.failed_batches += 1
+                    self._retries += 1
+                    if self._retries < self.max_retries:
+                        logger.warning("批量写入失败，稍后重试 (%d/%d): %s", self._retries, self.max_retries, e)
+                        return
+                    logger.error("批量写入连续失败，丢弃 %d 条数据: %s", len(batch), e)
+                    self.dropped_items += len(batch)
+                else:
+                    self.flushed_batches += 1
+                    self.flushed_items += len(batch)
+                self._retries = 0
+                self._discard(batch)
+
+    def _discard(self, batch):
+        # 从队首移除已处理（写入或丢弃）的一批
+        del self._pending[:len(batch)]
+        for item in batch:
+            if item[0] == "session":
+                self._pending_sessions.pop(item[1], None)
+
+    async def _write_each(self, batch):
+        # 逐条写入，每条写入（或因违反约束丢弃）后立即移出队列和 batch；
+        # 其他错误直接抛出，此时 batch 中只剩未写入的数据，已提交的不会被再次写入
+        while batch:
+            item = batch[0]
+            try:
+                await self._write([item])
+                self.flushed_items += 1
+            except IntegrityError as e:
+                logger.error("丢弃无法写入的数据 %s: %s", item[:3], e)
+                self.dropped_items += 1
+            self._discard([item])
+            del batch[0]
+
+    async def _write(self, batch):
+        sessions = []
+        messages = []
+        touches = {}
+        for item in batch:
+            if item[0] == "session":
+                sessions.append(item[1:])
+                continue
+            _, session_id, user_id, role, content, model_id, preview, usage, truncated = item
+            messages.append((session_id, user_id, role, content, model_id, usage, truncated))
+            count, first_preview = touches.get(session_id, (0, None))
+            touches[session_id] = (count + 1, first_preview or preview)
+        async with self.db_pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                try:
+                    if sessions:
+                        await cursor.executemany(
+                            "INSERT INTO chat_sessions (session_id, user_id, model_id, preview) VALUES (%s, %s, %s, %s)",
+                            sessions
+                        )
+                    if messages:
+                        keys = await self._session_keys(cursor, list(touches))
+                        # pymysql 会把 INSERT ... VALUES 的 executemany 改写为多行插入
+                        await cursor.executemany(
+                            "INSERT INTO ai_chat_messages "
+                            "(session_key, user_id, role, content, prompt_tokens, completion_tokens, truncated) "
+                            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                            [
+                                (keys[session_id], user_id, role, content, *(usage or (None, None)), int(truncated))
+                                for session_id, user_id, role, content, _, usage, truncated in messages
+                            ]
+                        )
+                        await cursor.executemany(
+                            "UPDATE chat_sessions SET message_count = message_count + %s, preview = COALESCE(preview, %s), "
+                            "update_time = NOW() WHERE id = %s",
+                            [(count, preview, keys[session_id]) for session_id, (count, preview) in touches.items()]
+                        )
+                        await cursor.executemany(
+                            USER_COUNTS_SQL, user_counts([(user_id, role) for _, user_id, role, _, _, _, _ in messages])
+                        )
+                        await cursor.executemany(
+                            DAILY_USAGE_SQL,
+                            daily_usage([
+                                (user_id, model_id, role, usage) for _, user_id, role, _, model_id, usage, _ in messages
+                            ])
+                        )
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def _session_keys(self, cursor, session_ids):
+        # 查出会话主键并锁定会话行（与归档互斥）；已归档的会话先把消息移回消息表
+        placeholders = ", ".join(["%s"] * len(session_ids))
+        await cursor.execute(
+            f"SELECT session_id, id, archived FROM chat_sessions WHERE session_id IN ({placeholders}) FOR UPDATE",
+            session_ids
+        )
+        rows = await cursor.fetchall()
+        if len(rows) < len(session_ids):
+            # 会话已在流式输出期间被删除，按违反外键约束处理
+            missing = set(session_ids) - {row[0] for row in rows}
+            raise IntegrityError(1452, f"会话不存在: {', '.join(sorted(missing))}")
+        archived = [key for _, key, flag in rows if flag]
+        if archived:
+            for sql, args in move_statements(archived, archive=False):
+                await cursor.execute(sql, args)
+        return {session_id: key for session_id, key, _ in rows}
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "flushed_batches": self.flushed_batches,
+            "flushed_items": self.flushed_items,
+            "failed_batches": self.failed_batches,
+            "dropped_items": self.dropped_items,
+        }
@@ -0,0 +1,196 @@
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# 按用户的 token 配额和请求频率限制，在调用上游之前检查；计数保存在内存或 Redis 中，检查时不访问数据库。
+# 每个请求检查两个范围：用户在全部模型上的合计（QUOTA_CONFIG 中的 user_*），
+# 以及用户在该模型上的用量（模型配置的 daily_token_quota / rpm_limit，为空时使用 QUOTA_CONFIG 中的 model_*）。
+# token 配额按自然日计算，请求数按自然分钟计算（固定窗口）。token 数在回复结束后才知道，
+# 配额用完之后的下一个请求才会被拒绝，最后一个请求可能略微超出。
+
+# 启动时从每日用量汇总表恢复当天已用的 token 数（进程内计数）。usage_daily 的日期取数据库的 CURDATE()，
+# 进程内计数的换日也按数据库的时区计算，两者使用同一个时钟
+TODAY_USAGE_SQL = "SELECT user_id, model_id, tokens FROM usage_daily WHERE day = CURDATE()"
+DB_CLOCK_SQL = "SELECT CURDATE(), TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), NOW())"
+
+
+class QuotaExceeded(Exception):
+    # 超出 token 配额或请求频率限制，调用方应直接告知用户
+    pass
+
+
+def _today(utc_offset=None):
+    # utc_offset 为数据库时区相对 UTC 的秒数，为 None 时使用本机日期
+    if utc_offset is None:
+        return date.today().isoformat()
+    return (datetime.now(timezone.utc) + timedelta(seconds=utc_offset)).date().isoformat()
+
+
+def _minute():
+    return int(time.time() // 60)
+
+
+def _check(model_id, tokens, requests, token_limit, request_limit):
+    # model_id 为 None 表示用户在全部模型上的合计
+    scope = f"在模型 {model_id} 上" if model_id is not None else ""
+    if token_limit is not None and tokens >= token_limit:
+        raise QuotaExceeded(f"今日{scope}的 token 配额已用完")
+    if request_limit is not None and requests >= request_limit:
+        raise QuotaExceeded(f"{scope}请求过于频繁，请稍后再试")
+
+
+class QuotaTracker:
+    # 进程内计数；多进程部署时各进程分别计数，需要共享时使用 RedisQuotaTracker
+    def __init__(self, db_pool=None, user_daily_tokens=None, user_rpm=None):
+        self.db_pool = db_pool
+        self.user_daily_tokens = user_daily_tokens
+        self.user_rpm = user_rpm
+        # (user_id, model_id) -> 当天的 token 数 / 当前分钟的请求数；model_id 为 None 表示全部模型合计
+        self._day = None
+        self._tokens = {}
+        self._minute = None
+        self._requests = {}
+        # 数据库时区相对 UTC 的秒数，启动时读取
+        self._utc_offset = None
+        self.rejected = 0
+
+    async def start(self):
+        if self.db_pool is None:
+            return
+        try:
+            async with self.db_pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(DB_CLOCK_SQL)
+                    db_day, self._utc_offset = await cursor.fetchone()
+                    await cursor.execute(TODAY_USAGE_SQL)
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            logger.warning("恢复当天的 token 用量失败，从零开始计数: %s", e)
+            return
+        self._rollover()
+        if self._day != db_day.isoformat():
+            # 查询期间数据库已经换日，读到的是前一天的用量
+            return
+        for user_id, model_id, tokens in rows:
+            for key in ((user_id, None), (user_id, model_id)):
+                self._tokens[key] = self._tokens.get(key, 0) + tokens
+
+    def _rollover(self):
+        day, minute = _today(self._utc_offset), _minute()
+        if day != self._day:
+            self._day, self._tokens = day, {}
+        if minute != self._minute:
+            self._minute, self._requests = minute, {}
+
+    async def acquire(self, user_id, model_id, daily_tokens=None, rpm=None):
+        # 检查配额并计入一次请求，超出时抛出 QuotaExceeded（不计入）；daily_tokens / rpm 为该模型的限制。
+        # 返回计入的分钟，请求在调用上游之前结束（例如没有获得准入）时用它调用 release 退回
+        self._rollover()
+        scopes = ((user_id, None), self.user_daily_tokens, self.user_rpm), ((user_id, model_id), daily_tokens, rpm)
+        try:
+            for key, token_limit, request_limit in scopes:
+                _check(key[1], self._tokens.get(key, 0), self._requests.get(key, 0), token_limit, request_limit)
+        except QuotaExceeded:
+            self.rejected += 1
+            raise
+        for key, _, _ in scopes:
+            self._requests[key] = self._requests.get(key, 0) + 1
+        return self._minute
+
+    async def release(self, user_id, model_id, minute):
+        # 退回 acquire 计入的请求；已经进入下一分钟时计数已重置，无需退回
+        self._rollover()
+        if minute != self._minute:
+            return
+        for key in ((user_id, None), (user_id, model_id)):
+            if self._requests.get(key):
+                self._requests[key] -= 1
+
+    async def add_tokens(self, user_id, model_id, tokens):
+        self._rollover()
+        for key in ((user_id, None), (user_id, model_id)):
+            self._tokens[key] = self._tokens.get(key, 0) + tokens
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "users_today": sum(1 for _, model_id in self._tokens if model_id is None),
+            "rejected": self.rejected,
+        }
+
+
+class RedisQuotaTracker:
+    # Redis 计数，多个进程共享；Redis 不可用时不限制（记录警告）
+    def __init__(self, redis, user_daily_tokens=None, user_rpm=None, prefix="ai-helper:quota:"):
+        self._redis = redis
+        self.user_daily_tokens = user_daily_tokens
+        self.user_rpm = user_rpm
+        self.prefix = prefix
+        self.rejected = 0
+
+    async def start(self):
+        pass
+
+    def _keys(self, user_id, model_id, minute=None):
+        scope = f"{user_id}:{model_id if model_id is not None else '*'}"
+        minute = _minute() if minute is None else minute
+        return f"{self.prefix}tokens:{_today()}:{scope}", f"{self.prefix}rpm:{minute}:{scope}"
+
+    async def acquire(self, user_id, model_id, daily_tokens=None, rpm=None):
+        # 返回计入的分钟；Redis 不可用（没有计入）时返回 None
+        minute = _minute()
+        scopes = (None, self.user_daily_tokens, self.user_rpm), (model_id, daily_tokens, rpm)
+        keys = [self._keys(user_id, scope, minute) for scope, _, _ in scopes]
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for token_key, request_key in keys:
+                    pipe.get(token_key)
+                    pipe.incr(request_key)
+                    pipe.expire(request_key, 120)
+                results = await pipe.execute()
+        except Exception as e:
+            logger.warning("读取配额计数失败，本次不限制: %s", e)
+            return None
+        try:
+            for i, (scope, token_limit, request_limit) in enumerate(scopes):
+                # incr 之后的值包含本次请求
+                _check(scope, int(results[i * 3] or 0), results[i * 3 + 1] - 1, token_limit, request_limit)
+        except QuotaExceeded:
+            self.rejected += 1
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for _, request_key in keys:
+                        pipe.decr(request_key)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("回退请求计数失败: %s", e)
+            raise
+        return minute
+
+    async def release(self, user_id, model_id, minute):
+        # 只退回当前分钟的计数，避免给已过期的键减出没有过期时间的负数
+        if minute is None or minute != _minute():
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for scope in (None, model_id):
+                    pipe.decr(self._keys(user_id, scope, minute)[1])
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("回退请求计数失败: %s", e)
+
+    async def add_tokens(self, user_id, model_id, tokens):
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for scope in (None, model_id):
+                    token_key, _ = self._keys(user_id, scope)
+                    pipe.incrby(token_key, tokens)
+                    pipe.expire(token_key, 2 * 86400)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("写入 token 用量失败: %s", e)
+
+    def stats(self):
+        return {"backend": "redis", "rejected": self.rejected}
@@ -0,0 +1,27 @@
+from config import REDIS_CONFIG
+
+# redis 为可选依赖（pip install redis），只有开启了 Redis 相关功能时才需要
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if aioredis is None:
+        raise RuntimeError("未安装 redis，无法启用 Redis 相关功能（pip install redis）")
+    if _client is None:
+        _client = aioredis.Redis(**REDIS_CONFIG)
+    return _client
+
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        # redis-py 5.0.1 起 close() 更名为 aclose()
+        close = getattr(_client, "aclose", None) or _client.close
+        _client = None
+        await close()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 完全相同的请求（同一模型、相同的上下文和生成参数）直接返回上次的完整回复，不再调用上游。
+# 只对管理后台开启了回复缓存的模型生效。
+
+
+def response_key(payload):
+    # payload 为发给上游的请求体。除 stream 外的字段都参与计算（模型、上下文、温度等生成参数），
+    # 消息内容去掉首尾空白并统一换行符，只差空格或换行的提问视为相同
+    params = {key: value for key, value in payload.items() if key not in ("messages", "stream")}
+    messages = [
+        (message["role"], message["content"].replace("\r\n", "\n").strip())
+        for message in payload["messages"]
+    ]
+    raw = json.dumps([params, messages], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    # 进程内缓存：按最近使用淘汰（LRU），同时限制条数和总字节数，条目超过 ttl 秒失效
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, max_entry_bytes=256 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        # key -> (回复, 字节数, 过期时间)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[2] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    async def put(self, key, reply):
+        size = len(reply.encode())
+        if size > self.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (reply, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class RedisResponseCache:
+    # Redis 缓存，多个进程共享。条目按 ttl 过期，总量由 Redis 的 maxmemory 淘汰策略控制
+    # （建议 allkeys-lru）；Redis 不可用时按未命中处理
+    def __init__(self, redis, max_entry_bytes=256 * 1024, ttl=3600, prefix="ai-helper:reply:"):
+        self._redis = redis
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        try:
+            value = await self._redis.get(self.prefix + key)
+        except Exception as e:
+            logger.warning("读取回复缓存失败: %s", e)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode()
+
+    async def put(self, key, reply):
+        value = reply.encode()
+        if len(value) > self.max_entry_bytes:
+            return
+        try:
+            await self._redis.set(self.prefix + key, value, ex=self.ttl)
+        except Exception as e:
+            logger.warning("写入回复缓存失败: %s", e)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 可续传的流式输出：每次生成在后台任务中进行，输出帧按序号（从 1 开始）保存在有界的环形缓冲中，
+# 响应只是缓冲的一个读取者，客户端断开不影响生成。客户端带上最后收到的序号（SSE 的 Last-Event-ID）
+# 重新连接时，先补发错过的帧再继续实时输出。生成结束 grace 秒后删除缓冲。
+
+
+class StreamNotFound(Exception):
+    # 输出不存在、已删除或不属于当前用户
+    pass
+
+
+class StreamExpired(Exception):
+    # 需要补发的帧已被环形缓冲覆盖
+    pass
+
+
+class _Buffer:
+    __slots__ = ("user_id", "frames", "last", "done", "readers", "last_seen", "_changed")
+
+    def __init__(self, user_id, max_frames):
+        self.user_id = user_id
+        self.frames = deque(maxlen=max_frames)
+        self.last = 0
+        self.done = False
+        self.readers = 0
+        self.last_seen = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def first(self):
+        # 缓冲中最早一帧的序号
+        return self.last - len(self.frames) + 1
+
+    def _publish(self):
+        # 唤醒所有等待中的读取者，之后的等待使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class ResumableStreams:
+    # 进程内缓冲，只能在本进程内续传；多进程部署时使用 RedisResumableStreams
+    def __init__(self, max_frames=2000, grace=60, idle_timeout=15):
+        self.max_frames = max_frames
+        self.grace = grace
+        self.idle_timeout = idle_timeout
+        self._buffers = {}
+        self.resumed = 0
+
+    async def create(self, user_id):
+        stream_id = uuid.uuid4().hex
+        self._buffers[stream_id] = _Buffer(user_id, self.max_frames)
+        return stream_id
+
+    async def publish(self, stream_id, frame):
+        buffer = self._buffers[stream_id]
+        buffer.frames.append(frame)
+        buffer.last += 1
+        buffer._publish()
+
+    async def finish(self, stream_id):
+        buffer = self._buffers[stream_id]
+        buffer.done = True
+        buffer._publish()
+        asyncio.get_running_loop().call_later(self.grace, self._evict, stream_id, buffer)
+
+    def _evict(self, stream_id, buffer):
+        if self._buffers.get(stream_id) is buffer:
+            del self._buffers[stream_id]
+
+    async def open(self, stream_id, user_id, after):
+        # 续传前检查：输出属于该用户，且 after 之后的帧都还在缓冲中
+        buffer = self._buffers.get(stream_id)
+        if buffer is None or buffer.user_id != user_id:
+            raise StreamNotFound(stream_id)
+        if after + 1 < buffer.first():
+            raise StreamExpired(stream_id)
+        self.resumed += 1
+
+    async def read(self, stream_id, after, timeout=None):
+        # 产出 after 之后的 (序号, 帧)，生成结束后返回；timeout 秒内没有新的帧时产出 (None, None)，
+        # 调用方借此检查客户端是否已断开。读得太慢、未读的帧被覆盖时抛出 StreamExpired
+        buffer = self._buffers.get(stream_id)
+        if buffer is None:
+            return
+        buffer.readers += 1
+        try:
+            while True:
+                while after < buffer.last:
+                    if after + 1 < buffer.first():
+                        raise StreamExpired(stream_id)
+                    after += 1
+                    yield after, buffer.frames[after - buffer.first()]
+                if buffer.done:
+                    return
+                try:
+                    await asyncio.wait_for(buffer._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    yield None, None
+        finally:
+            buffer.readers -= 1
+            buffer.last_seen = time.monotonic()
+
+    async def idle(self, stream_id):
+        # 没有读取者，且最后一个读取者离开已超过 idle_timeout
+        buffer = self._buffers.get(stream_id)
+        return buffer is None or (buffer.readers == 0 and time.monotonic() - buffer.last_seen >= self.idle_timeout)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "streams": len(self._buffers),
+            "generating": sum(1 for buffer in self._buffers.values() if not buffer.done),
+            "resumed": self.resumed,
+        }
+
+
+class RedisResumableStreams(ResumableStreams):
+    # 本进程生成的输出同时写入 Redis Stream（条目ID为 0-序号），其他进程可以从 Redis 续传；
+    # 本进程内的读取仍然读内存。Redis 不可用时只能在本进程内续传（记录警告）
+    def __init__(self, redis, max_frames=2000, grace=60, idle_timeout=15, max_age=3600, prefix="ai-helper:resume:"):
+        super().__init__(max_frames, grace, idle_timeout)
+        self._redis = redis
+        self.max_age = max_age
+        self.prefix = prefix
+        self._unmirrored = set()
+
+    def _keys(self, stream_id):
+        # 输出、所属用户、其他进程中的读取者心跳
+        return f"{self.prefix}{stream_id}", f"{self.prefix}{stream_id}:owner", f"{self.prefix}{stream_id}:alive"
+
+    async def _mirror(self, stream_id, commands):
+        if stream_id in self._unmirrored:
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            commands(pipe)
+            await pipe.execute()
+        except Exception as e:
+            # 之后的帧不再写入，避免其他进程读到不连续的输出
+            logger.warning("写入可续传输出失败，只能在本进程内续传: %s", e)
+            self._unmirrored.add(stream_id)
+
+    async def create(self, user_id):
+        stream_id = await super().create(user_id)
+        _, owner_key, _ = self._keys(stream_id)
+        await self._mirror(stream_id, lambda pipe: pipe.set(owner_key, user_id, ex=self.max_age))
+        return stream_id
+
+    async def publish(self, stream_id, frame):
+        await super().publish(stream_id, frame)
+        key, _, _ = self._keys(stream_id)
+        seq = self._buffers[stream_id].last
+
+        def commands(pipe):
+            pipe.xadd(key, {"f": frame}, id=f"0-{seq}", maxlen=self.max_frames, approximate=True)
+            pipe.expire(key, self.max_age)
+        await self._mirror(stream_id, commands)
+
+    async def finish(self, stream_id):
+        await super().finish(stream_id)
+        key, owner_key, _ = self._keys(stream_id)
+        seq = self._buffers[stream_id].last
+
+        def commands(pipe):
+            # 结束标记不是输出帧，读取者看到它就结束
+            pipe.xadd(key, {"end": 1}, id=f"0-{seq + 1}")
+            pipe.expire(key, self.grace)
+            pipe.expire(owner_key, self.grace)
+        await self._mirror(stream_id, commands)
+        self._unmirrored.discard(stream_id)
+
+    async def open(self, stream_id, user_id, after):
+        if stream_id in self._buffers:
+            return await super().open(stream_id, user_id, after)
+        key, owner_key, _ = self._keys(stream_id)
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.get(owner_key)
+            pipe.xrange(key, count=1)
+            owner, head = await pipe.execute()
+        except Exception as e:
+            logger.warning("读取可续传输出失败: %s", e)
+            raise StreamNotFound(stream_id)
+        if owner is None or int(owner) != user_id or not head:
+            raise StreamNotFound(stream_id)
+        if after + 1 < _seq(head[0][0]):
+            raise StreamExpired(stream_id)
+        self.resumed += 1
+
+    async def read(self, stream_id, after, timeout=None):
+        if stream_id in self._buffers:
+            async for item in super().read(stream_id, after, timeout):
+                yield item
+            return
+        # 其他进程生成的输出：阻塞读取 Redis Stream，并用心跳告知生成所在的进程仍有读取者
+        key, _, alive_key = self._keys(stream_id)
+        block = timeout or 5
+        alive_ttl = max(int(self.idle_timeout + block), 1)
+        try:
+            while True:
+                await self._redis.set(alive_key, 1, ex=alive_ttl)
+                result = await self._redis.xread({key: f"0-{after}"}, count=self.max_frames, block=int(block * 1000))
+                if not result:
+                    if not await self._redis.exists(key):
+                        return
+                    yield None, None
+                    continue
+                for entry_id, fields in result[0][1]:
+                    if b"end" in fields:
+                        return
+                    seq = _seq(entry_id)
+                    if seq != after + 1:
+                        raise StreamExpired(stream_id)
+                    after = seq
+                    yield seq, fields[b"f"].decode()
+        finally:
+            try:
+                if self.idle_timeout > 0:
+                    await self._redis.set(alive_key, 1, ex=max(int(self.idle_timeout), 1))
+                else:
+                    await self._redis.delete(alive_key)
+            except Exception as e:
+                logger.warning("更新续传心跳失败: %s", e)
+
+    async def idle(self, stream_id):
+        if not await super().idle(stream_id):
+            return False
+        try:
+            return not await self._redis.exists(self._keys(stream_id)[2])
+        except Exception as e:
+            logger.warning("读取续传心跳失败: %s", e)
+            return True
+
+    def stats(self):
+        return {**super().stats(), "backend": "redis"}
+
+
+def _seq(entry_id):
+    # Redis Stream 条目ID 0-序号
+    return int(entry_id.split(b"-")[1])
+
+
+async def produce(streams, stream_id, frames):
+    # 把一次生成的输出写入缓冲，直到生成结束；与客户端连接无关
+    try:
+        async for frame in frames:
+            await streams.publish(stream_id, frame)
+    finally:
+        await frames.aclose()
+        await streams.finish(stream_id)
+
+
+def _with_id(seq, frame):
+    # SSE id 放在帧内最后一个事件中（raw 模式下一帧可能包含多个事件），客户端收到带 id 的事件时整帧已收全
+    head, sep, last = frame.rstrip("\n").rpartition("\n\n")
+    return f"{head}{sep}id: {seq}\n{last}\n\n"
+
+
+async def relay(streams, stream_id, after, request, check_interval=None):
+    # 从缓冲读取 after 之后的帧，附带 SSE id 发给客户端；每 check_interval 秒检查一次客户端是否已断开，
+    # 断开后停止读取（生成继续进行，客户端可以续传）
+    last = after
+    try:
+        async for seq, frame in streams.read(stream_id, after, check_interval):
+            if seq is None:
+                if await request.is_disconnected():
+                    return
+                continue
+            last = seq
+            yield _with_id(seq, frame)
+    except StreamExpired:
+        # 同样带上 id（序号不变），客户端按完整的帧处理
+        yield _with_id(last, f"data: {json.dumps({'error': '输出已过期，无法继续接收，请重新加载会话'})}\n\n")
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from llm_clients import PROVIDER_HTTP_FIELDS
+from admission import PROVIDER_LIMIT_FIELDS
+
+# 路由中携带的服务商配置字段：连接参数和并发限制
+PROVIDER_FIELDS = PROVIDER_HTTP_FIELDS + PROVIDER_LIMIT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+ROUTING_SQL = f"""
+    SELECT mc.model_id, mc.model_name, mc.max_tokens, mc.hedge_delay_ms, mc.cache_enabled, mc.sort_order, mc.id,
+           mc.daily_token_quota, mc.rpm_limit, ap.id, ap.name, ap.api_key, ap.base_url,
+           {", ".join("ap." + field for field in PROVIDER_FIELDS)}
+    FROM model_configs mc
+    JOIN api_providers ap ON mc.provider_id = ap.id
+    WHERE mc.status = 1 AND ap.status = 1
+    ORDER BY ap.name, mc.sort_order, mc.id
+"""
+
+
+class RoutingTable:
+    # 模型 -> 服务商路由的内存快照：启动时加载，管理端修改后整体重建并递增版本号。
+    # 同一 model_id 可以配置在多个服务商下，routes[model_id] 为按排序权重排列的候选列表。
+    # 多进程部署时通过 TTL 后台刷新或 Redis 发布/订阅保持一致。
+    def __init__(self, db_pool, ttl=0, miss_reload_interval=5, channel="ai-helper:routing", on_reload=None):
+        self.db_pool = db_pool
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self.channel = channel
+        self.on_reload = on_reload
+        self.version = 0
+        self.routes = {}
+        self.providers = {}
+        self.catalog = {"models": [], "providers": {}}
+        self._loaded_at = None
+        self._lock = None
+        self._refresh_task = None
+        self._listen_task = None
+        self._redis = None
+        self._origin = uuid.uuid4().hex
+
+    async def _fetch(self):
+        async with self.db_pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(ROUTING_SQL)
+                return await cursor.fetchall()
+
+    async def reload(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            rows = await self._fetch()
+            routes = {}
+            providers = {}
+            catalog = {"models": [], "providers": {}}
+            for row in rows:
+                (model_id, model_name, max_tokens, hedge_delay_ms, cache_enabled, sort_order, config_id,
+                 daily_token_quota, rpm_limit, provider_id, provider_name, api_key, base_url) = row[:13]
+                provider = dict(zip(PROVIDER_FIELDS, row[13:]), base_url=base_url)
+                providers[provider_id] = provider
+                if model_id not in routes:
+                    routes[model_id] = []
+                    catalog["models"].append(model_id)
+                routes[model_id].append({
+                    "model_id": model_id,
+                    "model_name": model_name,
+                    "max_tokens": max_tokens,
+                    "hedge_delay_ms": hedge_delay_ms,
+                    "cache_enabled": bool(cache_enabled),
+                    "daily_token_quota": daily_token_quota,
+                    "rpm_limit": rpm_limit,
+                    "sort_order": (sort_order, config_id),
+                    "provider_id": provider_id,
+                    "provider_name": provider_name,
+                    "api_key": api_key,
+                    "provider": provider,
+                })
+                catalog["providers"].setdefault(provider_name, []).append({
+                    "model_id": model_id,
+                    "model_name": model_name
+                })
+            for candidates in routes.values():
+                candidates.sort(key=lambda route: route["sort_order"])
+            # 整体替换，读取方不会看到更新到一半的数据
+            self.routes, self.providers, self.catalog = routes, providers, catalog
+            self.version += 1
+            self._loaded_at = time.monotonic()
+        if self.on_reload is not None:
+            self.on_reload(self)
+
+    def _expired(self):
+        if self._loaded_at is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self._loaded_at > self.ttl
+
+    def _shared_reload(self):
+        # 同一时间只进行一次重新加载，并发的调用方等待同一个任务
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self.reload())
+            self._refresh_task.add_done_callback(_log_reload_failure)
+        return self._refresh_task
+
+    async def _reload_after_change(self):
+        # 进行中的加载可能在修改之前就读取了数据库，等它结束后再加载一次；失败由 _log_reload_failure 记录
+        stale = self._refresh_task is not None and not self._refresh_task.done()
+        try:
+            await asyncio.shield(self._shared_reload())
+            if stale:
+                await asyncio.shield(self._shared_reload())
+        except Exception:
+            pass
+
+    async def get_routes(self, model_id):
+        if self._loaded_at is None:
+            # 单个请求取消时不取消其他请求共同等待的加载
+            await asyncio.shield(self._shared_reload())
+        elif self._expired():
+            # 过期时先用旧数据响应，后台刷新
+            self._shared_reload()
+        routes = self.routes.get(model_id)
+        if routes is None and time.monotonic() - self._loaded_at > self.miss_reload_interval:
+            # 未命中可能是其他进程刚添加的模型，限频重新加载一次；同一模型的大量请求共用一次加载
+            await asyncio.shield(self._shared_reload())
+            routes = self.routes.get(model_id)
+        return routes
+
+    async def get_catalog(self):
+        if self._loaded_at is None:
+            await asyncio.shield(self._shared_reload())
+        elif self._expired():
+            self._shared_reload()
+        return self.catalog
+
+    async def invalidate(self):
+        # 管理端修改后调用：本进程立即重建，并通知其他进程
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.warning("重建路由表失败，将在下次访问时重试: %s", e)
+            self._loaded_at = None
+        if self._redis is not None:
+            try:
+                await self._redis.publish(self.channel, json.dumps({"origin": self._origin, "version": self.version}))
+            except Exception as e:
+                logger.warning("发布路由表更新通知失败: %s", e)
+
+    async def start(self, redis=None):
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.warning("加载路由表失败，将在首次请求时重试: %s", e)
+        if redis is not None:
+            self._redis = redis
+            self._listen_task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if json.loads(message["data"]).get("origin") != self._origin:
+                        await self._reload_after_change()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("路由表订阅中断，5秒后重连: %s", e)
+            finally:
+                await _close_pubsub(pubsub)
+            await asyncio.sleep(5)
+
+    async def stop(self):
+        for task in (self._listen_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "models": len(self.routes),
+            "providers": len(self.providers),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+        }
+
+
+async def _close_pubsub(pubsub):
+    # 每次重连使用新的订阅连接，旧的必须关闭；redis-py 5.0.1 起 close() 更名为 aclose()
+    try:
+        close = getattr(pubsub, "aclose", None) or pubsub.close
+        await close()
+    except Exception as e:
+        logger.warning("关闭路由表订阅连接失败: %s", e)
+
+
+def _log_reload_failure(task):
+    # 后台刷新失败只记录；等待该任务的调用方会收到同一个异常
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("刷新路由表失败: %s", task.exception())
@@ -0,0 +1,53 @@
+import base64
+import html
+import re
+
+# 对话消息全文搜索的查询构造和摘要高亮，查询本身由 ai_chat_messages 上的 ngram 全文索引完成
+
+
+def search_terms(query, min_length=2):
+    # 按空白拆分搜索词，去掉引号（布尔模式中的短语分隔符）和过短的词，保持顺序去重
+    terms = []
+    for term in query.replace('"', " ").split():
+        if len(term) >= min_length and term.lower() not in (t.lower() for t in terms):
+            terms.append(term)
+    return terms
+
+
+def boolean_query(terms):
+    # 每个词都作为短语且必须出现：ngram 分词下短语即连续出现的字符，
+    # 不会把“数据库”拆成“数据”“据库”各自匹配
+    return " ".join(f'+"{term}"' for term in terms)
+
+
+def encode_search_cursor(score, pk):
+    return base64.urlsafe_b64encode(f"{score}|{pk}".encode()).decode()
+
+
+def decode_search_cursor(value):
+    # 格式错误时抛出 ValueError
+    score, pk = base64.urlsafe_b64decode(value.encode()).decode().split("|")
+    return int(score), int(pk)
+
+
+def highlight(content, terms, length=80):
+    # 取第一个命中位置附近 length 个字符作为摘要，HTML 转义后用 <mark> 标出所有命中的词
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(content)
+    start = 0
+    if match is not None and len(content) > length:
+        start = max(0, min(match.start() - length // 4, len(content) - length))
+    window = content[start:start + length]
+    parts = []
+    last = 0
+    for found in pattern.finditer(window):
+        parts.append(html.escape(window[last:found.start()]))
+        parts.append("<mark>" + html.escape(found.group()) + "</mark>")
+        last = found.end()
+    parts.append(html.escape(window[last:]))
+    snippet = "".join(parts)
+    if start > 0:
+        snippet = "…" + snippet
+    if start + length < len(content):
+        snippet += "…"
+    return snippet
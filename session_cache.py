@@ -0,0 +1,138 @@
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# 缓存活跃会话最近的上下文消息，连续对话时不必再读取 ai_chat_messages。
+# 每个会话记录消息总数 total，与 chat_sessions.message_count 比较：
+# 数据库中的数量更大说明其他进程写入过新消息，本地缓存已过期。
+
+
+class _Entry:
+    __slots__ = ("user_id", "messages", "total", "expires_at")
+
+    def __init__(self, user_id, messages, total, expires_at):
+        self.user_id = user_id
+        self.messages = messages
+        self.total = total
+        self.expires_at = expires_at
+
+
+class SessionContextCache:
+    # 进程内 LRU 缓存
+    def __init__(self, max_sessions=10000, max_messages=50, ttl=1800):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, session_id, user_id, min_total=0):
+        # 返回 (按时间正序的 [(role, content)], 消息总数)，未命中返回 None
+        entry = self._entries.get(session_id)
+        now = time.monotonic()
+        if entry is None or entry.user_id != user_id or entry.expires_at < now or entry.total < min_total:
+            if entry is not None:
+                del self._entries[session_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        entry.expires_at = now + self.ttl
+        self.hits += 1
+        return list(entry.messages), entry.total
+
+    async def put(self, session_id, user_id, messages, total):
+        self._entries[session_id] = _Entry(
+            user_id, deque(messages, maxlen=self.max_messages), total, time.monotonic() + self.ttl
+        )
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    async def append(self, session_id, role, content):
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.messages.append((role, content))
+            entry.total += 1
+
+    async def invalidate(self, session_id):
+        self._entries.pop(session_id, None)
+
+    def stats(self):
+        return {"backend": "memory", "sessions": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class RedisSessionContextCache:
+    # Redis 缓存，多个进程共享；Redis 不可用时按未命中处理，不影响对话
+    def __init__(self, redis, max_messages=50, ttl=1800, prefix="ai-helper:ctx:"):
+        self._redis = redis
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _keys(self, session_id):
+        return f"{self.prefix}{session_id}:meta", f"{self.prefix}{session_id}:msgs"
+
+    async def get(self, session_id, user_id, min_total=0):
+        meta_key, msgs_key = self._keys(session_id)
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hgetall(meta_key)
+            pipe.lrange(msgs_key, 0, -1)
+            pipe.expire(meta_key, self.ttl)
+            pipe.expire(msgs_key, self.ttl)
+            meta, raw, _, _ = await pipe.execute()
+        except Exception as e:
+            logger.warning("读取会话缓存失败: %s", e)
+            self.misses += 1
+            return None
+        if (not meta or b"user_id" not in meta or int(meta[b"user_id"]) != user_id
+                or int(meta[b"total"]) < min_total or not raw):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [tuple(json.loads(item)) for item in raw], int(meta[b"total"])
+
+    async def put(self, session_id, user_id, messages, total):
+        meta_key, msgs_key = self._keys(session_id)
+        messages = list(messages)[-self.max_messages:]
+        try:
+            pipe = self._redis.pipeline(transaction=True)
+            pipe.delete(meta_key, msgs_key)
+            pipe.hset(meta_key, mapping={"user_id": user_id, "total": total})
+            if messages:
+                pipe.rpush(msgs_key, *(json.dumps(message, ensure_ascii=False) for message in messages))
+            pipe.expire(meta_key, self.ttl)
+            pipe.expire(msgs_key, self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("写入会话缓存失败: %s", e)
+
+    async def append(self, session_id, role, content):
+        meta_key, msgs_key = self._keys(session_id)
+        try:
+            pipe = self._redis.pipeline(transaction=True)
+            # RPUSHX 只在列表已存在时追加，未缓存的会话不会被创建出残缺的条目
+            pipe.rpushx(msgs_key, json.dumps((role, content), ensure_ascii=False))
+            pipe.ltrim(msgs_key, -self.max_messages, -1)
+            pipe.hincrby(meta_key, "total", 1)
+            pipe.expire(meta_key, self.ttl)
+            pipe.expire(msgs_key, self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("追加会话缓存失败: %s", e)
+            await self.invalidate(session_id)
+
+    async def invalidate(self, session_id):
+        try:
+            await self._redis.delete(*self._keys(session_id))
+        except Exception as e:
+            logger.warning("删除会话缓存失败: %s", e)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FlightCancelled(Exception):
+    # 所有订阅者都已离开，上游请求被取消
+    pass
+
+
+class Flight:
+    # 一个进行中的上游请求。产出的数据按顺序保存在 items 中，每个订阅者各自记录读到的位置：
+    # 读得慢的订阅者只会落后，不会拖慢上游或其他订阅者；中途加入的订阅者从头读起
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _publish(self):
+        # 唤醒所有等待中的订阅者，之后的等待使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self):
+        return Subscription(self)
+
+
+class Subscription:
+    # 订阅者的读取位置。创建时立即计入订阅者（而不是首次读取时），读完、出错、被取消或 aclose 时退出；
+    # 最后一个订阅者退出时上游请求还没结束则取消它
+    def __init__(self, flight):
+        self.flight = flight
+        self.index = 0
+        self.closed = False
+        flight.subscribers += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        flight = self.flight
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            while self.index >= len(flight.items):
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    raise StopAsyncIteration
+                await flight._changed.wait()
+        except BaseException:
+            await self.aclose()
+            raise
+        self.index += 1
+        return flight.items[self.index - 1]
+
+    async def aclose(self):
+        # 可重复调用
+        if self.closed:
+            return
+        self.closed = True
+        flight = self.flight
+        flight.subscribers -= 1
+        if not flight.subscribers and not flight.done and flight.task is not None:
+            flight.task.cancel()
+
+
+class SingleFlight:
+    # 相同 key 的并发请求共用一个上游请求：第一个请求调用上游，其余请求订阅它的输出。
+    # 上游请求在后台任务中运行，发起者断开不影响其他订阅者；所有订阅者都断开时取消。
+    # 只在本进程内合并
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+
+    def get(self, key):
+        # 订阅进行中的请求，没有时返回 None；返回的订阅不再使用时需要 aclose
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        self.joined += 1
+        return flight.subscribe()
+
+    def start(self, key, source, on_finish=None):
+        # source 为上游数据的异步迭代器；on_finish 在请求结束（包括出错、取消）后调用，用于释放资源。
+        # 返回发起者自己的订阅
+        flight = Flight()
+        self._flights[key] = flight
+        flight.task = asyncio.get_running_loop().create_task(self._run(flight, source))
+        # 收尾放在完成回调中：任务在开始运行前就被取消时协程不会执行，但回调仍会调用
+        flight.task.add_done_callback(lambda task: self._finish(key, flight, on_finish))
+        self.started += 1
+        return flight.subscribe()
+
+    async def _run(self, flight, source):
+        try:
+            async for item in source:
+                flight.items.append(item)
+                flight._publish()
+        except asyncio.CancelledError:
+            flight.error = FlightCancelled("请求已取消")
+        except Exception as e:
+            flight.error = e
+
+    def _finish(self, key, flight, on_finish):
+        if flight.error is None and flight.task.cancelled():
+            flight.error = FlightCancelled("请求已取消")
+        # 先移出再标记结束，之后到达的相同请求会重新发起（或命中回复缓存）
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.done = True
+        flight._publish()
+        if on_finish is not None:
+            on_finish()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(flight.subscribers for flight in self._flights.values()),
+            "started": self.started,
+            "joined": self.joined,
+        }
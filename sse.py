@@ -0,0 +1,178 @@
+import asyncio
+import json
+from json.decoder import scanstring
+from json.encoder import encode_basestring_ascii
+from typing import NamedTuple
+
+# orjson 为可选依赖（pip install orjson），未安装时使用标准库 json
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# 上游流式数据块中 delta.content 的起始标记
+_CONTENT_KEY = '"content":"'
+
+
+def delta_content(data: str):
+    # 从上游 data 帧中取出 choices[0].delta.content，没有内容时返回 None。
+    # 常见格式下只解码 content 这一个字符串，不构建整个对象；
+    # 格式不符合预期（有空格、多个 content 字段等）时退回完整解析。
+    # 数据不是合法 JSON 时抛出 ValueError（json.JSONDecodeError / orjson.JSONDecodeError 均为其子类）
+    i = data.find(_CONTENT_KEY)
+    if i != -1 and data.find(_CONTENT_KEY, i + 1) == -1 and '"delta":{' in data[:i]:
+        try:
+            return scanstring(data, i + len(_CONTENT_KEY))[0]
+        except ValueError:
+            pass
+    chunk = loads(data)
+    choices = chunk.get("choices") if isinstance(chunk, dict) else None
+    if choices:
+        return (choices[0].get("delta") or {}).get("content")
+    return None
+
+
+class TokenUsage(NamedTuple):
+    prompt_tokens: int
+    completion_tokens: int
+
+
+def frame_usage(data: str):
+    # 从上游 data 帧中取出 usage（请求带 stream_options.include_usage 时，服务商在最后一帧返回），
+    # 没有时返回 None；只在帧中出现 "usage" 时才解析
+    if '"usage"' not in data:
+        return None
+    chunk = loads(data)
+    usage = chunk.get("usage") if isinstance(chunk, dict) else None
+    if not isinstance(usage, dict):
+        return None
+    prompt, completion = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if not isinstance(prompt, int) or not isinstance(completion, int):
+        return None
+    return TokenUsage(prompt, completion)
+
+
+def content_frame(content: str) -> str:
+    # 等价于 f"data: {json.dumps({'content': content})}\n\n"，省去构建字典和通用编码器的开销
+    return 'data: {"content": ' + encode_basestring_ascii(content) + '}\n\n'
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_END = object()
+_TIMEOUT = object()
+
+
+class _Buffer:
+    # coalesce 中等待发出的片段：累计字节数，并记录缓冲中第一个片段的发出期限
+    def __init__(self, loop, flush_bytes, flush_interval):
+        self.loop = loop
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.parts = []
+        self.size = 0
+        self.deadline = None
+
+    def add(self, fragment):
+        # 加入片段，达到 flush_bytes 时返回 True
+        self.parts.append(fragment)
+        self.size += len(fragment.encode())
+        if self.deadline is None:
+            self.deadline = self.loop.time() + self.flush_interval
+        return self.size >= self.flush_bytes
+
+    def timeout(self):
+        # 距离发出期限的秒数，缓冲为空时返回 None（一直等待）
+        return None if self.deadline is None else max(self.deadline - self.loop.time(), 0)
+
+    def take(self):
+        chunk = "".join(self.parts)
+        self.parts = []
+        self.size = 0
+        self.deadline = None
+        return chunk
+
+
+async def _pump(fragments, queue):
+    # 后台读取上游，结束或出错时放入 _END / _Failure
+    try:
+        async for fragment in fragments:
+            queue.put_nowait(fragment)
+        queue.put_nowait(_END)
+    except Exception as e:
+        queue.put_nowait(_Failure(e))
+
+
+async def _halt(stop, task, queue):
+    await stop.wait()
+    task.cancel()
+    queue.put_nowait(_END)
+
+
+async def _next_item(queue, timeout):
+    # 取下一个片段，超时返回 _TIMEOUT
+    try:
+        return queue.get_nowait()
+    except asyncio.QueueEmpty:
+        pass
+    try:
+        return await asyncio.wait_for(queue.get(), timeout)
+    except asyncio.TimeoutError:
+        return _TIMEOUT
+
+
+def _finished(item):
+    # item 为 _END 时返回 True，为 _Failure 时抛出上游的异常
+    if isinstance(item, _Failure):
+        raise item.exc
+    return item is _END
+
+
+async def _drain(queue, buffer):
+    # 第一个片段立即发出，之后按 buffer 的字节数和期限合并发出
+    item = await queue.get()
+    if _finished(item):
+        return
+    yield item
+    while True:
+        item = await _next_item(queue, buffer.timeout())
+        if item is _TIMEOUT:
+            yield buffer.take()
+        elif item is _END or isinstance(item, _Failure):
+            if buffer.parts:
+                yield buffer.take()
+            _finished(item)
+            return
+        elif buffer.add(item):
+            yield buffer.take()
+
+
+async def coalesce(fragments, flush_bytes=512, flush_interval=0.02, stop=None):
+    # 合并连续的输出片段以减少写出的帧数：第一个片段立即发出，之后累计到 flush_bytes 字节
+    # 或距离缓冲中第一个片段超过 flush_interval 秒时发出，以先到者为准。
+    # 上游由后台任务读取，上游停顿时缓冲的内容也会按时发出。
+    # stop 为 asyncio.Event：被设置后立即取消后台任务（上游请求随之关闭），发出已读到的内容后正常结束
+    if flush_interval <= 0:
+        if stop is None:
+            async for fragment in fragments:
+                yield fragment
+            return
+        # 不合并，但仍由后台任务读取上游，以便随时停止
+        flush_bytes = 0
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    task = loop.create_task(_pump(fragments, queue))
+    watcher = loop.create_task(_halt(stop, task, queue)) if stop is not None else None
+    try:
+        async for chunk in _drain(queue, _Buffer(loop, flush_bytes, flush_interval)):
+            yield chunk
+    finally:
+        task.cancel()
+        if watcher is not None:
+            watcher.cancel()
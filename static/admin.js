@@ -13,7 +13,14 @@ createApp({
                 name: '',
                 base_url: '',
                 api_key: '',
-                description: ''
+                description: '',
+                max_connections: null,
+                keepalive_expiry: null,
+                connect_timeout: null,
+                read_timeout: null,
+                http2: null,
+                max_concurrency: null,
+                max_queue: null
             },
             // 模型配置数据
             models: [],
@@ -25,6 +32,10 @@ createApp({
                 model_name: '',
                 max_tokens: 4000,
                 sort_order: 0,
+                hedge_delay_ms: null,
+                cache_enabled: 0,
+                daily_token_quota: null,
+                rpm_limit: null,
                 description: ''
             },
             // 用户管理数据
@@ -35,7 +46,11 @@ createApp({
                 username: '',
                 status: 1,
                 is_admin: 0
-            }
+            },
+            // 用量统计数据
+            usageRange: null,
+            usageGroupBy: 'day',
+            usage: { group_by: 'day', rows: [], total: null }
         };
     },
     mounted() {
@@ -70,8 +85,13 @@ createApp({
                 confirmButtonText: '确定',
                 cancelButtonText: '取消',
                 type: 'warning'
-            }).then(() => {
-                document.cookie = 'session_token=; expires=Thu, 01 Jan 1970 00:00:00 UTC; path=/;';
+            }).then(async () => {
+                // 会话 cookie 是 httponly 的，由服务端注销并清除
+                try {
+                    await fetch('/api/logout', { method: 'POST', credentials: 'include' });
+                } catch (error) {
+                    // 忽略
+                }
                 window.location.href = '/';
             });
         },
@@ -98,7 +118,14 @@ createApp({
                 name: provider.name,
                 base_url: provider.base_url,
                 api_key: '', // 编辑时需要重新输入API密钥
-                description: provider.description || ''
+                description: provider.description || '',
+                max_connections: provider.max_connections,
+                keepalive_expiry: provider.keepalive_expiry,
+                connect_timeout: provider.connect_timeout,
+                read_timeout: provider.read_timeout,
+                http2: provider.http2,
+                max_concurrency: provider.max_concurrency,
+                max_queue: provider.max_queue
             };
             this.showProviderDialog = true;
         },
@@ -115,7 +142,15 @@ createApp({
                     name: this.providerForm.name,
                     base_url: this.providerForm.base_url,
                     api_key: this.providerForm.api_key || '',
-                    description: this.providerForm.description || ''
+                    description: this.providerForm.description || '',
+                    // 连接参数留空表示使用服务端默认值
+                    max_connections: this.providerForm.max_connections ?? null,
+                    keepalive_expiry: this.providerForm.keepalive_expiry ?? null,
+                    connect_timeout: this.providerForm.connect_timeout ?? null,
+                    read_timeout: this.providerForm.read_timeout ?? null,
+                    http2: this.providerForm.http2 ?? null,
+                    max_concurrency: this.providerForm.max_concurrency ?? null,
+                    max_queue: this.providerForm.max_queue ?? null
                 };
                 console.log('发送的数据:', providerData);
                 
@@ -171,7 +206,14 @@ createApp({
                 name: '',
                 base_url: '',
                 api_key: '',
-                description: ''
+                description: '',
+                max_connections: null,
+                keepalive_expiry: null,
+                connect_timeout: null,
+                read_timeout: null,
+                http2: null,
+                max_concurrency: null,
+                max_queue: null
             };
         },
 
@@ -257,6 +299,10 @@ createApp({
                 model_name: '',
                 max_tokens: 4000,
                 sort_order: 0,
+                hedge_delay_ms: null,
+                cache_enabled: 0,
+                daily_token_quota: null,
+                rpm_limit: null,
                 description: ''
             };
         },
@@ -334,9 +380,36 @@ createApp({
                     ElMessage.error('删除失败');
                 }
             });
+        },
+
+        // 用量统计（不选日期时为最近30天）
+        async loadUsage() {
+            const params = new URLSearchParams({ group_by: this.usageGroupBy });
+            if (this.usageRange) {
+                params.set('start', this.usageRange[0]);
+                params.set('end', this.usageRange[1]);
+            }
+            try {
+                const response = await fetch(`/api/admin/usage?${params}`, {
+                    credentials: 'include'
+                });
+                if (response.ok) {
+                    this.usage = await response.json();
+                } else {
+                    const error = await response.json();
+                    ElMessage.error(error.detail || '加载用量统计失败');
+                }
+            } catch (error) {
+                ElMessage.error('加载用量统计失败');
+            }
         }
     },
     watch: {
+        activeTab(val) {
+            if (val === 'usage') {
+                this.loadUsage();
+            }
+        },
         showProviderDialog(val) {
             if (!val) {
                 this.resetProviderForm();
@@ -1,13 +1,15 @@
 const { createApp } = Vue;
 const { ElMessage, ElMessageBox } = ElementPlus;
-const { Delete, Picture, SwitchButton } = ElementPlusIconsVue;
+const { Delete, Download, Picture, SwitchButton, Upload } = ElementPlusIconsVue;
 
 createApp({
     setup() {
         return {
             Delete,
+            Download,
             Picture,
-            SwitchButton
+            SwitchButton,
+            Upload
         };
     },
     data() {
@@ -29,7 +31,21 @@ createApp({
             messages: [],
             inputMessage: '',
             isTyping: false,
+            // 服务繁忙时的排队位置，null 表示未排队
+            queuePosition: null,
+            // 正在生成回复的会话和请求，用于停止生成
+            streamingSessionId: null,
+            streamController: null,
             sessions: [],
+            // 分页状态：会话列表向下滚动加载更早的会话，消息区向上滚动加载更早的消息
+            sessionsCursor: null,
+            sessionsHasMore: false,
+            loadingSessions: false,
+            // 增量同步标记：之后只获取该时间以来有更新的会话
+            sessionsSyncToken: null,
+            messagesCursor: null,
+            messagesHasMore: false,
+            loadingOlderMessages: false,
             currentSessionId: null,
             userId: null,
             userInfo: {
@@ -39,23 +55,33 @@ createApp({
             },
             dateRange: null,
             dateFilterCollapse: [],
-            isDateFiltered: false
+            isDateFiltered: false,
+            // 消息搜索：输入停顿后自动搜索，结果按相关度分页
+            searchQuery: '',
+            searchResults: [],
+            searchCursor: null,
+            searchHasMore: false,
+            loadingSearch: false,
+            searchTimer: null,
+            searchSeq: 0
         }
     },
     async mounted() {
         // 检查登录状态
         await this.checkLoginStatus();
+        // 切回页面时同步其他标签页或设备上的会话变化
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'visible' && this.isLoggedIn) {
+                this.syncSessions();
+            }
+        });
+    },
+    computed: {
+        isSearching() {
+            return this.searchQuery.trim().length >= 2;
+        }
     },
     methods: {
-        getCookie(name) {
-            const value = `; ${document.cookie}`;
-            const parts = value.split(`; ${name}=`);
-            if (parts.length === 2) return parts.pop().split(';').shift();
-        },
-        setCookie(name, value, days = 7) {
-            const expires = new Date(Date.now() + days * 864e5).toUTCString();
-            document.cookie = `${name}=${value}; expires=${expires}; path=/`;
-        },
         async handleLogin() {
             try {
                 await this.$refs.loginFormRef.validate();
@@ -72,7 +98,6 @@ createApp({
                 
                 if (response.ok) {
                     if (this.isLogin) {
-                        this.setCookie('user_id', data.user_id);
                         this.userId = data.user_id;
                         this.isLoggedIn = true;
                         await this.loadModels();
@@ -93,24 +118,18 @@ createApp({
             }
         },
         async checkLoginStatus() {
-            const userId = this.getCookie('user_id');
-            if (userId) {
-                this.userId = userId;
-                // 验证登录状态是否有效
-                try {
-                    const response = await fetch('/api/models');
-                    if (response.status === 401) {
-                        this.handleLogout();
-                        return;
-                    }
-                    this.isLoggedIn = true;
-                    await this.loadModels();
-                    await this.loadSessions();
-                    await this.loadUserInfo();
-                } catch (error) {
-                    this.handleLogout();
+            // 会话 cookie 是 httponly 的，脚本读不到，由服务端验证登录状态
+            try {
+                const response = await fetch('/api/user/info');
+                if (response.status === 401) {
+                    this.isLoggedIn = false;
+                    return;
                 }
-            } else {
+                this.userInfo = await response.json();
+                this.isLoggedIn = true;
+                await this.loadModels();
+                await this.loadSessions();
+            } catch (error) {
                 this.isLoggedIn = false;
             }
         },
@@ -125,17 +144,42 @@ createApp({
                 message_count: 0,
                 avatar: ''
             };
-            // 清除cookie
-            document.cookie = 'user_id=; expires=Thu, 01 Jan 1970 00:00:00 UTC; path=/;';
             ElMessage.warning('登录已过期，请重新登录');
         },
         handleAvatarCommand(command) {
             if (command === 'changeAvatar') {
                 this.$refs.avatarInput.click();
+            } else if (command === 'exportChats') {
+                // 浏览器直接下载，服务端流式输出
+                window.location.href = '/api/chat/export?compress=true';
+            } else if (command === 'importChats') {
+                this.$refs.archiveInput.click();
             } else if (command === 'logout') {
                 this.logout();
             }
         },
+        async handleArchiveImport(event) {
+            const file = event.target.files[0];
+            if (!file) return;
+            try {
+                const formData = new FormData();
+                formData.append('file', file);
+                const response = await fetch('/api/chat/import', {
+                    method: 'POST',
+                    body: formData
+                });
+                const data = await response.json();
+                if (response.ok) {
+                    ElMessage.success(`已导入 ${data.imported_sessions} 个会话、${data.imported_messages} 条消息`);
+                } else {
+                    ElMessage.error(data.detail || '导入失败');
+                }
+                await this.loadSessions();
+            } catch (error) {
+                ElMessage.error('网络错误');
+            }
+            event.target.value = '';
+        },
         triggerAvatarUpload() {
             this.$refs.avatarInput.click();
         },
@@ -203,8 +247,131 @@ createApp({
                 }
                 const data = await response.json();
                 this.sessions = data.sessions || [];
+                this.sessionsCursor = data.next_cursor;
+                this.sessionsHasMore = !!data.has_more;
+                this.sessionsSyncToken = data.sync_token;
+            } catch (error) {
+                ElMessage.error('加载对话历史失败');
+            }
+        },
+        async syncSessions() {
+            // 时间筛选中显示的是搜索结果，不做增量合并
+            if (this.isDateFiltered) return;
+            if (!this.sessionsSyncToken) {
+                await this.loadSessions();
+                return;
+            }
+            try {
+                const response = await fetch(`/api/chat/sessions/changes?since=${encodeURIComponent(this.sessionsSyncToken)}`);
+                if (response.status === 401) {
+                    this.handleLogout();
+                    return;
+                }
+                const data = await response.json();
+                if (data.has_more) {
+                    // 变化太多，直接重新加载
+                    await this.loadSessions();
+                    return;
+                }
+                // 按更新时间正序返回，依次放到列表顶部后最新的在最上面
+                (data.sessions || []).forEach(session => this.upsertSession(session));
+                this.sessionsSyncToken = data.sync_token;
+            } catch (error) {
+                console.log('同步会话列表失败:', error);
+            }
+        },
+        upsertSession(session) {
+            const index = this.sessions.findIndex(s => s.session_id === session.session_id);
+            if (this.isDateFiltered) {
+                // 时间筛选中只更新已显示的会话
+                if (index !== -1) this.sessions.splice(index, 1, session);
+                return;
+            }
+            if (index !== -1) this.sessions.splice(index, 1);
+            this.sessions.unshift(session);
+        },
+        async loadMoreSessions() {
+            if (!this.sessionsHasMore || this.loadingSessions) return;
+            this.loadingSessions = true;
+            try {
+                let response;
+                if (this.isDateFiltered) {
+                    response = await fetch('/api/chat/history/date-range', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({
+                            start_time: this.dateRange[0],
+                            end_time: this.dateRange[1],
+                            before: this.sessionsCursor
+                        })
+                    });
+                } else {
+                    response = await fetch(`/api/chat/history?before=${encodeURIComponent(this.sessionsCursor)}`);
+                }
+                if (response.status === 401) {
+                    this.handleLogout();
+                    return;
+                }
+                const data = await response.json();
+                // 去重：加载期间列表可能已被更新
+                const known = new Set(this.sessions.map(s => s.session_id));
+                this.sessions.push(...(data.sessions || []).filter(s => !known.has(s.session_id)));
+                this.sessionsCursor = data.next_cursor;
+                this.sessionsHasMore = !!data.has_more;
             } catch (error) {
                 ElMessage.error('加载对话历史失败');
+            } finally {
+                this.loadingSessions = false;
+            }
+        },
+        onSessionsScroll(event) {
+            const el = event.target;
+            if (el.scrollHeight - el.scrollTop - el.clientHeight < 50) {
+                this.loadMoreSessions();
+            }
+        },
+        onSearchInput() {
+            clearTimeout(this.searchTimer);
+            // 作废进行中的请求，避免旧的结果覆盖新的
+            this.searchSeq++;
+            if (!this.isSearching) {
+                this.searchResults = [];
+                this.loadingSearch = false;
+                return;
+            }
+            this.loadingSearch = true;
+            this.searchTimer = setTimeout(() => this.searchMessages(false), 250);
+        },
+        async searchMessages(more) {
+            const seq = ++this.searchSeq;
+            const params = new URLSearchParams({ q: this.searchQuery.trim() });
+            if (more) params.set('cursor', this.searchCursor);
+            this.loadingSearch = true;
+            try {
+                const response = await fetch(`/api/chat/search?${params}`);
+                if (response.status === 401) {
+                    this.handleLogout();
+                    return;
+                }
+                const data = await response.json();
+                if (seq !== this.searchSeq) return;
+                if (!response.ok) {
+                    ElMessage.error(data.detail || '搜索失败');
+                    return;
+                }
+                this.searchResults = more ? this.searchResults.concat(data.results) : data.results;
+                this.searchCursor = data.next_cursor;
+                this.searchHasMore = !!data.has_more;
+            } catch (error) {
+                if (seq === this.searchSeq) ElMessage.error('搜索失败');
+            } finally {
+                if (seq === this.searchSeq) this.loadingSearch = false;
+            }
+        },
+        onSearchScroll(event) {
+            const el = event.target;
+            if (this.searchHasMore && !this.loadingSearch && el.scrollHeight - el.scrollTop - el.clientHeight < 50) {
+                this.searchMessages(true);
             }
         },
         async loadUserInfo() {
@@ -230,6 +397,8 @@ createApp({
                 }
                 const data = await response.json();
                 this.messages = data.conversation || [];
+                this.messagesCursor = data.next_cursor;
+                this.messagesHasMore = !!data.has_more;
                 this.$nextTick(() => {
                     this.scrollToBottom();
                 });
@@ -237,9 +406,44 @@ createApp({
                 ElMessage.error('加载对话失败');
             }
         },
+        async loadOlderMessages() {
+            if (!this.messagesHasMore || this.loadingOlderMessages || !this.currentSessionId) return;
+            const sessionId = this.currentSessionId;
+            const container = this.$refs.messagesContainer;
+            this.loadingOlderMessages = true;
+            try {
+                const response = await fetch(`/api/chat/history?session_id=${sessionId}&before=${this.messagesCursor}`);
+                if (response.status === 401) {
+                    this.handleLogout();
+                    return;
+                }
+                const data = await response.json();
+                // 加载期间切换了会话则丢弃结果
+                if (sessionId !== this.currentSessionId) return;
+                const previousHeight = container.scrollHeight;
+                this.messages.unshift(...(data.conversation || []));
+                this.messagesCursor = data.next_cursor;
+                this.messagesHasMore = !!data.has_more;
+                // 保持当前可见内容的位置不变
+                this.$nextTick(() => {
+                    container.scrollTop += container.scrollHeight - previousHeight;
+                });
+            } catch (error) {
+                ElMessage.error('加载对话失败');
+            } finally {
+                this.loadingOlderMessages = false;
+            }
+        },
+        onMessagesScroll(event) {
+            if (event.target.scrollTop < 50) {
+                this.loadOlderMessages();
+            }
+        },
         startNewChat() {
             this.currentSessionId = null;
             this.messages = [];
+            this.messagesCursor = null;
+            this.messagesHasMore = false;
         },
         async sendMessage() {
             if (!this.inputMessage.trim() || this.isTyping) return;
@@ -254,6 +458,8 @@ createApp({
             const messageToSend = this.inputMessage;
             this.inputMessage = '';
             this.isTyping = true;
+            this.streamController = new AbortController();
+            let assistantMessage = null;
             
             this.$nextTick(() => {
                 this.scrollToBottom();
@@ -267,7 +473,8 @@ createApp({
                         message: messageToSend,
                         model_id: this.currentModel,
                         session_id: this.currentSessionId
-                    })
+                    }),
+                    signal: this.streamController.signal
                 });
                 
                 if (response.status === 401) {
@@ -276,52 +483,170 @@ createApp({
                     return;
                 }
                 
-                const reader = response.body.getReader();
-                const decoder = new TextDecoder();
-                let assistantMessage = {
+                assistantMessage = {
                     role: 'assistant',
                     content: '',
                     timestamp: new Date().toISOString()
                 };
                 this.messages.push(assistantMessage);
-                
+                // 连接中断时带上最后收到的帧序号重新连接，服务端补发错过的内容后继续输出，不会重新生成
+                const stream = { id: null, lastEventId: 0, finished: false };
+                let current = response;
+                let retries = 0;
                 while (true) {
-                    const { done, value } = await reader.read();
-                    if (done) break;
-                    
-                    const chunk = decoder.decode(value, { stream: true });
-                    const lines = chunk.split('\n');
-                    
-                    for (const line of lines) {
-                        if (line.trim() && line.startsWith('data: ')) {
-                            try {
-                                const data = JSON.parse(line.slice(6));
-                                if (data.content) {
-                                    assistantMessage.content += data.content;
-                                    // 强制Vue更新DOM
-                                    this.$forceUpdate();
-                                    this.$nextTick(() => {
-                                        this.scrollToBottom();
-                                    });
-                                } else if (data.done) {
-                                    this.currentSessionId = data.session_id;
-                                    await this.loadSessions();
-                                    // 更新消息计数
-                                    this.userInfo.message_count++;
-                                } else if (data.error) {
-                                    ElMessage.error('AI回复出错: ' + data.error);
-                                }
-                            } catch (e) {
-                                console.log('解析数据出错:', line, e);
-                            }
-                        }
+                    const lastEventId = stream.lastEventId;
+                    try {
+                        await this.readStream(current, assistantMessage, stream);
+                        if (stream.finished || !stream.id) break;
+                    } catch (error) {
+                        if (error.name === 'AbortError' || !stream.id) throw error;
                     }
+                    // 没有收到结束事件就断开了；期间收到过新的帧时重新计算重试次数
+                    retries = stream.lastEventId > lastEventId ? 1 : retries + 1;
+                    if (retries > 3) throw new Error('连接已断开');
+                    await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                    current = await fetch(`/api/chat/stream/${stream.id}`, {
+                        headers: { 'Last-Event-ID': String(stream.lastEventId) },
+                        signal: this.streamController.signal
+                    });
+                    if (!current.ok) throw new Error('续传失败: ' + current.status);
                 }
             } catch (error) {
-                ElMessage.error('发送消息失败');
-                this.messages.pop(); // 移除失败的消息
+                if (error.name === 'AbortError' && assistantMessage) {
+                    // 已断开连接，服务端在客户端没有重新连接时停止生成并保存已生成的部分
+                    assistantMessage.truncated = true;
+                    if (this.streamingSessionId) {
+                        this.currentSessionId = this.streamingSessionId;
+                        await this.syncSessions();
+                    }
+                } else if (assistantMessage && assistantMessage.content) {
+                    // 续传失败：保留已收到的内容，服务端仍会保存回复
+                    assistantMessage.truncated = true;
+                    ElMessage.error('连接已断开，请稍后重新打开会话查看完整回复');
+                } else {
+                    ElMessage.error('发送消息失败');
+                    this.messages.pop(); // 移除失败的消息
+                }
             } finally {
                 this.isTyping = false;
+                this.queuePosition = null;
+                this.streamingSessionId = null;
+                this.streamController = null;
+            }
+        },
+        async readStream(response, assistantMessage, stream) {
+            // 读取流式响应并更新助手消息；stream 记录输出ID、最后收到的帧序号和是否已结束，用于续传
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            // 一次读取可能在数据帧中间截断，未读完的最后一行留到下次拼接
+            let buffer = '';
+            // 服务端每帧的 id 在帧内最后一个事件中（raw 模式下一帧可能包含多个事件）。
+            // 收到带 id 的事件时整帧才算收全，此时才处理帧内的事件并记下序号；中途断开时这一帧在续传时完整重发，
+            // 不会丢失也不会重复
+            let frameEvents = [];
+            let eventData = null;
+            let eventId = null;
+            
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                
+                // 一次读取可能包含多个数据帧，每帧也可能是合并后的多个片段；读完这批再统一刷新界面
+                let received = false;
+                for (const line of lines) {
+                    if (line.startsWith('id: ')) {
+                        eventId = Number(line.slice(4));
+                    } else if (line.startsWith('data: ')) {
+                        eventData = line.slice(6);
+                    } else if (!line.trim()) {
+                        // 空行结束一个事件
+                        if (eventData !== null) {
+                            frameEvents.push(eventData);
+                            eventData = null;
+                        }
+                        if (eventId !== null) {
+                            for (const data of frameEvents) {
+                                if (await this.handleStreamEvent(data, assistantMessage, stream)) {
+                                    received = true;
+                                }
+                            }
+                            frameEvents = [];
+                            stream.lastEventId = eventId;
+                            eventId = null;
+                        }
+                    }
+                }
+                if (received) {
+                    // 强制Vue更新DOM
+                    this.$forceUpdate();
+                    this.$nextTick(() => {
+                        this.scrollToBottom();
+                    });
+                }
+            }
+        },
+        async handleStreamEvent(line, assistantMessage, stream) {
+            // 处理一个数据事件，收到回复内容时返回 true
+            try {
+                const data = JSON.parse(line);
+                // 服务端 raw 模式下转发的是上游原始数据帧
+                const content = data.content || (data.choices && data.choices[0] && data.choices[0].delta && data.choices[0].delta.content);
+                if (content) {
+                    this.queuePosition = null;
+                    assistantMessage.content += content;
+                    return true;
+                } else if (data.queue_position) {
+                    this.queuePosition = data.queue_position;
+                } else if (data.done) {
+                    stream.finished = true;
+                    this.currentSessionId = data.session_id;
+                    if (data.truncated) {
+                        assistantMessage.truncated = true;
+                    }
+                    // 用结束事件中的会话摘要更新侧边栏，不再重新加载整个列表
+                    if (data.session) {
+                        this.upsertSession(data.session);
+                    } else {
+                        await this.syncSessions();
+                    }
+                    // 更新消息计数
+                    this.userInfo.message_count++;
+                } else if (data.session_id) {
+                    // 开始生成回复，记下会话ID以便停止
+                    this.streamingSessionId = data.session_id;
+                } else if (data.stream_id) {
+                    stream.id = data.stream_id;
+                } else if (data.error) {
+                    stream.finished = true;
+                    ElMessage.error('AI回复出错: ' + data.error);
+                }
+            } catch (e) {
+                console.log('解析数据出错:', line, e);
+            }
+            return false;
+        },
+        async stopGeneration() {
+            if (!this.isTyping) return;
+            // 通知服务端停止，之后照常收到结束事件（部分回复已保存）；
+            // 还没有开始生成（排队中）或停止失败时直接断开连接
+            if (this.streamingSessionId) {
+                try {
+                    const response = await fetch('/api/chat/stop', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ session_id: this.streamingSessionId })
+                    });
+                    if (response.ok) return;
+                } catch (error) {
+                    console.log('停止生成失败:', error);
+                }
+            }
+            if (this.streamController) {
+                this.streamController.abort();
             }
         },
         scrollToBottom() {
@@ -369,8 +694,7 @@ createApp({
                 const response = await fetch(`/api/chat/session/${sessionId}`, {
                     method: 'DELETE',
                     headers: {
-                        'Content-Type': 'application/json',
-                        'Cookie': document.cookie
+                        'Content-Type': 'application/json'
                     }
                 });
                 
@@ -383,11 +707,10 @@ createApp({
                     ElMessage.success('对话已删除');
                     // 如果删除的是当前会话，清空消息
                     if (this.currentSessionId === sessionId) {
-                        this.messages = [];
-                        this.currentSessionId = null;
+                        this.startNewChat();
                     }
-                    // 重新加载会话列表
-                    await this.loadSessions();
+                    // 从列表中移除
+                    this.sessions = this.sessions.filter(s => s.session_id !== sessionId);
                 } else {
                     const error = await response.json();
                     ElMessage.error(error.detail || '删除失败');
@@ -398,19 +721,27 @@ createApp({
                 }
             }
         },
-        logout() {
+        async logout() {
+            // 服务端注销会话并清除 cookie
+            try {
+                await fetch('/api/logout', { method: 'POST' });
+            } catch (error) {
+                // 网络错误时也退出界面，会话到期后自动失效
+            }
             this.isLoggedIn = false;
             this.userId = null;
             this.currentSessionId = null;
             this.messages = [];
             this.sessions = [];
-            // 清除cookie
-            document.cookie = 'user_id=; expires=Thu, 01 Jan 1970 00:00:00 UTC; path=/;';
             ElMessage.success('已退出登录');
         },
-        clearCookieAndReload() {
-            // 清除所有cookie
-            document.cookie = 'user_id=; expires=Thu, 01 Jan 1970 00:00:00 UTC; path=/;';
+        async clearCookieAndReload() {
+            // 注销会话（cookie 由服务端清除）
+            try {
+                await fetch('/api/logout', { method: 'POST' });
+            } catch (error) {
+                // 忽略
+            }
             // 重新加载页面
             location.reload();
         },
@@ -424,8 +755,7 @@ createApp({
                 const response = await fetch('/api/chat/history/date-range', {
                     method: 'POST',
                     headers: {
-                        'Content-Type': 'application/json',
-                        'Cookie': `user_id=${this.userId}`
+                        'Content-Type': 'application/json'
                     },
                     body: JSON.stringify({
                         start_time: this.dateRange[0],
@@ -436,12 +766,14 @@ createApp({
                 if (response.ok) {
                     const data = await response.json();
                     this.sessions = data.sessions;
+                    this.sessionsCursor = data.next_cursor;
+                    this.sessionsHasMore = !!data.has_more;
                     this.isDateFiltered = true;
                     
                     if (data.sessions.length === 0) {
                         ElMessage.info('该时间范围内没有找到对话记录');
                     } else {
-                        ElMessage.success(`找到 ${data.sessions.length} 条对话记录`);
+                        ElMessage.success(`找到 ${data.sessions.length}${data.has_more ? '+' : ''} 条对话记录`);
                     }
                 } else {
                     ElMessage.error('搜索失败');
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, ProviderGate
+
+
+def test_try_acquire_up_to_max_concurrency():
+    gate = ProviderGate(max_concurrency=2, max_queue=10, max_queue_per_user=3)
+    first, second = gate.try_acquire(1), gate.try_acquire(2)
+    assert first.admitted and second.admitted
+    assert gate.try_acquire(3) is None
+    first.release()
+    first.release()
+    assert gate.active == 1
+    assert gate.try_acquire(3) is not None
+
+
+def test_queue_round_robin_between_users():
+    async def run():
+        gate = ProviderGate(max_concurrency=1, max_queue=10, max_queue_per_user=3)
+        holder = gate.acquire(0)
+        a1, a2 = gate.acquire("a"), gate.acquire("a")
+        b1 = gate.acquire("b")
+        positions = [gate.position(ticket) for ticket in (a1, b1, a2)]
+        holder.release()
+        after_holder = (a1.admitted, b1.admitted, a2.admitted)
+        a1.release()
+        # a 还有排队的请求，但下一个位置轮到 b
+        after_a1 = (b1.admitted, a2.admitted)
+        return positions, after_holder, after_a1
+    positions, after_holder, after_a1 = asyncio.run(run())
+    assert positions == [1, 2, 3]
+    assert after_holder == (True, False, False)
+    assert after_a1 == (True, False)
+
+
+def test_queue_limits():
+    async def run():
+        gate = ProviderGate(max_concurrency=1, max_queue=2, max_queue_per_user=1)
+        gate.acquire(0)
+        gate.acquire("a")
+        with pytest.raises(AdmissionRejected):
+            gate.acquire("a")
+        gate.acquire("b")
+        with pytest.raises(AdmissionRejected):
+            gate.acquire("c")
+        return gate.stats()
+    stats = asyncio.run(run())
+    assert (stats["active"], stats["waiting"], stats["rejected"]) == (1, 2, 2)
+
+
+def test_releasing_a_waiting_ticket_leaves_the_queue():
+    async def run():
+        gate = ProviderGate(max_concurrency=1, max_queue=10, max_queue_per_user=3)
+        holder = gate.acquire(0)
+        waiting = gate.acquire("a")
+        other = gate.acquire("b")
+        waiting.release()
+        position = gate.position(other)
+        holder.release()
+        return position, other.admitted, gate.waiting
+    assert asyncio.run(run()) == (1, True, 0)
+
+
+def test_positions_reports_changes_and_times_out():
+    async def run():
+        gate = ProviderGate(max_concurrency=1, max_queue=10, max_queue_per_user=3)
+        gate.acquire(0)
+        gate.acquire("a")
+        ticket = gate.acquire("b")
+        seen = []
+        with pytest.raises(AdmissionRejected):
+            async for position in ticket.positions(interval=0.01, timeout=0.05):
+                seen.append(position)
+        return seen
+    assert asyncio.run(run()) == [2]
+
+
+def test_positions_ends_when_admitted():
+    async def run():
+        gate = ProviderGate(max_concurrency=1, max_queue=10, max_queue_per_user=3)
+        holder = gate.acquire(0)
+        ticket = gate.acquire("a")
+        asyncio.get_running_loop().call_later(0.02, holder.release)
+        seen = [position async for position in ticket.positions(interval=1, timeout=5)]
+        return seen, ticket.admitted
+    assert asyncio.run(run()) == ([1], True)
+
+
+def test_controller_applies_provider_limits():
+    controller = AdmissionController({"max_concurrency": 5, "max_queue": 10, "max_queue_per_user": 2})
+    assert controller.limits_for({}) == (5, 10, 2)
+    assert controller.limits_for({"max_concurrency": 1, "max_queue": 0}) == (1, 0, 2)
+    assert controller.try_acquire(1, {"max_concurrency": 1}, "a") is not None
+    assert controller.try_acquire(1, {"max_concurrency": 1}, "a") is None
+    # 调大并发数后立即生效
+    assert controller.try_acquire(1, {"max_concurrency": 2}, "a") is not None
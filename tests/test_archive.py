@@ -0,0 +1,126 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from archive import ArchiveError, ArchiveImporter, ExportLimiter, read_lines
+
+
+class Upload:
+    # 按指定大小分块读取的上传文件
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    async def read(self, size):
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+
+def test_read_lines_splits_across_chunks():
+    async def run():
+        return [line async for line in read_lines(Upload(b'{"a": 1}\n{"b": 2}\n\n{"c": 3}'), 4)]
+    assert asyncio.run(run()) == [b'{"a": 1}', b'{"b": 2}', b"", b'{"c": 3}']
+
+
+def test_read_lines_keeps_multibyte_characters_intact():
+    data = '{"content": "中文"}\n'.encode()
+
+    async def run():
+        return [line async for line in read_lines(Upload(data), 1)]
+    assert asyncio.run(run()) == [data.rstrip(b"\n")]
+
+
+def test_read_lines_detects_gzip():
+    data = gzip.compress("第一行\n第二行\n".encode())
+
+    async def run():
+        return [line async for line in read_lines(Upload(data), 64)]
+    assert asyncio.run(run()) == ["第一行".encode(), "第二行".encode()]
+
+
+def test_read_lines_gzip_in_small_chunks():
+    # 前几块只够解出 gzip 头，解压结果为空
+    data = "".join(f"第{i}行\n" for i in range(50)).encode()
+
+    async def run():
+        return [line async for line in read_lines(Upload(gzip.compress(data)), 5)]
+    assert asyncio.run(run()) == data.split(b"\n")[:-1]
+
+
+def test_read_lines_rejects_truncated_gzip():
+    compressed = gzip.compress("".join(f"第{i}行\n" for i in range(500)).encode())
+
+    async def run():
+        return [line async for line in read_lines(Upload(compressed[:len(compressed) // 2]), 64)]
+    with pytest.raises(ArchiveError):
+        asyncio.run(run())
+
+
+def test_read_lines_empty_upload():
+    async def run():
+        return [line async for line in read_lines(Upload(b""), 4)]
+    assert asyncio.run(run()) == []
+
+
+def test_export_limiter_rejects_when_full():
+    limiter = ExportLimiter(2)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+
+class FakeConnection:
+    # chat_sessions 中已有 existing 里的会话；记录写入的会话
+    def __init__(self, existing):
+        self.existing = set(existing)
+        self.inserted = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    async def commit(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, sql, args):
+        if sql.startswith("SELECT session_id FROM"):
+            self.rows = [(session_id,) for session_id in args if session_id in self.conn.existing]
+        else:
+            self.rows = [(session_id, index) for index, session_id in enumerate(args, 1)]
+
+    async def executemany(self, sql, rows):
+        if sql.startswith("INSERT INTO chat_sessions"):
+            self.conn.inserted.extend(row[0] for row in rows)
+
+    async def fetchall(self):
+        return self.rows
+
+
+def test_keep_ids_skips_existing_sessions_and_their_messages():
+    async def run():
+        conn = FakeConnection({"s2"})
+        importer = ArchiveImporter(conn, None, keep_ids=True)
+        items = [{"type": "session", "session_id": s, "model_id": "m", "user_id": 1} for s in ("s1", "s2", "s3")]
+        items += [{"type": "message", "session_id": s, "role": "user", "content": "hi"} for s in ("s2", "s3")]
+        for lineno, item in enumerate(items, 1):
+            await importer.add_line(json.dumps(item), lineno)
+        return conn.inserted, await importer.finish()
+    inserted, result = asyncio.run(run())
+    assert inserted == ["s1", "s3"]
+    assert (result["imported_sessions"], result["skipped_sessions"]) == (2, 1)
+    assert (result["imported_messages"], result["skipped_messages"]) == (1, 1)
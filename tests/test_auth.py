@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from auth import AuthUser, SessionStore, RedisSessionStore
+
+
+class FakePool:
+    # 只支持 USER_AUTH_SQL：按用户ID返回 users 中的 (id, status, is_admin)
+    def __init__(self, users):
+        self.users = users
+        self.queries = 0
+
+    def connection(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+
+class FakeCursor(FakeConnection):
+    async def execute(self, sql, args):
+        self.pool.queries += 1
+        self.row = self.pool.users.get(args[0])
+        # 模拟读取数据库之后、写入缓存之前用户被修改
+        during_query, self.pool.during_query = getattr(self.pool, "during_query", None), None
+        if during_query is not None:
+            await during_query()
+
+    async def fetchone(self):
+        return self.row
+
+
+def test_login_record_is_cached():
+    async def run():
+        pool = FakePool({1: (1, 1, 1)})
+        store = SessionStore(pool)
+        token = await store.create(1, AuthUser(1, 1, 1))
+        users = [await store.authenticate(token) for _ in range(3)]
+        return users, pool.queries, await store.authenticate("forged")
+    users, queries, forged = asyncio.run(run())
+    assert users == [AuthUser(1, 1, 1)] * 3
+    assert queries == 0
+    assert forged is None
+
+
+def test_cache_miss_loads_once_until_invalidated():
+    async def run():
+        pool = FakePool({1: (1, 1, 0)})
+        store = SessionStore(pool)
+        token = await store.create(1)
+        first = await store.authenticate(token)
+        await store.authenticate(token)
+        pool.users[1] = (1, 1, 1)
+        stale = await store.authenticate(token)
+        await store.invalidate_user(1)
+        fresh = await store.authenticate(token)
+        return first, stale, fresh, pool.queries
+    assert asyncio.run(run()) == (AuthUser(1, 1, 0), AuthUser(1, 1, 0), AuthUser(1, 1, 1), 2)
+
+
+def test_revoke_user_ends_all_sessions():
+    async def run():
+        store = SessionStore(FakePool({1: (1, 1, 0), 2: (2, 1, 0)}))
+        tokens = [await store.create(1), await store.create(1)]
+        other = await store.create(2)
+        await store.revoke_user(1)
+        return [await store.authenticate(token) for token in tokens], await store.authenticate(other)
+    assert asyncio.run(run()) == ([None, None], AuthUser(2, 1, 0))
+
+
+def test_logout_and_expiry():
+    async def run():
+        store = SessionStore(FakePool({1: (1, 1, 0)}), session_ttl=0.01)
+        token = await store.create(1)
+        await store.delete(token)
+        logged_out = await store.authenticate(token)
+        token = await store.create(1)
+        await asyncio.sleep(0.02)
+        return logged_out, await store.authenticate(token), store.stats()["sessions"]
+    assert asyncio.run(run()) == (None, None, 0)
+
+
+def test_deleted_user_session_is_dropped():
+    async def run():
+        pool = FakePool({})
+        store = SessionStore(pool)
+        token = await store.create(1)
+        return await store.authenticate(token), store.stats()["sessions"]
+    assert asyncio.run(run()) == (None, 0)
+
+
+def test_redis_store_shared_between_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        redis = fakeredis.FakeAsyncRedis()
+        pool = FakePool({1: (1, 1, 0)})
+        first, second = RedisSessionStore(redis, pool), RedisSessionStore(redis, pool)
+        token = await first.create(1, AuthUser(1, 1, 0))
+        before = await second.authenticate(token)
+        pool.users[1] = (1, 0, 0)
+        await first.invalidate_user(1)
+        disabled = await second.authenticate(token)
+        await first.revoke_user(1)
+        return before, disabled, await second.authenticate(token), pool.queries
+    assert asyncio.run(run()) == (AuthUser(1, 1, 0), AuthUser(1, 0, 0), None, 1)
+
+
+def test_load_racing_invalidate_is_not_cached():
+    async def run():
+        pool = FakePool({1: (1, 1, 0)})
+        store = SessionStore(pool)
+
+        async def disable():
+            # 查询进行中管理员禁用了该用户
+            pool.users[1] = (1, 0, 0)
+            await store.invalidate_user(1)
+        pool.during_query = disable
+        return await store.get_user(1), await store.get_user(1), pool.queries
+    assert asyncio.run(run()) == (AuthUser(1, 1, 0), AuthUser(1, 0, 0), 2)
+
+
+def test_redis_load_racing_invalidate_is_not_cached():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        pool = FakePool({1: (1, 1, 0)})
+        redis = fakeredis.FakeAsyncRedis()
+        first, second = RedisSessionStore(redis, pool), RedisSessionStore(redis, pool)
+
+        async def disable():
+            # 第一个进程查询期间，另一个进程禁用了该用户
+            pool.users[1] = (1, 0, 0)
+            await second.invalidate_user(1)
+        pool.during_query = disable
+        stale = await first.get_user(1)
+        return stale, await first.get_user(1), await second.get_user(1), pool.queries
+    assert asyncio.run(run()) == (AuthUser(1, 1, 0), AuthUser(1, 0, 0), AuthUser(1, 0, 0), 2)
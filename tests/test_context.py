@@ -0,0 +1,54 @@
+from context import build_context, chat_payload, context_budget, estimate_tokens, message_tokens, MESSAGE_OVERHEAD_TOKENS
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    # CJK 字符按 1 token/字
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("你好abcd") == 3
+    assert message_tokens("abcd") == 1 + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_context_budget():
+    assert context_budget(1000, 0.25, 4096) == 750
+    assert context_budget(None, 0.5, 4096) == 2048
+    assert context_budget(1, 0.9, 4096) == 1
+
+
+def test_build_context_keeps_newest_history_within_budget():
+    # history 从新到旧；每条 "abcd" 计 5 个 token
+    history = [("assistant", "a3a3"), ("user", "u3u3"), ("assistant", "a2a2"), ("user", "u2u2")]
+    context = build_context(history, "next", 15)
+    assert context == [
+        {"role": "user", "content": "u3u3"},
+        {"role": "assistant", "content": "a3a3"},
+        {"role": "user", "content": "next"},
+    ]
+
+
+def test_build_context_stops_at_first_message_over_budget():
+    history = [("assistant", "x" * 400), ("user", "abcd")]
+    context = build_context(history, "next", 20)
+    # 放不下的消息之前的更早消息也不再加入，保证上下文连续
+    assert context == [{"role": "user", "content": "next"}]
+
+
+def test_build_context_always_keeps_current_message():
+    context = build_context([("user", "abcd")], "x" * 1000, 10)
+    assert context == [{"role": "user", "content": "x" * 1000}]
+
+
+def test_chat_payload_limits_history_not_reply():
+    history = [("assistant", "x" * 400), ("user", "abcd")]
+    payload = chat_payload("m", history, "next", context_budget(1000, 0.25, 4096), include_usage=True)
+    assert payload["messages"] == [
+        {"role": "user", "content": "abcd"},
+        {"role": "assistant", "content": "x" * 400},
+        {"role": "user", "content": "next"},
+    ]
+    # 预算只截取历史，不限制回复长度
+    assert "max_tokens" not in payload
+    assert payload["stream_options"] == {"include_usage": True}
+    assert "stream_options" not in chat_payload("m", [], "next", 10)
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from pymysql.constants import SERVER_STATUS
+
+import db
+from db import ConnectionPool, is_read
+
+
+class FakeRaw:
+    # 记录收到的命令；BEGIN 之后到 COMMIT / ROLLBACK 之前处于事务中
+    def __init__(self, log, **kwargs):
+        self.log = log
+        self.kwargs = kwargs
+        self.open = True
+        self.server_status = 0
+
+    def cursor(self, cursor_class=None):
+        return FakeRawCursor(self)
+
+    def begin(self):
+        self.log.append("begin")
+        self.server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def commit(self):
+        self.log.append("commit")
+        self.server_status = 0
+
+    def rollback(self):
+        self.log.append("rollback")
+        self.server_status = 0
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.log.append("close")
+        self.open = False
+
+
+class FakeRawCursor:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def execute(self, query, args=None):
+        self.raw.log.append(query.split()[0])
+
+    def executemany(self, query, args):
+        self.execute(query)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def log(monkeypatch):
+    log = []
+    monkeypatch.setattr(db.pymysql, "connect", lambda **kwargs: FakeRaw(log, **kwargs))
+    return log
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT 1", True),
+    ("  select id FROM t", True),
+    ("SELECT /*+ MAX_EXECUTION_TIME(1000) */ id FROM t", True),
+    ("SHOW TABLES", True),
+    ("SELECT id FROM t WHERE id = %s FOR UPDATE", False),
+    ("SELECT id FROM t LOCK IN SHARE MODE", False),
+    ("INSERT INTO t SELECT * FROM s", False),
+    ("UPDATE t SET a = 1", False),
+])
+def test_is_read(query, expected):
+    assert is_read(query) is expected
+
+
+def test_reads_do_not_open_a_transaction(log):
+    async def run():
+        pool = ConnectionPool(minsize=0, maxsize=1)
+        async with pool.connection() as conn:
+            await conn.cursor().execute("SELECT 1")
+            await conn.commit()
+        await pool.close()
+        return conn.raw.kwargs
+    kwargs = asyncio.run(run())
+    assert kwargs["autocommit"] is True
+    assert log == ["SELECT", "close"]
+
+
+def test_writes_run_in_a_transaction(log):
+    async def run():
+        pool = ConnectionPool(minsize=0, maxsize=1)
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+            await cursor.execute("SELECT 1")
+            await cursor.execute("INSERT INTO t VALUES (1)")
+            await cursor.executemany("UPDATE t SET a = %s", [(1,), (2,)])
+            await conn.commit()
+        async with pool.connection() as conn:
+            await conn.cursor().execute("DELETE FROM t")
+        return pool.stats()["idle"]
+    assert asyncio.run(run()) == 1
+    assert log == ["SELECT", "begin", "INSERT", "UPDATE", "commit", "begin", "DELETE", "rollback"]
+
+
+def test_connection_returned_after_close_is_closed(log):
+    async def run():
+        pool = ConnectionPool(minsize=0, maxsize=2)
+        leased = await pool.acquire()
+        async with pool.connection():
+            pass
+        await pool.close()
+        await pool.release(leased)
+        return pool.stats()
+    stats = asyncio.run(run())
+    assert log.count("close") == 2
+    assert (stats["size"], stats["in_use"]) == (0, 0)
+
+
+@pytest.mark.parametrize("native_timeout", [True, False])
+def test_timeouts_racing_releases_keep_every_permit(log, monkeypatch, native_timeout):
+    if not native_timeout:
+        monkeypatch.delattr(asyncio, "timeout", raising=False)
+
+    async def run():
+        pool = ConnectionPool(minsize=0, maxsize=2, acquire_timeout=0.01)
+        held = [await pool.acquire(), await pool.acquire()]
+        for _ in range(20):
+            # 归还连接的时间点与等待者超时的时间点大致重合
+            waiter = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0.01)
+            await pool.release(held.pop())
+            try:
+                held.append(await waiter)
+            except db.PoolTimeoutError:
+                held.append(await pool.acquire())
+        for conn in held:
+            await pool.release(conn)
+        return await asyncio.wait_for(asyncio.gather(pool.acquire(), pool.acquire()), 1)
+    assert len(asyncio.run(run())) == 2
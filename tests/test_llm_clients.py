@@ -0,0 +1,50 @@
+import asyncio
+
+from llm_clients import ProviderClientRegistry
+
+DEFAULTS = {
+    "max_connections": 10, "max_keepalive_connections": 5, "keepalive_expiry": 60, "connect_timeout": 5,
+    "read_timeout": 60, "write_timeout": 10, "pool_timeout": 10, "http2": True,
+}
+
+
+def provider(**fields):
+    return {"base_url": "http://upstream/v1", **fields}
+
+
+def test_null_fields_use_defaults():
+    registry = ProviderClientRegistry(DEFAULTS)
+    settings = registry.settings_for(provider(http2=None, max_connections=3))
+    assert settings["http2"] is True
+    assert settings["max_connections"] == 3
+    assert registry.settings_for(provider(http2=0))["http2"] is False
+
+
+def test_client_does_not_rebuild_from_a_stale_route():
+    async def run():
+        registry = ProviderClientRegistry(DEFAULTS)
+        registry.sync({1: provider(read_timeout=30)})
+        synced = registry._entries[1].client
+        # 持有旧路由（不同设置）的请求仍使用当前的客户端
+        async with registry.client(1, provider(read_timeout=10)) as client:
+            same = client is synced
+        async with registry.client(1, provider(read_timeout=30)) as client:
+            still_same = client is synced
+        await registry.close()
+        return same, still_same
+    assert asyncio.run(run()) == (True, True)
+
+
+def test_sync_replaces_client_after_in_flight_requests():
+    async def run():
+        registry = ProviderClientRegistry(DEFAULTS)
+        registry.sync({1: provider()})
+        async with registry.client(1, provider()) as old:
+            registry.sync({1: provider(read_timeout=10)})
+            open_during_request = not old.is_closed
+        await asyncio.sleep(0)
+        replaced = registry._entries[1].client is not old
+        registry.sync({})
+        await asyncio.sleep(0)
+        return open_during_request, old.is_closed, replaced, registry.stats()
+    assert asyncio.run(run()) == (True, True, True, {})
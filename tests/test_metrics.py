@@ -0,0 +1,13 @@
+from metrics import statement_label
+
+
+def test_in_lists_share_one_label():
+    one = statement_label("SELECT id FROM chat_sessions WHERE id IN (%s) AND archived = 0")
+    many = statement_label("SELECT id FROM chat_sessions WHERE id in (%s, %s,%s)\n  AND archived = 0")
+    assert one == many == "SELECT id FROM chat_sessions WHERE id IN (...) AND archived = 0"
+
+
+def test_other_placeholders_are_kept():
+    query = "INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = COALESCE(b, %s)"
+    assert statement_label(query) == query
+    assert len(statement_label("SELECT " + "a, " * 100 + "b FROM t")) == 120
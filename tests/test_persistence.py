@@ -0,0 +1,98 @@
+import asyncio
+
+from pymysql.err import IntegrityError, OperationalError
+
+from persistence import PersistenceQueue
+
+
+class FakePool:
+    # 模拟一个会话 s1（主键 1）；多行插入消息时违反约束，逐条插入时内容为 fail_content 的那条连接出错。
+    # 提交后的消息内容记录在 messages 中
+    def __init__(self, fail_content=None):
+        self.fail_content = fail_content
+        self.messages = []
+
+    def connection(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.inserted = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    async def commit(self):
+        self.pool.messages.extend(self.inserted)
+        self.inserted = []
+
+    async def rollback(self):
+        self.inserted = []
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, sql, args):
+        pass
+
+    async def fetchall(self):
+        return [("s1", 1, 0)]
+
+    async def executemany(self, sql, rows):
+        if not sql.startswith("INSERT INTO ai_chat_messages"):
+            return
+        if len(rows) > 1:
+            raise IntegrityError(1062, "重复的消息")
+        if rows[0][3] == self.conn.pool.fail_content:
+            raise OperationalError(2013, "连接中断")
+        self.conn.inserted.append(rows[0][3])
+
+
+def test_failure_during_per_item_write_keeps_only_unwritten_items():
+    async def run():
+        pool = FakePool(fail_content="b")
+        queue = PersistenceQueue(pool)
+        queue._pending = [("message", "s1", 1, "user", content, 1, None, None, False) for content in "abc"]
+        await queue.flush()
+        after_failure = list(pool.messages), [item[4] for item in queue._pending]
+        pool.fail_content = None
+        await queue.flush()
+        return after_failure, pool.messages, queue.stats()
+    (written, pending), messages, stats = asyncio.run(run())
+    # 第一条已提交并移出队列，失败的第二条和未写的第三条留待重试
+    assert written == ["a"]
+    assert pending == ["b", "c"]
+    assert messages == ["a", "b", "c"]
+    assert stats["pending"] == 0
+    assert stats["flushed_items"] == 3
+    assert stats["dropped_items"] == 0
+
+
+def test_per_item_failures_drop_remaining_after_max_retries():
+    async def run():
+        pool = FakePool(fail_content="b")
+        queue = PersistenceQueue(pool, max_retries=1)
+        queue._pending = [("message", "s1", 1, "user", content, 1, None, None, False) for content in "abc"]
+        await queue.flush()
+        return pool.messages, queue.stats()
+    messages, stats = asyncio.run(run())
+    assert messages == ["a"]
+    assert stats["pending"] == 0
+    assert stats["flushed_items"] == 1
+    assert stats["dropped_items"] == 2
@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from quota import QuotaTracker, QuotaExceeded
+
+
+def test_user_rpm_limit():
+    async def run():
+        tracker = QuotaTracker(user_rpm=2)
+        await tracker.acquire(1, "m1")
+        await tracker.acquire(1, "m2")
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m1")
+        # 其他用户不受影响
+        await tracker.acquire(2, "m1")
+        return tracker.stats()
+    assert asyncio.run(run())["rejected"] == 1
+
+
+def test_model_rpm_limit_is_per_model():
+    async def run():
+        tracker = QuotaTracker()
+        await tracker.acquire(1, "m1", rpm=1)
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m1", rpm=1)
+        await tracker.acquire(1, "m2", rpm=1)
+    asyncio.run(run())
+
+
+def test_rejected_request_is_not_counted():
+    async def run():
+        tracker = QuotaTracker(user_rpm=2)
+        await tracker.acquire(1, "m1", rpm=1)
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m1", rpm=1)
+        # 被模型限制拒绝的请求不占用户的名额
+        await tracker.acquire(1, "m2")
+    asyncio.run(run())
+
+
+def test_daily_tokens():
+    async def run():
+        tracker = QuotaTracker(user_daily_tokens=100)
+        await tracker.acquire(1, "m1", daily_tokens=50)
+        await tracker.add_tokens(1, "m1", 50)
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m1", daily_tokens=50)
+        await tracker.acquire(1, "m2")
+        await tracker.add_tokens(1, "m2", 50)
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m2")
+        return tracker.stats()
+    stats = asyncio.run(run())
+    assert (stats["users_today"], stats["rejected"]) == (1, 2)
+
+
+def test_release_returns_the_request():
+    async def run():
+        tracker = QuotaTracker(user_rpm=1)
+        minute = await tracker.acquire(1, "m1", rpm=1)
+        await tracker.release(1, "m1", minute)
+        await tracker.release(1, "m1", minute)
+        await tracker.acquire(1, "m1", rpm=1)
+        # 上一分钟的请求不会从当前分钟的计数中退回
+        await tracker.release(1, "m1", minute - 1)
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m1", rpm=1)
+    asyncio.run(run())
+
+
+class FakePool:
+    # DB_CLOCK_SQL 返回 (数据库日期, 时区偏移)，TODAY_USAGE_SQL 返回 rows
+    def __init__(self, day, offset, rows):
+        self.results = [(day, offset), rows]
+
+    def connection(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self):
+        return self
+
+    async def execute(self, sql):
+        self.result = self.pool.results.pop(0)
+
+    async def fetchone(self):
+        return self.result
+
+    async def fetchall(self):
+        return self.result
+
+
+def test_start_restores_by_the_database_day():
+    # 数据库时区比 UTC 早 14 小时，日期按数据库的时区换算
+    offset = -14 * 3600
+    db_day = (datetime.now(timezone.utc) + timedelta(seconds=offset)).date()
+
+    async def run():
+        tracker = QuotaTracker(FakePool(db_day, offset, [(1, "m1", 100)]))
+        await tracker.start()
+        with pytest.raises(QuotaExceeded):
+            await tracker.acquire(1, "m1", daily_tokens=100)
+        return tracker._day
+    assert asyncio.run(run()) == db_day.isoformat()
+
+
+def test_start_skips_rows_from_the_previous_database_day():
+    async def run():
+        yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).date()
+        tracker = QuotaTracker(FakePool(yesterday, 0, [(1, "m1", 100)]))
+        await tracker.start()
+        await tracker.acquire(1, "m1", daily_tokens=100)
+    asyncio.run(run())
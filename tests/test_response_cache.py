@@ -0,0 +1,54 @@
+import asyncio
+
+from response_cache import ResponseCache, response_key
+
+
+def test_response_key_ignores_whitespace_and_stream_flag():
+    hello = {"model": "m1", "stream": True, "messages": [{"role": "user", "content": "你好"}]}
+    padded = {"model": "m1", "stream": True, "messages": [{"role": "user", "content": " 你好\r\n"}]}
+    assert response_key(padded) == response_key({**hello, "stream": False})
+    assert response_key(hello) != response_key({**hello, "temperature": 0.5})
+    split = {"model": "m1", "stream": True, "messages": [{"role": "user", "content": "a"}, {"role": "user", "content": "b"}]}
+    joined = {"model": "m1", "stream": True, "messages": [{"role": "user", "content": "ab"}]}
+    assert response_key(split) != response_key(joined)
+
+
+def test_get_put_and_stats():
+    async def run():
+        cache = ResponseCache()
+        missing = await cache.get("k")
+        await cache.put("k", "回复")
+        return missing, await cache.get("k"), cache.stats()
+    missing, hit, stats = asyncio.run(run())
+    assert missing is None and hit == "回复"
+    assert (stats["entries"], stats["bytes"], stats["hits"], stats["misses"]) == (1, 6, 1, 1)
+
+
+def test_evicts_least_recently_used():
+    async def run():
+        cache = ResponseCache(max_entries=2)
+        await cache.put("a", "1")
+        await cache.put("b", "2")
+        await cache.get("a")
+        await cache.put("c", "3")
+        return [await cache.get(key) for key in "abc"]
+    assert asyncio.run(run()) == ["1", None, "3"]
+
+
+def test_limits_total_and_entry_bytes():
+    async def run():
+        cache = ResponseCache(max_bytes=10, max_entry_bytes=6)
+        await cache.put("big", "x" * 7)
+        await cache.put("a", "x" * 6)
+        await cache.put("b", "x" * 6)
+        await cache.put("b", "y" * 2)
+        return [await cache.get(key) for key in ("big", "a", "b")], cache.stats()["bytes"]
+    assert asyncio.run(run()) == ([None, None, "yy"], 2)
+
+
+def test_expired_entries_miss():
+    async def run():
+        cache = ResponseCache(ttl=-1)
+        await cache.put("k", "v")
+        return await cache.get("k"), cache.stats()["entries"]
+    assert asyncio.run(run()) == (None, 0)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from resumable import ResumableStreams, StreamNotFound, StreamExpired, produce, relay
+
+
+def test_read_and_resume_after_sequence():
+    async def run():
+        streams = ResumableStreams(grace=0)
+        stream_id = await streams.create(1)
+        for frame in ("a", "b", "c"):
+            await streams.publish(stream_id, frame)
+        await streams.finish(stream_id)
+        await streams.open(stream_id, 1, 1)
+        first = [item async for item in streams.read(stream_id, 0)]
+        resumed = [item async for item in streams.read(stream_id, 1)]
+        return first, resumed, streams.stats()["resumed"]
+    assert asyncio.run(run()) == ([(1, "a"), (2, "b"), (3, "c")], [(2, "b"), (3, "c")], 1)
+
+
+def test_open_checks_owner_and_buffer():
+    async def run():
+        streams = ResumableStreams(max_frames=2)
+        stream_id = await streams.create(1)
+        for frame in ("a", "b", "c"):
+            await streams.publish(stream_id, frame)
+        with pytest.raises(StreamNotFound):
+            await streams.open(stream_id, 2, 3)
+        with pytest.raises(StreamNotFound):
+            await streams.open("missing", 1, 0)
+        # 第 1 帧已被覆盖
+        with pytest.raises(StreamExpired):
+            await streams.open(stream_id, 1, 0)
+        await streams.open(stream_id, 1, 1)
+    asyncio.run(run())
+
+
+def test_reader_follows_live_frames_and_times_out():
+    async def run():
+        streams = ResumableStreams()
+        stream_id = await streams.create(1)
+
+        async def write():
+            await asyncio.sleep(0.05)
+            await streams.publish(stream_id, "a")
+            await streams.finish(stream_id)
+        writer = asyncio.create_task(write())
+        items = [item async for item in streams.read(stream_id, 0, 0.01)]
+        await writer
+        return items
+    items = asyncio.run(run())
+    assert (None, None) in items
+    assert [item for item in items if item[0] is not None] == [(1, "a")]
+
+
+def test_idle_after_readers_leave():
+    async def run():
+        streams = ResumableStreams(idle_timeout=0)
+        stream_id = await streams.create(1)
+        await streams.publish(stream_id, "a")
+        reader = streams.read(stream_id, 0)
+        await reader.__anext__()
+        busy = await streams.idle(stream_id)
+        await reader.aclose()
+        return busy, await streams.idle(stream_id)
+    assert asyncio.run(run()) == (False, True)
+
+
+def test_produce_and_relay():
+    class Request:
+        async def is_disconnected(self):
+            return False
+
+    async def frames():
+        yield "data: 1\n\n"
+        yield "data: 2\n\n"
+        # raw 模式下一帧可能包含多个事件
+        yield "data: 3a\n\ndata: 3b\n\n"
+
+    async def run():
+        streams = ResumableStreams()
+        stream_id = await streams.create(1)
+        await produce(streams, stream_id, frames())
+        return [chunk async for chunk in relay(streams, stream_id, 1, Request())]
+    # id 放在帧的最后一个事件中
+    assert asyncio.run(run()) == ["id: 2\ndata: 2\n\n", "data: 3a\n\nid: 3\ndata: 3b\n\n"]
@@ -0,0 +1,116 @@
+import asyncio
+
+from routing import RoutingTable, PROVIDER_FIELDS
+
+
+def route_row(model_id, provider_id=1):
+    return (model_id, model_id.upper(), 4096, None, 0, 0, 1, None, None, provider_id, f"p{provider_id}", "key",
+            "http://upstream/v1") + (None,) * len(PROVIDER_FIELDS)
+
+
+class FakePool:
+    # 只支持 ROUTING_SQL，每次查询稍作等待，便于制造并发
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def connection(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self):
+        return FakeConnection(self.pool)
+
+    async def execute(self, sql, args=None):
+        self.pool.queries += 1
+        await asyncio.sleep(0.01)
+
+    async def fetchall(self):
+        return list(self.pool.rows)
+
+
+def test_routes_grouped_by_model():
+    async def run():
+        table = RoutingTable(FakePool([route_row("m1", 1), route_row("m1", 2), route_row("m2", 1)]))
+        routes = await table.get_routes("m1")
+        return [route["provider_id"] for route in routes], table.catalog["models"], sorted(table.providers)
+    assert asyncio.run(run()) == ([1, 2], ["m1", "m2"], [1, 2])
+
+
+def test_concurrent_misses_share_one_reload():
+    async def run():
+        pool = FakePool([route_row("m1")])
+        table = RoutingTable(pool, miss_reload_interval=0)
+        results = await asyncio.gather(*(table.get_routes("unknown") for _ in range(20)))
+        initial_and_miss = pool.queries
+        # 重新加载后出现的模型
+        pool.rows.append(route_row("new"))
+        await asyncio.sleep(0.001)
+        routes = await table.get_routes("new")
+        return results, initial_and_miss, [route["model_id"] for route in routes], pool.queries
+    results, initial_and_miss, routes, queries = asyncio.run(run())
+    assert results == [None] * 20
+    assert initial_and_miss == 2
+    assert routes == ["new"]
+    assert queries == 3
+
+
+def test_miss_reload_is_rate_limited():
+    async def run():
+        pool = FakePool([route_row("m1")])
+        table = RoutingTable(pool, miss_reload_interval=60)
+        for _ in range(5):
+            await table.get_routes("unknown")
+        return pool.queries
+    assert asyncio.run(run()) == 1
+
+
+class FakePubSub:
+    # 先收到一条其他进程的通知，之后连接中断
+    def __init__(self, redis):
+        self.redis = redis
+        self.closed = False
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        yield {"type": "subscribe", "data": 1}
+        yield {"type": "message", "data": '{"origin": "other", "version": 2}'}
+        raise ConnectionError("连接已断开")
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeRedis:
+    def __init__(self):
+        self.pubsubs = []
+
+    def pubsub(self):
+        self.pubsubs.append(FakePubSub(self))
+        return self.pubsubs[-1]
+
+
+def test_notification_reloads_and_reconnect_closes_old_pubsub():
+    async def run():
+        pool = FakePool([route_row("m1")])
+        table = RoutingTable(pool)
+        redis = FakeRedis()
+        await table.start(redis)
+        await asyncio.sleep(0.05)
+        await table.stop()
+        return pool.queries, [pubsub.closed for pubsub in redis.pubsubs]
+    queries, closed = asyncio.run(run())
+    assert queries == 2
+    assert closed == [True]
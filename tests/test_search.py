@@ -0,0 +1,35 @@
+import pytest
+
+from search import search_terms, boolean_query, encode_search_cursor, decode_search_cursor, highlight
+
+
+def test_search_terms():
+    assert search_terms('数据库  "索引" a 数据库 Index index') == ["数据库", "索引", "Index"]
+    assert search_terms("a b", min_length=1) == ["a", "b"]
+
+
+def test_boolean_query_requires_every_phrase():
+    assert boolean_query(["数据库", "索引"]) == '+"数据库" +"索引"'
+
+
+def test_search_cursor_round_trip():
+    assert decode_search_cursor(encode_search_cursor(123456, 789)) == (123456, 789)
+
+
+@pytest.mark.parametrize("value", ["", "abc", "!!!", encode_search_cursor("x", 1)])
+def test_search_cursor_rejects_malformed(value):
+    with pytest.raises(ValueError):
+        decode_search_cursor(value)
+
+
+def test_highlight_marks_terms_and_escapes_html():
+    snippet = highlight("<b>MySQL</b> 的索引", ["mysql", "索引"])
+    assert snippet == "&lt;b&gt;<mark>MySQL</mark>&lt;/b&gt; 的<mark>索引</mark>"
+
+
+def test_highlight_windows_long_content_around_first_match():
+    content = "x" * 100 + "命中" + "y" * 100
+    snippet = highlight(content, ["命中"], length=40)
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "<mark>命中</mark>" in snippet
+    assert len(snippet.replace("<mark>", "").replace("</mark>", "")) == 42
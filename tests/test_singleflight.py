@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_subscribers_share_one_upstream():
+    gate = asyncio.Event()
+
+    async def upstream():
+        await gate.wait()
+        yield "a"
+        yield "b"
+
+    async def run():
+        flights = SingleFlight()
+        finished = []
+        first = flights.start("k", upstream(), on_finish=lambda: finished.append(True))
+        joined = flights.get("k")
+        gate.set()
+        results = [[item async for item in first], [item async for item in joined]]
+        return results, finished, flights.get("k"), flights.stats()
+    results, finished, after, stats = asyncio.run(run())
+    assert results == [["a", "b"], ["a", "b"]]
+    assert finished == [True]
+    assert after is None
+    assert (stats["started"], stats["joined"], stats["in_flight"]) == (1, 1, 0)
+
+
+def test_late_subscriber_reads_from_the_start():
+    async def run():
+        flights = SingleFlight()
+        queue = asyncio.Queue()
+
+        async def upstream():
+            while (item := await queue.get()) is not None:
+                yield item
+        first = flights.start("k", upstream())
+        queue.put_nowait("a")
+        queue.put_nowait("b")
+        head = [await first.__anext__(), await first.__anext__()]
+        late = flights.get("k")
+        queue.put_nowait("c")
+        queue.put_nowait(None)
+        return head, [item async for item in late], [item async for item in first]
+    assert asyncio.run(run()) == (["a", "b"], ["a", "b", "c"], ["c"])
+
+
+def test_upstream_error_reaches_every_subscriber():
+    async def upstream():
+        yield "a"
+        raise RuntimeError("boom")
+
+    async def run():
+        flights = SingleFlight()
+        items = []
+        with pytest.raises(RuntimeError):
+            async for item in flights.start("k", upstream()):
+                items.append(item)
+        return items
+    assert asyncio.run(run()) == ["a"]
+
+
+def test_upstream_cancelled_when_all_subscribers_leave():
+    closed = []
+
+    async def upstream():
+        try:
+            await asyncio.Event().wait()
+            yield "a"
+        finally:
+            closed.append(True)
+
+    async def run():
+        flights = SingleFlight()
+        finished = []
+        first = flights.start("k", upstream(), on_finish=lambda: finished.append(True))
+        readers = [asyncio.ensure_future(subscription.__anext__()) for subscription in (first, flights.get("k"))]
+        await asyncio.sleep(0)
+        readers[0].cancel()
+        await asyncio.sleep(0)
+        cancelled_with_one_left = bool(closed)
+        readers[1].cancel()
+        await asyncio.sleep(0.01)
+        return cancelled_with_one_left, finished, flights.get("k")
+    assert asyncio.run(run()) == (False, [True], None)
+    assert closed == [True]
+
+
+def test_joiner_counts_before_first_read():
+    async def run():
+        flights = SingleFlight()
+        queue = asyncio.Queue()
+
+        async def upstream():
+            while (item := await queue.get()) is not None:
+                yield item
+        first = flights.start("k", upstream())
+        # 加入后还没开始读取时发起者离开，上游请求不能被取消
+        late = flights.get("k")
+        subscribers = flights.stats()["subscribers"]
+        await first.aclose()
+        await first.aclose()
+        queue.put_nowait("a")
+        queue.put_nowait(None)
+        items = [item async for item in late]
+        return subscribers, items, flights.stats()["subscribers"]
+    assert asyncio.run(run()) == (2, ["a"], 0)
+
+
+def test_closing_last_unread_subscription_cancels_upstream():
+    async def upstream():
+        await asyncio.Event().wait()
+        yield "a"
+
+    async def run():
+        flights = SingleFlight()
+        finished = []
+        subscription = flights.start("k", upstream(), on_finish=lambda: finished.append(True))
+        await subscription.aclose()
+        await asyncio.sleep(0.01)
+        return finished, flights.get("k")
+    assert asyncio.run(run()) == ([True], None)
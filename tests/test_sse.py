@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+
+from sse import delta_content, frame_usage, content_frame, coalesce, TokenUsage
+
+
+def test_delta_content_fast_path():
+    assert delta_content('{"choices":[{"index":0,"delta":{"content":"你好"}}]}') == "你好"
+    assert delta_content('{"choices":[{"delta":{"content":"a\\n\\"b\\u4e2d"}}]}') == 'a\n"b中'
+
+
+def test_delta_content_falls_back_to_full_parse():
+    assert delta_content('{"choices": [{"delta": {"content": "hi"}}]}') == "hi"
+    assert delta_content('{"choices":[{"delta":{"content":"x"}}],"content":"y"}') == "x"
+
+
+def test_delta_content_without_content():
+    assert delta_content('{"choices":[{"index":0,"delta":{"role":"assistant"}}]}') is None
+    assert delta_content('{"choices":[]}') is None
+    assert delta_content("[1, 2]") is None
+    with pytest.raises(ValueError):
+        delta_content("not json")
+
+
+def test_frame_usage():
+    assert frame_usage('{"choices":[{"index":0,"delta":{"content":"x"}}]}') is None
+    assert frame_usage('{"choices":[],"usage":{"prompt_tokens":3,"completion_tokens":4}}') == TokenUsage(3, 4)
+    assert frame_usage('{"choices":[],"usage":null}') is None
+    assert frame_usage('{"usage":{"prompt_tokens":"3","completion_tokens":4}}') is None
+
+
+@pytest.mark.parametrize("content", ["", "plain", 'quote " and \\ slash', "中文\n换行", " "])
+def test_content_frame_matches_json_dumps(content):
+    assert content_frame(content) == f"data: {json.dumps({'content': content})}\n\n"
+
+
+def test_coalesce_sends_first_fragment_then_merges():
+    async def upstream():
+        for fragment in ("a", "b", "c"):
+            yield fragment
+
+    async def run():
+        return [chunk async for chunk in coalesce(upstream(), flush_bytes=100, flush_interval=0.05)]
+    assert asyncio.run(run()) == ["a", "bc"]
+
+
+def test_coalesce_flushes_by_size():
+    async def upstream():
+        for fragment in ("ab", "cd", "ef"):
+            yield fragment
+
+    async def run():
+        return [chunk async for chunk in coalesce(upstream(), flush_bytes=2, flush_interval=1)]
+    assert asyncio.run(run()) == ["ab", "cd", "ef"]
+
+
+def test_coalesce_flushes_on_interval_when_upstream_stalls():
+    async def upstream():
+        for fragment in ("a", "b", "c"):
+            yield fragment
+            await asyncio.sleep(0.1)
+
+    async def run():
+        return [chunk async for chunk in coalesce(upstream(), flush_bytes=100, flush_interval=0.01)]
+    assert asyncio.run(run()) == ["a", "b", "c"]
+
+
+def test_coalesce_without_interval_passes_through():
+    async def upstream():
+        yield "a"
+        yield "b"
+
+    async def run():
+        return [chunk async for chunk in coalesce(upstream(), flush_bytes=100, flush_interval=0)]
+    assert asyncio.run(run()) == ["a", "b"]
+
+
+def test_coalesce_sends_buffered_content_before_error():
+    async def upstream():
+        for fragment in ("a", "b", "c"):
+            yield fragment
+        raise RuntimeError("boom")
+
+    async def run():
+        result = []
+        with pytest.raises(RuntimeError):
+            async for chunk in coalesce(upstream(), 100, 1):
+                result.append(chunk)
+        return result
+    assert asyncio.run(run()) == ["a", "bc"]
+
+
+def test_coalesce_stop_closes_upstream():
+    closed = []
+
+    async def upstream():
+        try:
+            yield "a"
+            await asyncio.sleep(0.01)
+            yield "b"
+            # 模拟一直没有结束的上游
+            await asyncio.sleep(10)
+        finally:
+            closed.append(True)
+
+    async def run():
+        stop = asyncio.Event()
+        result = []
+        async for chunk in coalesce(upstream(), 100, 0.01, stop):
+            result.append(chunk)
+            stop.set()
+        await asyncio.sleep(0)
+        return result
+    assert asyncio.run(run()) == ["a"]
+    assert closed == [True]
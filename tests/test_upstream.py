@@ -0,0 +1,84 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from admission import AdmissionController
+from upstream import UpstreamError, UpstreamRouter
+
+
+class FakeResponse:
+    def __init__(self, lines):
+        self.status_code = 200
+        self.lines = lines
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            yield line
+
+
+class FakeClients:
+    # 按服务商ID返回预设的数据行；calls 记录实际请求过的服务商
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+        self.on_call = {}
+
+    @asynccontextmanager
+    async def client(self, provider_id, provider):
+        self.calls.append(provider_id)
+        if provider_id in self.on_call:
+            self.on_call[provider_id]()
+        yield self
+
+    def stream(self, method, url, headers, json):
+        return FakeResponse(self.replies[self.calls[-1]])
+
+
+def test_empty_stream_fails_over():
+    clients = FakeClients({1: ["data: [DONE]"], 2: ['data: {"choices": [{"delta": {"content": "hi"}}]}', "data: [DONE]"]})
+    admission = AdmissionController({"max_concurrency": 1, "max_queue": 1, "max_queue_per_user": 1})
+    router = UpstreamRouter(clients, admission)
+    routes = [{"provider_id": i, "provider": {}, "provider_name": f"p{i}", "model_id": "m"} for i in (1, 2)]
+
+    async def run():
+        ticket = admission.try_acquire(1, {}, 1)
+        return [text async for _, text in router.stream(routes, ticket, lambda r: ("/chat", {}, {}), 1)]
+    assert asyncio.run(run()) == ["hi"]
+    assert clients.calls == [1, 2]
+    assert router.stats()[1]["error_rate"] > 0
+
+
+def test_empty_stream_from_last_provider_raises():
+    clients = FakeClients({1: []})
+    admission = AdmissionController({"max_concurrency": 1, "max_queue": 1, "max_queue_per_user": 1})
+    router = UpstreamRouter(clients, admission)
+    routes = [{"provider_id": 1, "provider": {}, "provider_name": "p1", "model_id": "m"}]
+
+    async def run():
+        ticket = admission.try_acquire(1, {}, 1)
+        return [item async for item in router.stream(routes, ticket, lambda r: ("/chat", {}, {}), 1)]
+    with pytest.raises(UpstreamError):
+        asyncio.run(run())
+
+
+def test_saturated_provider_is_skipped_not_dropped():
+    clients = FakeClients({1: [], 2: ['data: {"choices": [{"delta": {"content": "ok"}}]}', "data: [DONE]"], 3: []})
+    admission = AdmissionController({"max_concurrency": 1, "max_queue": 1, "max_queue_per_user": 1})
+    router = UpstreamRouter(clients, admission)
+    routes = [{"provider_id": i, "provider": {}, "provider_name": f"p{i}", "model_id": "m"} for i in (1, 2, 3)]
+    # 首选失败时服务商 2 已满，跳过它请求 3；3 开始请求时 2 空闲下来，3 失败后仍会尝试 2
+    holder = admission.try_acquire(2, {}, 0)
+    clients.on_call = {3: holder.release}
+
+    async def run():
+        ticket = admission.try_acquire(1, {}, 1)
+        return [text async for _, text in router.stream(routes, ticket, lambda r: ("/chat", {}, {}), 1)]
+    assert asyncio.run(run()) == ["ok"]
+    assert clients.calls == [1, 3, 2]
@@ -0,0 +1,22 @@
+from sse import TokenUsage
+from usage import user_counts, daily_usage
+
+
+def test_user_counts_sorted_by_user():
+    messages = [(2, "user"), (1, "assistant"), (2, "assistant"), (1, "user"), (2, "user")]
+    assert user_counts(messages) == [(2, 1, 1), (3, 2, 2)]
+
+
+def test_user_counts_negative_for_delete():
+    assert user_counts([(1, "user"), (1, "assistant")], sign=-1) == [(-2, -1, 1)]
+
+
+def test_daily_usage_sums_tokens_per_user_and_model():
+    messages = [
+        (1, "m1", "user", None),
+        (1, "m1", "assistant", TokenUsage(10, 5)),
+        (1, "m2", "user", None),
+        (1, "m1", "user", None),
+        (1, "m1", "assistant", TokenUsage(20, 1)),
+    ]
+    assert daily_usage(messages) == [(1, "m1", 4, 2, 36), (1, "m2", 1, 1, 0)]
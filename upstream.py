@@ -0,0 +1,249 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from sse import delta_content, frame_usage
+from metrics import UPSTREAM_TTFT, UPSTREAM_TOKENS_PER_SECOND, UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    # 服务商返回了非 200 状态码
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class _Health:
+    __slots__ = ("ttft", "error_rate", "samples", "open_until")
+
+    def __init__(self):
+        self.ttft = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.open_until = 0.0
+
+
+class UpstreamRouter:
+    # 同一 model_id 可以由多个服务商提供。按各服务商近期的首 token 延迟和错误率（均为指数移动平均）排序，
+    # 错误率过高的服务商暂停使用 cooldown 秒；输出首个 token 之前失败时自动切换到下一个服务商。
+    # 模型配置了对冲延迟时，首个服务商超过该时间仍未返回首个 token 就同时请求下一个，先返回的胜出。
+    def __init__(self, clients, admission, alpha=0.2, error_threshold=0.5, min_samples=5, cooldown=30):
+        self.clients = clients
+        self.admission = admission
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._health = {}
+
+    def _get(self, provider_id):
+        health = self._health.get(provider_id)
+        if health is None:
+            health = self._health[provider_id] = _Health()
+        return health
+
+    def record_ttft(self, provider_id, seconds):
+        health = self._get(provider_id)
+        health.ttft = seconds if health.ttft is None else health.ttft + self.alpha * (seconds - health.ttft)
+        health.error_rate -= self.alpha * health.error_rate
+        health.samples += 1
+
+    def record_error(self, provider_id):
+        health = self._get(provider_id)
+        health.error_rate += self.alpha * (1 - health.error_rate)
+        health.samples += 1
+        if health.samples >= self.min_samples and health.error_rate >= self.error_threshold:
+            health.open_until = time.monotonic() + self.cooldown
+
+    def rank(self, routes):
+        # routes 已按管理端的排序权重排列。健康的服务商按首 token 延迟从快到慢，
+        # 还没有数据的视为最快（以便尽快获得数据），延迟相同时保持原有顺序；暂停中的排在最后作为兜底
+        now = time.monotonic()
+        healthy = []
+        paused = []
+        for route in routes:
+            health = self._health.get(route["provider_id"])
+            (paused if health is not None and health.open_until > now else healthy).append(route)
+        healthy.sort(key=self._ttft)
+        return healthy + paused
+
+    def _ttft(self, route):
+        health = self._health.get(route["provider_id"])
+        return health.ttft or 0 if health is not None else 0
+
+    async def _attempt(self, index, route, ticket, build_request, events):
+        started = time.monotonic()
+        try:
+            url, headers, body = build_request(route)
+            async with self.clients.client(route["provider_id"], route["provider"]) as client:
+                async with client.stream("POST", url, headers=headers, json=body) as response:
+                    if response.status_code != 200:
+                        detail = (await response.aread())[:200].decode(errors="replace")
+                        raise UpstreamError(
+                            f"{route['provider_name']} 返回 {response.status_code}: {detail}", response.status_code
+                        )
+                    first_at, fragments, usage = await self._read(index, route, response, started, events)
+            self._record_speed(route, first_at, fragments)
+            if usage is not None:
+                # 服务商返回的用量作为最后一项产出
+                events.put_nowait((index, "content", usage))
+            events.put_nowait((index, "end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record_failure(route, e)
+            events.put_nowait((index, "error", e))
+        finally:
+            ticket.release()
+
+    async def _read(self, index, route, response, started, events):
+        # 逐行读取回复并放入 events，返回 (首个片段的时间, 片段数, 用量)
+        first_at = None
+        fragments = 0
+        usage = None
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            content, parsed = _parse(data)
+            if parsed is not None:
+                usage = (line, parsed)
+            if not content:
+                continue
+            fragments += 1
+            if first_at is None:
+                first_at = time.monotonic()
+                self.record_ttft(route["provider_id"], first_at - started)
+                UPSTREAM_TTFT.observe(route["model_id"], route["provider_name"], value=first_at - started)
+            events.put_nowait((index, "content", (line, content)))
+        return first_at, fragments, usage
+
+    def _record_speed(self, route, first_at, fragments):
+        if first_at is None:
+            # 没有输出任何内容就结束，按失败处理以便切换到下一个服务商，避免保存和缓存空回复
+            raise UpstreamError(f"{route['provider_name']} 没有返回内容")
+        if fragments > 1:
+            # 每个数据帧通常对应一个 token，按首个 token 之后的片段数计算输出速度
+            elapsed = time.monotonic() - first_at
+            if elapsed > 0:
+                UPSTREAM_TOKENS_PER_SECOND.observe(
+                    route["model_id"], route["provider_name"], value=(fragments - 1) / elapsed
+                )
+
+    def _record_failure(self, route, error):
+        # 计入服务商的错误率和按原因分类的错误数
+        self.record_error(route["provider_id"])
+        if isinstance(error, UpstreamError):
+            reason = f"http_{error.status}" if error.status else "empty"
+        else:
+            reason = type(error).__name__
+        UPSTREAM_ERRORS.inc(route["provider_name"], reason)
+
+    async def stream(self, routes, ticket, build_request, user_id, hedge_delay=None):
+        # routes: 候选服务商，第一个已持有准入 ticket；build_request(route) 返回 (url, headers, json)。
+        # 产出胜出服务商的 (原始数据行, 回复片段)，服务商返回了用量时最后一项为 (原始数据行, TokenUsage)；
+        # 已输出内容后再出错不再切换，直接抛出
+        race = _Race(self, routes, build_request, user_id)
+        race.launch(ticket)
+        winner = None
+        try:
+            while True:
+                # 还没有胜出者时，到对冲时间就再请求一个服务商（同时最多两个）
+                hedge = winner is None and hedge_delay and race.pending and len(race.tasks) < 2
+                event = await race.next_event(hedge_delay if hedge else None)
+                if event is None:
+                    race.launch()
+                    continue
+                index, kind, payload = event
+                if winner is not None and index != winner:
+                    continue
+                if kind == "error":
+                    if index == winner:
+                        raise payload
+                    race.failed(index, payload)
+                    continue
+                if winner is None:
+                    # 首个返回内容（或正常结束）的请求胜出，取消其余请求
+                    winner = index
+                    race.cancel(keep=index)
+                if kind == "end":
+                    return
+                yield payload
+        finally:
+            race.cancel()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            provider_id: {
+                "ttft_ms": round(health.ttft * 1000) if health.ttft is not None else None,
+                "error_rate": round(health.error_rate, 3),
+                "samples": health.samples,
+                "paused": health.open_until > now,
+            }
+            for provider_id, health in self._health.items()
+        }
+
+
+class _Race:
+    # 一次 stream 调用中尚未尝试的候选服务商和进行中的请求
+    def __init__(self, router, routes, build_request, user_id):
+        self.router = router
+        self.pending = list(routes)
+        self.build_request = build_request
+        self.user_id = user_id
+        self.tasks = {}
+        self.events = asyncio.Queue()
+        self._counter = itertools.count()
+
+    def launch(self, first_ticket=None):
+        # 启动下一个能立即获得准入的候选，没有可用候选时返回 False；
+        # 已满的服务商暂时跳过、留在候选中，下次对冲或切换时再尝试
+        loop = asyncio.get_running_loop()
+        for position, route in enumerate(self.pending):
+            ticket = first_ticket or self.router.admission.try_acquire(route["provider_id"], route["provider"], self.user_id)
+            first_ticket = None
+            if ticket is None:
+                continue
+            del self.pending[position]
+            index = next(self._counter)
+            self.tasks[index] = loop.create_task(self.router._attempt(index, route, ticket, self.build_request, self.events))
+            return True
+        return False
+
+    async def next_event(self, timeout):
+        # 取下一个 (index, kind, payload)，超过 timeout 秒仍没有时返回 None
+        try:
+            return self.events.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def failed(self, index, error):
+        # 尚无胜出者时某个请求失败：切换到下一个候选，已没有进行中的请求和可用候选时抛出
+        del self.tasks[index]
+        logger.warning("调用服务商失败，尝试下一个: %s", error)
+        if not self.tasks and not self.launch():
+            raise error
+
+    def cancel(self, keep=None):
+        for index, task in self.tasks.items():
+            if index != keep:
+                task.cancel()
+
+
+def _parse(data):
+    # 返回 (回复片段, 用量)，无法解析的数据帧返回 (None, None)
+    try:
+        content = delta_content(data)
+        return content, None if content else frame_usage(data)
+    except ValueError:
+        return None, None
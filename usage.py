@@ -0,0 +1,33 @@
+# 预聚合的用量计数（migrations/010_usage_counters.sql），与消息在同一事务中增量维护：
+# users.message_count / sent_count 为用户的消息总数和发送的消息数，写入消息时增加、删除会话时减少；
+# usage_daily 按 天/用户/模型 累加新产生的消息数和 token 数，删除会话不会减少。
+# 同一批中的多行按主键排序后再更新，多个进程同时写入时加锁顺序一致，避免死锁。
+
+USER_COUNTS_SQL = "UPDATE users SET message_count = message_count + %s, sent_count = sent_count + %s WHERE id = %s"
+
+# 日期取数据库的当前日期，与消息 create_time 的默认值一致
+DAILY_USAGE_SQL = (
+    "INSERT INTO usage_daily (day, user_id, model_id, messages, sent_count, tokens) "
+    "VALUES (CURDATE(), %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE messages = messages + VALUES(messages), sent_count = sent_count + VALUES(sent_count), "
+    "tokens = tokens + VALUES(tokens)"
+)
+
+
+def user_counts(messages, sign=1):
+    # messages: [(user_id, role), ...] -> USER_COUNTS_SQL 的参数；sign=-1 用于删除
+    counts = {}
+    for user_id, role in messages:
+        total, sent = counts.get(user_id, (0, 0))
+        counts[user_id] = (total + 1, sent + (role == "user"))
+    return [(sign * total, sign * sent, user_id) for user_id, (total, sent) in sorted(counts.items())]
+
+
+def daily_usage(messages):
+    # messages: [(user_id, model_id, role, usage), ...] -> DAILY_USAGE_SQL 的参数；
+    # usage 为助手消息的 TokenUsage（本次调用的 prompt + completion），用户消息为 None
+    totals = {}
+    for user_id, model_id, role, usage in messages:
+        count, sent, tokens = totals.get((user_id, model_id), (0, 0, 0))
+        totals[(user_id, model_id)] = (count + 1, sent + (role == "user"), tokens + (sum(usage) if usage else 0))
+    return [(user_id, model_id, *values) for (user_id, model_id), values in sorted(totals.items())]